@@ -584,6 +584,7 @@ config file. To import an area that has been exported to a text file, see
         
         p = self.world.get_player(name)
         if not p:
+            self.world.sync_saves()
             row = self.world.db.select('* from player where name=?', [name])
             if row:
                 p = Player(('foo', 'bar'))
@@ -2364,6 +2364,61 @@ You must be in the same room as an npc to log it.
 command_list.register(Log, ['log'])
 command_help.register(Log.help, ['log'])
 
+class TickStats(BaseCommand):
+    """Show how long each phase of the world's turns has been taking."""
+    required_permissions = ADMIN
+    help = (
+    """<title>TickStats (Command)</title>
+The TickStats command shows how long the world has been taking to run each
+phase of its turns (ticking npcs and players, cleanup, sending output,
+battles and scheduled timers such as area resets), as rolling 50th/95th/99th percentiles and maximums
+in milliseconds. It also shows how much output has been sent to each player's
+connection, and how well it has compressed (for telnet clients using MCCP).
+\nREQUIRED PERMISSIONS: ADMIN
+\nUSAGE:
+To see the current stats:
+  tickstats
+To throw away the stats collected so far and start over:
+  tickstats reset
+    """
+    )
+    def execute(self):
+        if self.args and self.args.strip().lower() == 'reset':
+            self.world.tick_stats.reset()
+            self.pc.update_output('Tick stats have been reset.')
+            return
+        self.pc.update_output(self.world.tick_stats.display())
+        self.pc.update_output(self.connection_stats())
+    
+    def connection_stats(self):
+        table = ' Connections '.center(50, '-') + '\n'
+        table += '%-20s%10s%10s%10s\n' % ('player', 'raw(KB)', 'sent(KB)',
+                                          'ratio')
+        total_raw = total_out = 0
+        for name, player in sorted(self.world.player_list.items()):
+            conn = getattr(player, 'conn', None)
+            if not hasattr(conn, 'compression_ratio'):
+                continue
+            total_raw += conn.bytes_raw
+            total_out += conn.bytes_out
+            table += '%-20s%10.1f%10.1f%10.2f\n' % (name,
+                                                     conn.bytes_raw / 1024.0,
+                                                     conn.bytes_out / 1024.0,
+                                                     conn.compression_ratio())
+        ratio = 1.0
+        if total_out:
+            ratio = float(total_raw) / total_out
+        table += '%-20s%10.1f%10.1f%10.2f\n' % ('total', total_raw / 1024.0,
+                                                 total_out / 1024.0, ratio)
+        table += 'Reaped: %s idle, %s stalled logins\n' % \
+                 (self.world.reaped['idle'], self.world.reaped['login'])
+        table += '-'.center(50, '-')
+        return table
+    
+
+command_list.register(TickStats, ['tickstats'])
+command_help.register(TickStats.help, ['tickstats', 'tick stats'])
+
 
 # **************** Command Specific Exceptions *******************
 class SaleFail(Exception):
@@ -1,88 +1,160 @@
 from shinymud.models.player import Player
 from shinymud.lib.connection_handlers.shiny_connections import *
+from shinymud.lib.reactor import Reactor
+from shinymud.lib.metrics import format_prometheus, rss_bytes
+from shinymud.data.config import METRICS_HOST, HANDSHAKE_TIMEOUT
 
 import threading
 import socket
+import errno
+import json
+import time
 
-class WebsocketHandler(threading.Thread):
+class ConnectionListener(threading.Thread):
+    """The ConnectionListener is a single thread that listens on the ports of
+    all of our connection handlers at once.
     
-    def __init__(self, port, host, world):
+    When one of the handlers' listening sockets has a client waiting, the
+    listener tells that handler to accept it. Handlers pass new players off to
+    the world with world.player_handoff, which just appends them to a queue
+    that the world's main loop drains -- so accepting a flood of new
+    connections never has to wait on the world's player_list_lock.
+    
+    Anything registered with the listener's reactor (handlers, and any
+    clients a handler deals with itself) gets its handle_ready() called when
+    it has something for us, and every handler gets its idle() called at
+    least once a second. An error in one of them gets logged, rather than
+    taking the listener (and every handler with it) down.
+    """
+    
+    def __init__(self, world):
         threading.Thread.__init__(self)
         self.world = world
-        self.host = host
-        self.port = port
         self.daemon = True # So this thread will exit when the main thread does
-        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.listener.bind((host, port))
-        self.world.log.info("WebsocketHandler running on host: %s and port: %s." % (host, port))
+        self.handlers = []
+        self.reactor = Reactor()
+    
+    def add_handler(self, handler):
+        handler.reactor = self.reactor
+        self.handlers.append(handler)
+        if handler.wants_metrics:
+            self.world.publish_metrics = True
     
     def run(self):
-        """Start the connection-handler thread running.
-        This thread will accept connections, create a Player object for the
-        player logging in, and then add that Player object to the world.
-        """
-        
-        self.listener.listen(5)
+        for handler in self.handlers:
+            handler.listen()
+            self.reactor.register(handler, handler)
         self.world.log.debug("Listener started")
         while 1:
-            try:
-                connection = WebsocketConnection( self.listener.accept(), 
-                                                    self.world.log, self.host, self.port)
-            except Exception, e:
-                self.world.log.debug(str(e))
-            else:
-                new_player = Player(connection)
-                self.world.log.info("Websocket: Client logging in from: %s" % str(connection.addr))
-                # new_player.conn.setblocking(0)
-                # The player_add function in the world requires access to the player_list,
-                # which the main thread edits quite a bit -- that's why we need a lock 
-                # before we add a player
-                self.world.player_list_lock.acquire()
-                self.world.player_add(new_player)
-                self.world.player_list_lock.release()
+            for ready, events in self.reactor.poll(1.0):
+                try:
+                    ready.handle_ready()
+                except Exception, e:
+                    self.world.log.error('%s: %s' % (ready.__class__.__name__,
+                                                     str(e)))
+            for handler in self.handlers:
+                try:
+                    handler.idle()
+                except Exception, e:
+                    self.world.log.error('%s: %s' % (handler.__class__.__name__,
+                                                     str(e)))
     
 
 
-class TelnetHandler(threading.Thread):
+class ConnectionHandler(object):
+    """A ConnectionHandler owns a listening socket, and knows what to do with
+    the clients that connect to it. Subclasses should define handle().
+    """
+    # Whether we need the world to publish its metrics (see World.metrics)
+    wants_metrics = False
     
     def __init__(self, port, host, world):
-        threading.Thread.__init__(self)
         self.world = world
-        self.daemon = True # So this thread will exit when the main thread does
+        self.host = host
+        self.port = port
+        self.reactor = None # the ConnectionListener's, once we're added to it
         self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.listener.bind((host, port))
-        self.world.log.info("TelnetHandler running on host: %s and port: %s." % (host, port))
+        self.world.log.info("%s running on host: %s and port: %s." % 
+                            (self.__class__.__name__, host, port))
     
-    def run(self):
-        """Start the connection-handler thread running.
-        This thread will accept connections, create a Player object for the
-        player logging in, and then add that Player object to the world.
-        """
-        
-        self.listener.listen(5)
-        self.world.log.debug("Listener started")
+    def fileno(self):
+        return self.listener.fileno()
+    
+    def listen(self):
+        self.listener.listen(socket.SOMAXCONN)
+        self.listener.setblocking(0)
+    
+    def handle_ready(self):
+        self.accept_all()
+    
+    def idle(self):
+        """Do any housekeeping we need to (called at least once a second)."""
+        pass
+    
+    def accept_all(self):
+        """Accept every client that's waiting on our listening socket."""
         while 1:
             try:
-                connection = TelnetConnection(self.listener.accept(), self.world.log)
-            except Exception, e:
-                self.world.log.debug(str(e))
-            else:
-                new_player = Player(connection)
-                self.world.log.info("Telnet: Client logging in from: %s" % str(connection.addr))
-                # The player_add function in the world requires access to the player_list,
-                # which the main thread edits quite a bit -- that's why we need a lock 
-                # before we add a player
-                self.world.player_list_lock.acquire()
-                self.world.player_add(new_player)
-                self.world.player_list_lock.release()
+                conn_info = self.listener.accept()
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.world.log.debug(str(e))
+                return
+            # Accepted sockets don't always inherit blocking mode from the
+            # listener, so make sure they start out the same everywhere. We
+            # never wait on a client here: any negotiating a connection needs
+            # to do is done later, by the world's main loop.
+            conn_info[0].setblocking(0)
+            self.handle(conn_info)
+    
+    def handle(self, conn_info):
+        """Do something with a newly accepted client.
+        conn_info -- the (socket, address) pair returned by accept()
+        """
+        raise NotImplementedError
     
 
 
-class StatSender(threading.Thread):
-    """StatSender is a stand-alone thread that sends game-statistics to any
-    client that connects on its port.
+class WebsocketHandler(ConnectionHandler):
+    
+    def handle(self, conn_info):
+        """Create a Player object for the player logging in, and hand it off
+        to the world.
+        """
+        try:
+            connection = WebsocketConnection(conn_info, self.world.log, 
+                                             self.host, self.port)
+        except Exception, e:
+            self.world.log.debug(str(e))
+        else:
+            new_player = Player(connection)
+            self.world.log.info("Websocket: Client logging in from: %s" % str(connection.addr))
+            self.world.player_handoff(new_player)
+    
+
+
+class TelnetHandler(ConnectionHandler):
+    
+    def handle(self, conn_info):
+        """Create a Player object for the player logging in, and hand it off
+        to the world.
+        """
+        try:
+            connection = TelnetConnection(conn_info, self.world.log)
+        except Exception, e:
+            self.world.log.debug(str(e))
+        else:
+            new_player = Player(connection)
+            self.world.log.info("Telnet: Client logging in from: %s" % str(connection.addr))
+            self.world.player_handoff(new_player)
+    
+
+
+class StatSender(ConnectionHandler):
+    """StatSender sends game-statistics to any client that connects on its
+    port.
      
     When a client connects to StatSender, StatSender sends back a string
     containing a list of players currently logged in and the date the server was
@@ -100,32 +172,116 @@ class StatSender(threading.Thread):
     the epoch, in UTC (as returned by Python's time.time() function). See the
     time documentation (http://docs.python.org/library/time.html) for details.
     """
+    wants_metrics = True
+    
+    def handle(self, conn_info):
+        try:
+            # Wrap the whole thing in a try block so that if any part of the
+            # request causes an exception to be thrown we can just quietly
+            # ignore it and it won't crash the server.
+            conn, info = conn_info
+            # Send them the game-stats! (From the world's last published
+            # metrics, so we don't touch the player list from this thread)
+            plist = ','.join(self.world.metrics.get('players', []))
+            conn.send(str(self.world.uptime) + ':' + plist)
+            conn.close()
+        except Exception, e:
+            self.world.log.error('StatSender ERROR: ' + str(e))
+    
+
+
+class MetricsHandler(ConnectionHandler):
+    """MetricsHandler is a tiny HTTP server for monitoring the game.
+    
+    GET /metrics returns the game's metrics in the Prometheus text format, and
+    GET /status returns the same things as JSON. Both come from the snapshot
+    the world publishes every METRICS_INTERVAL seconds (see lib/metrics.py),
+    so a scrape never touches live game data. Until the first snapshot's out,
+    we answer 503 Service Unavailable.
+    
+    MetricsHandler only listens on METRICS_HOST (localhost, by default),
+    whatever HOST the rest of the game uses. Requests are read without
+    blocking the listener; a client that hasn't sent its whole request within
+    HANDSHAKE_TIMEOUT seconds gets hung up on.
+    """
+    wants_metrics = True
     
     def __init__(self, port, host, world):
-        threading.Thread.__init__(self)
-        self.daemon = True # So this thread will exit when the main thread does
-        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.listener.bind((host, port))
-        self.world = world
-        self.world.log.info("StatSender running on host: %s and port: %s." % (host, port))
+        ConnectionHandler.__init__(self, port, METRICS_HOST, world)
+        self.requests = []
     
-    def run(self):
-        """Start the StatSender thread running.
-        """
-        self.listener.listen(5)
-        while 1:
-            try:
-                # Wrap the whole thing in a try block so that if any part of the
-                # request causes an exception to be thrown we can just quietly
-                # ignore it and it won't crash the server.
-                conn, info = self.listener.accept()
-                # Send them the game-stats!
-                plist = ','.join([name for name in self.world.player_list if isinstance(name, basestring)])
-                conn.send(str(self.world.uptime) + ':' + plist)
-                conn.close()
-            except Exception, e:
-                self.world.log.error('StatSender ERROR: ' + str(e))
+    def handle(self, conn_info):
+        request = MetricsRequest(self, conn_info[0])
+        self.requests.append(request)
+        self.reactor.register(request, request)
+    
+    def idle(self):
+        now = time.time()
+        for request in self.requests[:]:
+            if now >= request.deadline:
+                request.finish()
+    
+    def respond(self, path):
+        """Return (status, content type, body) for a request for path."""
+        if not self.world.metrics:
+            return ('503 Service Unavailable', 'text/plain',
+                    'The game is still starting up.\n')
+        snapshot = dict(self.world.metrics)
+        snapshot['rss_bytes'] = rss_bytes()
+        if path == '/metrics':
+            return ('200 OK', 'text/plain; version=0.0.4',
+                    format_prometheus(snapshot))
+        elif path == '/status':
+            return ('200 OK', 'application/json', json.dumps(snapshot))
+        return ('404 Not Found', 'text/plain', 'Try /metrics or /status.\n')
     
 
 
+class MetricsRequest(object):
+    """A client of the MetricsHandler, waiting for us to read its request."""
+    
+    def __init__(self, handler, conn):
+        self.handler = handler
+        self.conn = conn
+        self.data = ''
+        self.deadline = time.time() + HANDSHAKE_TIMEOUT
+    
+    def fileno(self):
+        return self.conn.fileno()
+    
+    def handle_ready(self):
+        try:
+            data = self.conn.recv(4096)
+        except socket.error, e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                # (Left registered, a broken socket would be ready forever)
+                self.finish()
+            return
+        self.data += data
+        if not data or len(self.data) > 8192:
+            self.finish()
+        elif '\r\n\r\n' in self.data or '\n\n' in self.data:
+            parts = self.data.split(None, 2)
+            if len(parts) < 2 or parts[0] != 'GET':
+                status, kind, body = ('405 Method Not Allowed', 'text/plain',
+                                      'Only GET is allowed.\n')
+            else:
+                status, kind, body = self.handler.respond(parts[1].split('?')[0])
+            self.finish('HTTP/1.0 %s\r\nContent-Type: %s\r\n'
+                        'Content-Length: %s\r\nConnection: close\r\n\r\n%s' %
+                        (status, kind, len(body), body))
+    
+    def finish(self, response=None):
+        """Send our response (if we have one) and hang up."""
+        self.handler.reactor.unregister(self)
+        self.handler.requests.remove(self)
+        try:
+            if response:
+                # Responses are small enough for the socket's buffer, but
+                # don't let a client that isn't reading hold us up
+                self.conn.settimeout(1.0)
+                self.conn.sendall(response)
+            self.conn.close()
+        except socket.error, e:
+            self.handler.world.log.debug('MetricsRequest: ' + str(e))
+    
@@ -1,15 +1,159 @@
-import re
-import hashlib
+from shinymud.data.config import OUTPUT_HIGH_WATER, MCCP, MCCP_LEVEL, \
+                                 NEGOTIATION_TIMEOUT, HANDSHAKE_TIMEOUT, \
+                                 WEBSOCKET_DEFLATE, KEEPALIVE_IDLE, \
+                                 KEEPALIVE_INTERVAL, KEEPALIVE_COUNT, \
+                                 SEND_GMCP
+
+import time
+import json
+import zlib
+import errno
+import socket
 from struct import pack
 from socket import error as socket_error
+from shinymud.lib.connection_handlers.telnet_parser import TelnetParser, IAC, \
+     WILL, DO, SB, SE, NAWS, LINEMODE, COMPRESS2, GMCP
+from shinymud.lib.connection_handlers.websocket_frames import encode_frame, \
+     accept_key, parse_deflate_offer, MessageDeflater, FrameParser, \
+     ProtocolError, TEXT, PING, PONG, CLOSE, BINARY, NORMAL_CLOSURE
 
 class ShinyConnection(object):
+    """The base class for connections to our players' clients.
+    
+    Output is buffered: send() turns a player's whole output queue into one
+    string of bytes and writes as much of it as the socket will take. Whatever
+    doesn't fit stays in out_buffer until flush() is called again (when the
+    socket is writable). If a client stops reading and its buffer grows past
+    OUTPUT_HIGH_WATER bytes, we give up on it.
+    
+    Before a connection is ready for the game, it may have to negotiate with
+    the client (telnet options, the websocket handshake). That's done without
+    blocking: the world calls negotiate() whenever the client sends something
+    (and once a turn, so deadlines get noticed) until negotiated is True.
+    
+    Subclasses should define format_output() and recv(), and negotiate() if
+    they need to.
+    """
+    negotiated = True
+    # Whether the client wants out-of-band status updates (see send_status)
+    gmcp = False
     
     def __init__(self, conn_info, log):
         self.conn, self.addr = conn_info
         self.log = log
+        # Remember our file descriptor so that we can still be unregistered
+        # from the World's reactor after our socket has been closed
+        self._fileno = self.conn.fileno()
+        self.out_buffer = ''
+        # How many bytes of output we've been given, and how many bytes that
+        # came to once formatted for the client (these differ a lot if the
+        # output is being compressed)
+        self.bytes_raw = 0
+        self.bytes_out = 0
+        try:
+            # We send each turn's output in one go, so there's no point in
+            # letting the kernel hold it back waiting for more
+            self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (socket_error, AttributeError):
+            pass
+        self.set_keepalive()
+    
+    def set_keepalive(self):
+        """Turn on TCP keepalive for our socket, so that if the client
+        disappears without closing the connection, the kernel notices and our
+        next read or write fails (instead of the player hanging around
+        forever). The timings can only be tuned on some platforms (like
+        linux); elsewhere we get the system's defaults.
+        """
+        try:
+            self.conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except (socket_error, AttributeError):
+            return
+        for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+                              ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                              ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+            if hasattr(socket, option):
+                try:
+                    self.conn.setsockopt(socket.IPPROTO_TCP,
+                                         getattr(socket, option), value)
+                except socket_error:
+                    pass
+    
+    def fileno(self):
+        return self._fileno
+    
+    def format_output(self, queue):
+        """Return the lines in queue as a string of bytes ready to be sent
+        to the client.
+        """
+        pass
+    
+    def send(self, queue):
+        """Send the lines in queue to the client, emptying the queue.
+        Returns False if the connection is dead (or has fallen too far behind
+        on reading its output), True otherwise.
+        """
+        output = self.format_output(queue)
+        self.bytes_out += len(output)
+        self.out_buffer += output
+        del queue[:]
+        if not self.flush():
+            return False
+        # (Only what the socket wouldn't take counts against the client, so a
+        # big burst of output doesn't get a client that's keeping up dropped)
+        if len(self.out_buffer) > OUTPUT_HIGH_WATER:
+            self.log.warning('Client %s has %s bytes of unread output; '
+                             'disconnecting.' % (str(self.addr),
+                                                 len(self.out_buffer)))
+            self.out_buffer = ''
+            return False
+        return True
+    
+    def flush(self):
+        """Write as much of our buffered output as the socket will take.
+        Returns False if the connection is dead, True otherwise.
+        """
+        if not self.out_buffer:
+            return True
+        try:
+            sent = self.conn.send(self.out_buffer)
+        except socket_error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                # The socket's buffer is full; try again when it's writable
+                return True
+            # If we die here, it's probably because we got a broken pipe...
+            # tell the function that's calling us we're not alive anymore
+            return False
+        self.out_buffer = self.out_buffer[sent:]
+        return True
+    
+    def has_output(self):
+        """Return True if we have output waiting for the socket to be
+        writable.
+        """
+        return bool(self.out_buffer)
+    
+    def compression_ratio(self):
+        """Return how many bytes of output we've been given for every byte
+        we've had to send (1.0 if we haven't sent anything yet).
+        """
+        if not self.bytes_out:
+            return 1.0
+        return float(self.bytes_raw) / self.bytes_out
+    
+    def negotiate(self):
+        """Carry on setting up the connection with the client. Returns True
+        once we're ready to go, False if we're still waiting on the client, and
+        None if the client has gone away (or taken too long).
+        """
+        return True
     
-    def send(self):
+    def send_status(self, package, data):
+        """Queue an out-of-band status message (GMCP) for the client, if it
+        has asked for them. package is the GMCP package name (like
+        'Char.Vitals'), and data is anything that can be turned into JSON.
+        The message goes out with our next send().
+        """
         pass
     
     def recv(self):
@@ -17,50 +161,138 @@ class ShinyConnection(object):
 
 
 class TelnetConnection(ShinyConnection):
+    """A connection to a telnet client.
+    
+    Input is run through a TelnetParser, which pulls complete lines and
+    telnet negotiations out of the stream however the client's data happens
+    to be split up between reads.
+    
+    If MCCP is turned on in the config, we offer to compress our output with
+    MCCP2 (telnet option 86). A client that answers IAC DO COMPRESS2 gets
+    everything after our IAC SB COMPRESS2 IAC SE marker as one long zlib
+    stream, flushed at the end of each turn's output; clients that don't
+    answer (or refuse) just get plain text.
+    
+    Likewise with SEND_GMCP, we offer GMCP (telnet option 201); clients that
+    answer IAC DO GMCP get sent status updates (see send_status) as
+    subnegotiations alongside their normal output.
+    
+    We count the connection as negotiated once the client has answered all of
+    our options, or NEGOTIATION_TIMEOUT seconds have gone by (plenty of
+    clients never answer at all).
+    """
     
-    win_change_regexp = re.compile(r"\xff\xfa\x1f(?P<size>.*?)\xff\xf0")
+    recv_size = 4096
     
     def __init__(self, conn_info, log):
         ShinyConnection.__init__(self, conn_info, log)
         self.win_size = (80,40)
-        self.set_telnet_options()
+        self.compressor = None
+        self.parser = TelnetParser(self.handle_option, self.handle_subneg)
+        self.recv_buffer = bytearray(self.recv_size)
         # Put our socket into non-blocking mode - we'll periodically poll for data
         # instead of blocking until we get it
         self.conn.setblocking(0)
+        self.negotiated = False
+        self.deadline = time.time() + NEGOTIATION_TIMEOUT
+        # The options we've asked the client about that it hasn't answered
+        self.pending_options = set()
+        self.set_telnet_options()
     
-    def send(self, queue):
-        try:
-            for index, line in enumerate(queue):
-                if index != (len(queue) - 1):
-                    line += '\r\n'
-                self.conn.send(line)
-            del queue[:]
-        except socket_error:
-            # If we die here, it's probably because we got a broken pipe...
-            # tell the function that's calling us we're not alive anymore
-            return False
-        else:
-            return True
+    def format_output(self, queue):
+        output = '\r\n'.join(queue)
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+        self.bytes_raw += len(output)
+        return self.compress(output)
     
-    def recv(self):
+    def compress(self, output):
+        """Return output compressed for MCCP2, if the client has agreed to
+        it (or just output, if not).
+        """
+        if self.compressor:
+            output = self.compressor.compress(output) + \
+                     self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return output
+    
+    def send_status(self, package, data):
+        if not self.gmcp:
+            return
+        # (JSON escapes everything outside of ascii, so there are no IAC
+        # bytes in here for us to double)
+        output = IAC + SB + GMCP + package + ' ' + json.dumps(data) + IAC + SE
+        self.bytes_raw += len(output)
+        output = self.compress(output)
+        self.bytes_out += len(output)
+        self.out_buffer += output
+    
+    def start_compression(self):
+        """Start compressing everything we send from here on (the client has
+        agreed to MCCP2).
+        """
+        if self.compressor:
+            return
+        # IAC SB COMPRESS2 IAC SE: the last thing the client gets uncompressed
+        self.out_buffer += IAC + SB + COMPRESS2 + IAC + SE
+        self.compressor = zlib.compressobj(MCCP_LEVEL)
+        self.log.debug('Client %s accepted MCCP2.' % str(self.addr))
+    
+    def handle_option(self, command, option):
+        """Handle the client's answer to one of the options we've asked
+        about.
+        """
+        if not (option == NAWS and command == WILL):
+            # (If they're willing to do NAWS, we'd rather wait for their
+            # window size before we call that answered)
+            self.pending_options.discard(option)
+        if option == COMPRESS2 and command == DO and MCCP:
+            self.start_compression()
+        elif option == GMCP and SEND_GMCP:
+            self.gmcp = (command == DO)
+    
+    def handle_subneg(self, option, payload):
+        """Handle a subnegotiation from the client. The only one we ask for
+        is NAWS, which tells us the size of the player's window (GMCP clients
+        may send us messages too, but we've no use for them yet).
+        """
+        if option == NAWS and len(payload) == 4:
+            width = ord(payload[0]) * 256 + ord(payload[1])
+            height = ord(payload[2]) * 256 + ord(payload[3])
+            self.win_size = (width, height)
+            self.pending_options.discard(NAWS)
+    
+    def read(self):
+        """Read whatever the client has sent us and feed it to our parser.
+        Returns None if the client has closed the connection, False if there
+        was nothing to read, and True otherwise.
+        """
         try:
-            new_stuff = self.conn.recv(256)
+            count = self.conn.recv_into(self.recv_buffer)
         except socket_error:
             # In non-blocking mode, recv generates an error if it doesn't find
             # any data to recieve. We want to ignore that error and quitely wait until
             # there is data.
             return False
-        else:
-            # Get rid of the \r \n line terminators
-            new_stuff = new_stuff.replace('\n', '').replace('\r', '')
-            # See if the input is a notice of window size change
-            self.parse_winchange(new_stuff)
-            # Ignore any other telnet negotiations
-            new_stuff = re.sub(r"\xff((\xfa.*?\xf0)|(..))", '', new_stuff)
-            if new_stuff:
-                return new_stuff
-            return False
+        if not count:
+            # An empty read means the client closed the connection
+            return None
+        self.parser.feed(str(self.recv_buffer[:count]))
+        return True
+    
+    def negotiate(self):
+        if self.read() is None:
+            return None
+        if not self.pending_options or time.time() >= self.deadline:
+            self.negotiated = True
+        return self.negotiated
     
+    def recv(self):
+        if self.read() is None:
+            return None
+        lines = self.parser.take_lines()
+        if lines:
+            return lines
+        return False
     
     def close(self):
         self.conn.close()
@@ -72,155 +304,170 @@ class TelnetConnection(ShinyConnection):
         (they transmit each character as they receive it from the player). We want
         them to switch to linemode in this case, where they transmit each line
         after it's been assembled. We also wan't the client to tell us their
-        screen size so we can display things appropriately.
+        screen size so we can display things appropriately, and (if MCCP and
+        SEND_GMCP are on) offer to compress our output and send status
+        updates.
+        We don't wait around for their answers here; they go through our parser
+        like everything else the client sends.
         """
-        # IAC + WILL + LINEMODE
-        self.conn.send(chr(255) + chr(251) + chr(34) + '\r\n')
-        # We should get a response from their client (immediately)
-        self.conn.settimeout(1.0)
-        try:
-            result = list(self.conn.recv(256))
-        except socket.timeout:
-            # This just means that their telnet client didn't send us a timely
-            # response to our initiating linemode... we should just move on
-            result = 'Client response FAIL for linemode.'
-        finally:
-            self.log.debug(result)
-            
-        # IAC DO NAWS (Negotiate About Window Size)
-        self.conn.send(chr(255) + chr(253) + chr(31) + '\r\n')
-        try:
-            result = list(self.conn.recv(256))
-        except:
-            result = 'Client response FAIL for NAWS.'
-        else:
-            # IAC WILL NAWS
-            if result[0:3] == ['\xff', '\xfb', '\x1f']:
-                # win, they're willing to do NAWS! Parse their window info
-                stuff = ''.join(result[3:])
-                self.parse_winchange(stuff)
-        finally:
-            self.conn.settimeout(None)
-            self.log.debug(str(result))
-    
-    def parse_winchange(self, data):
-        """Parse and set the terminal size of the player."""
-        match = self.win_change_regexp.match(data)
-        if match:
-            size = match.group('size')
-            self.win_size = (ord(size[1]), ord(size[3]))
+        # IAC WILL LINEMODE, IAC DO NAWS (Negotiate About Window Size)
+        options = IAC + WILL + LINEMODE + IAC + DO + NAWS
+        self.pending_options.update([LINEMODE, NAWS])
+        if MCCP:
+            options += IAC + WILL + COMPRESS2
+            self.pending_options.add(COMPRESS2)
+        if SEND_GMCP:
+            options += IAC + WILL + GMCP
+            self.pending_options.add(GMCP)
+        self.out_buffer += options + '\r\n'
+        self.flush()
     
 
 
 class WebsocketConnection(ShinyConnection):
-    handshake_string = "HTTP/1.1 101 Web Socket Protocol Handshake\r\n\
-Upgrade: WebSocket\r\n\
+    """A connection to a WebSocket client (usually a browser), speaking
+    RFC 6455.
+    
+    Each turn's output goes out as a single text frame, with the lines joined
+    just as they would be for telnet. If the client offers permessage-deflate
+    (and WEBSOCKET_DEFLATE is on), frames are compressed with a zlib context
+    that's kept for the life of the connection. Text and binary messages from
+    the client are split into lines of input; pings are answered, and a close
+    frame is echoed back before we hang up.
+    """
+    handshake_string = "HTTP/1.1 101 Switching Protocols\r\n\
+Upgrade: websocket\r\n\
 Connection: Upgrade\r\n\
-Sec-WebSocket-Origin: %(origin)s\r\n\
-Sec-WebSocket-Location: ws://%(host)s/\r\n\r\n"
+Sec-WebSocket-Accept: %(accept)s\r\n"
+    
+    recv_size = 4096
     
     def __init__(self, conn_info, log, host, port):
         ShinyConnection.__init__(self, conn_info, log)
         self.host = host
         self.port = port
-        self.data_fragment = ''
-        self.handshake()
         self.conn.setblocking(0)
+        self.recv_buffer = bytearray(self.recv_size)
+        self.deflater = None
+        self.parser = None
+        # The client's opening handshake, as much of it as we've got so far
+        self.request = ''
+        self.negotiated = False
+        self.deadline = time.time() + HANDSHAKE_TIMEOUT
     
-    def send(self, queue):
-        try:
-            while (len(queue) > 0):
-                line = queue.pop(0)
-                line = '\x00' + line.encode('utf-8') + '\xFF'
-                self.conn.send(line)
-        except socket_error:
-            # If we die here, it's probably because we got a broken pipe...
-            # tell the function that's calling us we're not alive anymore 
-            return False
-        else:
-            return True
-    
+    def format_output(self, queue):
+        output = '\r\n'.join(queue)
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+        self.bytes_raw += len(output)
+        if self.deflater:
+            return encode_frame(TEXT, self.deflater.compress(output), rsv1=True)
+        return encode_frame(TEXT, output)
     
-    def recv(self):
+    def read(self):
+        """Read whatever the client has sent us. Returns the data, None if
+        the client has closed the connection, or '' if there was nothing to
+        read.
+        """
         try:
-            new_stuff = self.data_fragment + self.conn.recv(256)
+            count = self.conn.recv_into(self.recv_buffer)
         except socket_error:
             # In non-blocking mode, recv generates an error if it doesn't find
             # any data to recieve. We want to ignore that error and quitely wait until
             # there is data.
-            return False
-        else:
-            valid_lines = []
-            
-            # Split all lines on the terminating character
-            lines = new_stuff.split('\xFF')
-            
-            # Pop the last line off of the end - this will either be an empty string if the
-            # last line was terminated, or a left over fragment that should wait for the next batch
-            # of lines to be processed
-            self.data_fragment = lines.pop()
-            
-            # Now we should make sure the lines have a valid prefix. Ignore any that don't.
-            for line in lines:
-                if line[0] == '\x00':
-                    valid_lines.append(line[1:])
-                elif line == '':
-                    # The client wishes to terminate - send the closing handshake and disconnect
-                    self.close()
-                    # Return None so that the player object knows to log the player out
-                    return None
-                else:
-                    self.log.error('Received invalid message from client '
-                                    '(frame did not begin with 0x00 byte): %s' % (line))
-                
-            if valid_lines:
-                return valid_lines
-            
-            return False
+            return ''
+        if not count:
+            # An empty read means the client closed the connection
+            return None
+        return str(self.recv_buffer[:count])
+    
+    def recv(self):
+        data = self.read()
+        if data is None:
+            return None
+        if self.request:
+            data, self.request = self.request + data, ''
+        try:
+            messages = self.parser.feed(data)
+        except ProtocolError, e:
+            self.log.debug('Websocket client %s: %s' % (str(self.addr), str(e)))
+            self.send_close(e.status)
+            return None
+        lines = []
+        for opcode, payload in messages:
+            if opcode in (TEXT, BINARY):
+                lines.extend([line.strip('\r') for line in payload.split('\n')
+                              if line.strip('\r')])
+            elif opcode == PING:
+                self.out_buffer += encode_frame(PONG, payload)
+                self.flush()
+            elif opcode == CLOSE:
+                # The client wishes to terminate - send the closing handshake
+                # and return None so that the player object knows to log the
+                # player out
+                self.send_close(NORMAL_CLOSURE)
+                return None
+        if lines:
+            return lines
+        return False
+    
+    def send_close(self, status):
+        """Send a close frame (if the socket will take it)."""
+        self.out_buffer += encode_frame(CLOSE, pack('!H', status))
+        self.flush()
     
+    def negotiate(self):
+        """Read the client's opening handshake, and answer it once we've got
+        the whole thing. Clients that haven't finished their handshake by
+        HANDSHAKE_TIMEOUT seconds after connecting get dropped.
+        """
+        data = self.read()
+        if data is None:
+            return None
+        self.request += data
+        end = self.request.find('\r\n\r\n')
+        if end != -1:
+            try:
+                self.handshake(self.request[:end + 4])
+            except Exception, e:
+                self.log.debug('Bad websocket handshake from %s: %s' %
+                               (str(self.addr), str(e)))
+                self.out_buffer += 'HTTP/1.1 400 Bad Request\r\n\r\n'
+                self.flush()
+                return None
+            self.negotiated = True
+            # Anything that came in after the handshake is already frames;
+            # recv() will get to it
+            self.request = self.request[end + 4:]
+        elif time.time() >= self.deadline or len(self.request) > 8192:
+            self.log.debug('Client %s never finished its websocket handshake.'
+                           % str(self.addr))
+            return None
+        return self.negotiated
     
-    def handshake(self):
-        data = self.conn.recv(1024)
-        host = re.findall(r'Host: (.*?)\r\n', data)[0]
-        origin = re.findall(r'Origin: (.*?)\r\n', data)[0]
-        response = self.handshake_string % {'origin': origin, 'host': host}
-        
-        response = response.encode('utf-8') + self.parse_hybi00(data)
-        self.conn.send(response)
+    def handshake(self, request):
+        headers = {}
+        for line in request.split('\r\n')[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('sec-websocket-version') != '13':
+            raise ValueError('Unsupported websocket version %s' %
+                             headers.get('sec-websocket-version'))
+        response = self.handshake_string % \
+                   {'accept': accept_key(headers['sec-websocket-key'])}
+        offer = None
+        if WEBSOCKET_DEFLATE:
+            offer = parse_deflate_offer(headers.get('sec-websocket-extensions',
+                                                    ''))
+        if offer:
+            extension, window_bits, no_context_takeover = offer
+            self.deflater = MessageDeflater(window_bits, no_context_takeover,
+                                            MCCP_LEVEL)
+            response += 'Sec-WebSocket-Extensions: %s\r\n' % extension
+        self.parser = FrameParser(self.deflater)
+        self.out_buffer += response + '\r\n'
+        self.flush()
     
     def close(self):
         self.conn.close()
     
-    def parse_hybi00(self, request):
-        """ Parses an HTTP request header and forms a response according to
-        The WebSocket protocol, draft-ietf-hybi-thewebsocketprotocol-00
-        (http://tools.ietf.org/html/draft-ietf-hybi-thewebsocketprotocol-00).
-        """
-        # The random tokens will be in the last 8 bytes of the request
-        random_tokens = request[-8:]
-        # Grab the sooper seekret keys hidden away in the request headers
-        key1 = re.findall(r'Sec-WebSocket-Key1: (.*?)\r\n', request)[0]
-        key2 = re.findall(r'Sec-WebSocket-Key2: (.*?)\r\n', request)[0]
-        
-        def parse_key(key):
-            spaces = 0
-            digits = ''
-            
-            for char in list(key):
-                if char.isdigit():
-                    # If the character is a digit, concatonate it to our string of digits
-                    digits += char
-                elif char == ' ':
-                    # If the character is a space, add it to our space counter orgecc
-                    spaces += 1
-            
-            result = int(int(digits) / spaces)
-            return result
-        
-        
-        response = pack('>II8s', parse_key(key1), parse_key(key2), str(random_tokens))
-        hashed_response = hashlib.md5()
-        hashed_response.update(response)
-        return hashed_response.digest()
-    
-
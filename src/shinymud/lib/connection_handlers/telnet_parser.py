@@ -0,0 +1,124 @@
+# Telnet command bytes (see RFC 854)
+IAC = '\xff'
+DONT = '\xfe'
+DO = '\xfd'
+WONT = '\xfc'
+WILL = '\xfb'
+SB = '\xfa'
+SE = '\xf0'
+
+# Telnet options we care about
+NAWS = '\x1f'
+LINEMODE = '\x22'
+COMPRESS2 = '\x56'
+GMCP = '\xc9'
+
+# Parser states
+DATA, COMMAND, OPTION, SUBNEG, SUBNEG_IAC = range(5)
+
+class TelnetParser(object):
+    """An incremental parser for the stream of bytes coming from a telnet
+    client.
+
+    Feed it whatever recv() gave us with feed(); complete lines of input pile
+    up in lines (without their line terminators), and any telnet negotiations
+    are passed to the callbacks we were given:
+        on_option(command, option) -- for IAC WILL/WONT/DO/DONT <option>
+        on_subneg(option, payload) -- for IAC SB <option> <payload> IAC SE
+
+    Partial lines and partial negotiations are kept until the rest of them
+    arrives, so it doesn't matter how the client's data gets split up between
+    reads.
+    """
+    def __init__(self, on_option=None, on_subneg=None):
+        self.on_option = on_option
+        self.on_subneg = on_subneg
+        self.lines = []
+        self.state = DATA
+        self._line = []
+        self._command = None
+        self._subneg = []
+        # True if the last thing we saw was a \r, in which case a \n or \0
+        # right after it is part of the same line terminator
+        self._cr = False
+
+    def take_lines(self):
+        """Return the complete lines we've parsed so far, and forget them."""
+        lines = self.lines
+        self.lines = []
+        return lines
+
+    def feed(self, data):
+        """Parse data, a string of bytes from the client."""
+        i = 0
+        end = len(data)
+        while i < end:
+            if self.state == DATA:
+                # Most of what we get is plain text, so hand everything up to
+                # the next IAC off in one go
+                j = data.find(IAC, i)
+                if j == -1:
+                    j = end
+                if j > i:
+                    self._text(data[i:j])
+                if j < end:
+                    self.state = COMMAND
+                i = j + 1
+                continue
+            byte = data[i]
+            i += 1
+            if self.state == COMMAND:
+                if byte == IAC:
+                    # An escaped 255 byte, as part of the text
+                    self._text(IAC)
+                    self.state = DATA
+                elif byte in (WILL, WONT, DO, DONT):
+                    self._command = byte
+                    self.state = OPTION
+                elif byte == SB:
+                    self._subneg = []
+                    self.state = SUBNEG
+                else:
+                    # Any other command (NOP, GA, AYT...) we just ignore
+                    self.state = DATA
+            elif self.state == OPTION:
+                self.state = DATA
+                if self.on_option:
+                    self.on_option(self._command, byte)
+            elif self.state == SUBNEG:
+                if byte == IAC:
+                    self.state = SUBNEG_IAC
+                else:
+                    self._subneg.append(byte)
+            elif self.state == SUBNEG_IAC:
+                if byte == SE:
+                    self.state = DATA
+                    payload = ''.join(self._subneg)
+                    self._subneg = []
+                    if payload and self.on_subneg:
+                        self.on_subneg(payload[0], payload[1:])
+                else:
+                    # IAC IAC inside a subnegotiation is a literal 255 byte
+                    self._subneg.append(byte)
+                    self.state = SUBNEG
+
+    def _text(self, text):
+        """Add text to the current line, finishing any lines it completes."""
+        if self._cr:
+            self._cr = False
+            if text[0] in '\n\0':
+                text = text[1:]
+        if '\r' in text:
+            self._cr = text.endswith('\r')
+            text = text.replace('\r\n', '\n').replace('\r\0', '\n')
+            text = text.replace('\r', '\n')
+        pieces = text.split('\n')
+        if len(pieces) == 1:
+            self._line.append(text)
+            return
+        self._line.append(pieces[0])
+        pieces[0] = ''.join(self._line)
+        self._line = [pieces.pop()]
+        # Players hitting enter on an empty line don't need to be told
+        # anything, so we don't bother passing blank lines on
+        self.lines.extend([line for line in pieces if line])
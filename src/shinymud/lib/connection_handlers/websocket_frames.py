@@ -0,0 +1,227 @@
+"""Framing for the WebSocket protocol (RFC 6455), and the permessage-deflate
+extension (RFC 7692) that compresses the messages inside the frames.
+"""
+from struct import pack, unpack
+import hashlib
+import base64
+import zlib
+
+# The magic string the server hashes the client's key with (RFC 6455, 1.3)
+ACCEPT_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Frame opcodes
+CONTINUATION = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+# Close status codes
+NORMAL_CLOSURE = 1000
+PROTOCOL_ERROR = 1002
+MESSAGE_TOO_BIG = 1009
+
+# permessage-deflate strips this off the end of each compressed message (and
+# the receiver puts it back before decompressing)
+DEFLATE_TAIL = '\x00\x00\xff\xff'
+
+# XOR_TABLES[k] translates a string's bytes into those bytes XORed with k, so
+# unmasking a payload doesn't have to be done a byte at a time in python
+XOR_TABLES = [''.join([chr(i ^ k) for i in range(256)]) for k in range(256)]
+
+class ProtocolError(Exception):
+    """The other end broke the rules; status is the close code to send."""
+    def __init__(self, message, status=PROTOCOL_ERROR):
+        Exception.__init__(self, message)
+        self.status = status
+
+def accept_key(key):
+    """Return the Sec-WebSocket-Accept value for a client's
+    Sec-WebSocket-Key.
+    """
+    return base64.b64encode(hashlib.sha1(key + ACCEPT_GUID).digest())
+
+def unmask(payload, mask):
+    """Return payload XORed with the 4-byte masking key mask."""
+    data = bytearray(payload)
+    for i in range(4):
+        data[i::4] = payload[i::4].translate(XOR_TABLES[ord(mask[i])])
+    return str(data)
+
+def encode_frame(opcode, payload, rsv1=False, mask=None):
+    """Return a single (final) frame carrying payload. Frames from clients
+    must be masked with a 4-byte mask; frames from servers must not be.
+    """
+    first = 0x80 | opcode
+    if rsv1:
+        first |= 0x40
+    mask_bit = mask and 0x80 or 0
+    length = len(payload)
+    if length < 126:
+        header = pack('!BB', first, mask_bit | length)
+    elif length < 0x10000:
+        header = pack('!BBH', first, mask_bit | 126, length)
+    else:
+        header = pack('!BBQ', first, mask_bit | 127, length)
+    if mask:
+        return header + mask + unmask(payload, mask)
+    return header + payload
+
+def parse_deflate_offer(header):
+    """Look through a Sec-WebSocket-Extensions header for a permessage-deflate
+    offer we can accept. Returns (response, window_bits, no_context_takeover)
+    -- response being what to send back in our own Sec-WebSocket-Extensions
+    header -- or None if there isn't one.
+    """
+    for offer in header.split(','):
+        params = [p.strip() for p in offer.split(';')]
+        if params[0] != 'permessage-deflate':
+            continue
+        response = ['permessage-deflate']
+        window_bits = 15
+        no_context_takeover = False
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            name, value = name.strip(), value.strip().strip('"')
+            if name == 'server_no_context_takeover':
+                no_context_takeover = True
+                response.append(name)
+            elif name == 'server_max_window_bits':
+                # zlib won't make raw deflate streams with a window of 8, and
+                # we can't answer with a bigger window than the client
+                # offered, so we have to turn down offers of 8
+                if not value.isdigit() or not 9 <= int(value) <= 15:
+                    break
+                window_bits = int(value)
+                response.append('%s=%s' % (name, window_bits))
+            elif name == 'client_max_window_bits':
+                # We can read whatever window size the client uses
+                pass
+            elif name != 'client_no_context_takeover':
+                break
+        else:
+            return '; '.join(response), window_bits, no_context_takeover
+    return None
+
+
+class MessageDeflater(object):
+    """Compresses and decompresses messages for permessage-deflate."""
+    def __init__(self, window_bits=15, no_context_takeover=False, level=6):
+        self.window_bits = window_bits
+        self.no_context_takeover = no_context_takeover
+        self.level = level
+        self.compressor = self._compressor()
+        self.decompressor = zlib.decompressobj(-15)
+
+    def _compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, -self.window_bits)
+
+    def compress(self, data):
+        data = self.compressor.compress(data) + \
+               self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.no_context_takeover:
+            self.compressor = self._compressor()
+        if data.endswith(DEFLATE_TAIL):
+            data = data[:-4]
+        return data
+
+    def decompress(self, data):
+        try:
+            return self.decompressor.decompress(data + DEFLATE_TAIL)
+        except zlib.error, e:
+            raise ProtocolError('Bad compressed message: %s' % str(e))
+
+
+class FrameParser(object):
+    """An incremental parser for a stream of WebSocket frames.
+
+    feed() it whatever we've read; it returns a list of (opcode, payload)
+    pairs, one for each complete message (fragmented messages are put back
+    together, and compressed ones decompressed) or control frame. Raises
+    ProtocolError if the stream doesn't make sense.
+    """
+    def __init__(self, deflater=None, masked=True, max_size=65536):
+        self.deflater = deflater
+        self.masked = masked
+        self.max_size = max_size
+        self.data = ''
+        # The opcode, compression and payloads of a fragmented message that
+        # we're in the middle of
+        self._opcode = None
+        self._compressed = False
+        self._fragments = []
+
+    def feed(self, data):
+        self.data += data
+        messages = []
+        while 1:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            fin, rsv1, opcode, payload = frame
+            if rsv1 and opcode not in (TEXT, BINARY):
+                raise ProtocolError('Unexpected compressed frame')
+            if opcode >= CLOSE:
+                if not fin or len(payload) > 125:
+                    raise ProtocolError('Bad control frame')
+                messages.append((opcode, payload))
+                continue
+            if opcode == CONTINUATION:
+                if self._opcode is None:
+                    raise ProtocolError('Unexpected continuation frame')
+            elif self._opcode is not None:
+                raise ProtocolError('Expected a continuation frame')
+            else:
+                self._opcode = opcode
+                self._compressed = rsv1
+            self._fragments.append(payload)
+            if fin:
+                payload = ''.join(self._fragments)
+                if self._compressed:
+                    payload = self.deflater.decompress(payload)
+                messages.append((self._opcode, payload))
+                self._opcode = None
+                self._fragments = []
+        return messages
+
+    def _next_frame(self):
+        """Pull the next complete frame off of our data, returning (fin, rsv1,
+        opcode, payload), or None if we don't have a whole frame yet.
+        """
+        data = self.data
+        if len(data) < 2:
+            return None
+        first, second = ord(data[0]), ord(data[1])
+        fin, rsv1, opcode = first & 0x80, first & 0x40, first & 0x0F
+        if first & 0x30 or (rsv1 and not self.deflater):
+            raise ProtocolError('Unexpected reserved bits')
+        if opcode not in (CONTINUATION, TEXT, BINARY, CLOSE, PING, PONG):
+            raise ProtocolError('Unknown opcode %s' % opcode)
+        if bool(second & 0x80) != self.masked:
+            raise ProtocolError('Frame masking is wrong')
+        length = second & 0x7F
+        start = 2
+        if length == 126:
+            if len(data) < 4:
+                return None
+            length = unpack('!H', data[2:4])[0]
+            start = 4
+        elif length == 127:
+            if len(data) < 10:
+                return None
+            length = unpack('!Q', data[2:10])[0]
+            start = 10
+        if length + sum([len(f) for f in self._fragments]) > self.max_size:
+            raise ProtocolError('Message too big', MESSAGE_TOO_BIG)
+        if self.masked:
+            mask = data[start:start + 4]
+            start += 4
+        end = start + length
+        if len(data) < end:
+            return None
+        payload = data[start:end]
+        self.data = data[end:]
+        if self.masked:
+            payload = unmask(payload, mask)
+        return fin, rsv1, opcode, payload
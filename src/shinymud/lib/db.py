@@ -1,18 +1,182 @@
-from shinymud.data.config import DB_NAME
+from shinymud.data.config import DB_NAME, DB_PRAGMAS
 
 import sqlite3
+import time
 import re
 
 class DB(object):
+    # How many compiled statements sqlite3 keeps around for each connection.
+    # Our queries are built the same way every time (see _statement), so as
+    # long as they all fit, nothing has to be compiled twice.
+    cached_statements = 500
+    
     def __init__(self, logger, conn=None):
+        # The database file we've opened (if we opened one ourselves)
+        self.path = None
         if conn:
             if isinstance(conn, basestring):
-                self.conn = sqlite3.Connection(conn)
+                self.conn = sqlite3.Connection(conn,
+                                    cached_statements=self.cached_statements)
+                if conn != ':memory:':
+                    self.path = conn
             else:
                 self.conn = conn
         else:
-            self.conn = sqlite3.Connection(DB_NAME)
+            self.conn = sqlite3.Connection(DB_NAME,
+                                    cached_statements=self.cached_statements)
+            self.path = DB_NAME
         self.log = logger
+        # sqlite only enforces foreign keys (and their ON DELETE CASCADEs) on
+        # connections that ask it to, so every one of ours does -- including
+        # the DBWriter's, which makes our deletes for us
+        self.conn.execute('PRAGMA foreign_keys = true')
+        if self.path:
+            self.configure(DB_PRAGMAS)
+        # kind of query: [number run, total seconds spent running them]
+        self.query_stats = {'insert': [0, 0.0], 'select': [0, 0.0],
+                            'update': [0, 0.0], 'delete': [0, 0.0]}
+        # The SQL we've built for each (kind, table, columns) we've been asked
+        # to insert or update
+        self.statements = {}
+        # Whole tables fetched ahead of time by preload(), for select_by
+        self.preloaded = None
+        # How many begin()s haven't been matched by a commit() yet; while
+        # this is above zero, writes aren't committed as they're made
+        self.batch_depth = 0
+        # The DBWriter making our writes for us, if there is one (see
+        # _hand_off and use_writer)
+        self.writer = None
+        # The last dbid we've handed out for each table, while we have a
+        # writer (see next_dbid)
+        self.dbids = {}
+    
+    def begin(self):
+        """Start a batch of writes: the inserts, updates and deletes made
+        until the matching commit() all go into one transaction (so they're
+        only synced to disk once). Batches can be nested.
+        
+        ex:
+            db.begin()
+            try:
+                db.update(...)
+                db.update(...)
+            except:
+                db.rollback()
+                raise
+            else:
+                db.commit()
+        """
+        self.batch_depth += 1
+    
+    def commit(self):
+        """Finish a batch of writes, committing them if this is the
+        outermost batch.
+        """
+        self.batch_depth = max(0, self.batch_depth - 1)
+        if not self.batch_depth:
+            self.conn.commit()
+    
+    def rollback(self):
+        """Throw away everything that hasn't been committed yet, ending any
+        batches we're in the middle of.
+        """
+        self.batch_depth = 0
+        self.conn.rollback()
+    
+    def _failed(self, error, detail):
+        """Clean up after a write that raised error, and return the exception
+        to raise in its place (with detail, like the query, added to its
+        message). Outside of a batch, the write's rolled back; inside one,
+        sqlite has only undone the statement that failed, and it's up to
+        whoever started the batch what happens to the rest of it.
+        Constraint violations are raised as IntegrityErrors, so callers can
+        tell a write that's never going to work from one that might work if
+        it's tried again.
+        """
+        if not self.batch_depth:
+            self.conn.rollback()
+        if isinstance(error, sqlite3.IntegrityError):
+            return sqlite3.IntegrityError(str(error) + detail)
+        return Exception(str(error) + detail)
+    
+    def _commit(self):
+        """Commit a write, unless it's part of a batch."""
+        if not self.batch_depth:
+            self.conn.commit()
+    
+    def configure(self, pragmas):
+        """Apply a list of (name, value) SQLite PRAGMAs to our connection.
+        Returns a dictionary of what each setting ended up as (sqlite quietly
+        ignores settings it can't use, like WAL for an in-memory database).
+        """
+        settings = {}
+        for name, value in pragmas:
+            if not re.match(r'^\w+$', name) or not re.match(r'^[\w-]+$', str(value)):
+                raise Exception('Bad pragma: %s=%s' % (name, value))
+            row = self.conn.execute('PRAGMA %s=%s' % (name, value)).fetchone()
+            if row is None:
+                row = self.conn.execute('PRAGMA %s' % name).fetchone()
+            settings[name] = row and row[0]
+        self.log.debug('Database settings: %r', settings)
+        return settings
+    
+    def checkpoint(self):
+        """Merge what we can of the write-ahead log back into the database,
+        without waiting on anyone reading or writing it (a passive checkpoint).
+        This opens its own connection, so it can be run from another thread.
+        Returns (busy, log pages, pages checkpointed), as sqlite reports them.
+        """
+        conn = sqlite3.Connection(self.path)
+        try:
+            return tuple(conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone())
+        finally:
+            conn.close()
+    
+    def use_writer(self, writer):
+        """Have writer (a DBWriter, or None to go back to writing ourselves)
+        make our writes from now on.
+        """
+        self.writer = writer
+        # Rows may be added behind our counters' backs while we're without
+        # a writer, so start them over from the database next time
+        self.dbids = {}
+    
+    def next_dbid(self, table):
+        """Hand out the next dbid for a new row in table. The first one for
+        each table comes from the database; after that, they're counted here,
+        so an insert can be queued up with its dbid already known, instead of
+        waiting for the writer to tell us what sqlite3 picked. Only our
+        writer's connection makes inserts while we have one, so no one else
+        can take the ids we're counting on.
+        """
+        if table not in self.dbids:
+            rows = self.select('max(dbid) as dbid from ' + table)
+            self.dbids[table] = rows[0]['dbid'] or 0
+        self.dbids[table] += 1
+        return self.dbids[table]
+    
+    def _hand_off(self, method, args, wait=False):
+        """Give a write to our writer, if we have one. While a DBWriter's
+        running, its connection is the only one that writes, so ours never
+        has to wait on the writer's locks (or fail with 'database is locked'
+        when it's waited too long). Writes are just queued; if wait is set
+        (for raw inserts, whose new row ids only sqlite3 knows), we wait for
+        the write to be committed.
+        Returns (True, the write's result), or (False, None) if we should make
+        the write ourselves.
+        """
+        if not self.writer:
+            return False, None
+        if wait:
+            return True, self.writer.call(method, args)
+        self.writer.submit(method, args)
+        return True, None
+    
+    def _record(self, kind, start):
+        """Count a query of the given kind that started at start."""
+        stats = self.query_stats[kind]
+        stats[0] += 1
+        stats[1] += time.time() - start
     
     def insert(self, query, params=None):
         """    Insert a new row into a table.
@@ -24,34 +188,64 @@ class DB(object):
             db = DB()
             new_id = db.insert("into table mytable (field1, field2...) values (?, ?...)", [val1, val2...])
         """
+        handed_off, new_id = self._hand_off('insert', (query, params), True)
+        if handed_off:
+            # sqlite3 picked this row's id, not next_dbid, so our counters
+            # can't be trusted any more; the database is up to date now, so
+            # they can start over from it
+            self.dbids = {}
+            return new_id
         cursor = self.conn.cursor()
-        self.log.debug(query + ' ' + repr(params))
+        self.log.debug('%s %r', query, params)
+        start = time.time()
         try:
             if params:
                 cursor.execute("insert " + query, params)
             else:
                 cursor.execute("insert " + query)
         except Exception, e:
-            self.conn.rollback()
-            raise Exception(str(e) + '\n%s\n%s' % (query, repr(params)))
+            raise self._failed(e, '\n%s\n%s' % (query, repr(params)))
         else:
             new_id = cursor.lastrowid
-            self.conn.commit()
+            self._commit()
             return new_id
+        finally:
+            self._record('insert', start)
     
     def insert_from_dict(self, table, d):
-        query = "INTO " + table + " "
-        keys = []
-        values = []
-        self.log.debug("INSERTING: " + str(d))
-        for key,val in d.items():
-            keys.append(key)
-            values.append(val)
-        key_string = "(" + ",".join(keys) + ")"
-        val_string = "(" + ",".join(['?' for _ in values]) + ")"
-        query = query + key_string + " VALUES " + val_string
-        return self.insert(query, values)
-        
+        """Insert d as a new row in table, and return its dbid.
+        With a writer, the row is given its dbid here (see next_dbid) and the
+        insert is just queued, so its dbid is returned straight away; if the
+        insert fails when it's made, the writer logs it.
+        """
+        if self.writer and not d.get('dbid'):
+            d = dict(d, dbid=self.next_dbid(table))
+            self.log.debug("INSERTING: %s", d)
+            self._hand_off('insert_from_dict', (table, d))
+            return d['dbid']
+        columns = sorted(d.keys())
+        self.log.debug("INSERTING: %s", d)
+        return self.insert(self._statement('insert', table, columns),
+                           [d[key] for key in columns])
+    
+    def _statement(self, kind, table, columns):
+        """Return the query (minus its first word, which insert() and update()
+        add) for inserting a row into table, or updating a row's columns by
+        its dbid. Each query is only built once, and always comes out the same,
+        so sqlite3 can reuse the statement it compiled for it.
+        """
+        key = (kind, table, tuple(columns))
+        query = self.statements.get(key)
+        if query is None:
+            if kind == 'insert':
+                query = "INTO %s (%s) VALUES (%s)" % (table, ",".join(columns),
+                                                     ",".join(['?'] * len(columns)))
+            else:
+                query = "%s SET %s WHERE dbid=?" % (table,
+                                    ",".join(["%s=?" % column for column in columns]))
+            self.statements[key] = query
+        return query
+    
     def select(self, query, params=None):
         """    Fetch data from the database.
         If the select is successful, it returns a list of dictionaries.
@@ -64,66 +258,132 @@ class DB(object):
             print rows
             > [{'field1': somevalue, 'field2', someothervalue...}, {'field1':...}...]
         """
-        self.log.debug(query + ' ' + repr(params))
+        self.log.debug('%s %r', query, params)
         cursor = self.conn.cursor()
-        if params:
-            params = [unicode(p) for p in params]
-            cursor.execute(u"select " + unicode(query), params)
-        else:
-            cursor.execute("select " + query)
-        keys = [_[0] for _ in cursor.description]
-        rows = [dict([(keys[i], vals[i]) for i in range(len(keys))]) for vals in cursor.fetchall()]
+        start = time.time()
+        try:
+            if params:
+                params = [unicode(p) for p in params]
+                cursor.execute(u"select " + unicode(query), params)
+            else:
+                cursor.execute("select " + query)
+            keys = [_[0] for _ in cursor.description]
+            rows = [dict(zip(keys, vals)) for vals in cursor.fetchall()]
+        finally:
+            self._record('select', start)
         return rows
     
+    def preload(self, tables):
+        """Fetch each of a list of (table, column) pairs whole, and keep
+        their rows grouped by column, so that select_by() can hand them out
+        without asking the database again. This turns loading lots of models
+        that each select their own rows (like every room loading its exits)
+        into one query per table. Call end_preload() once you're done, to free
+        the rows (and so select_by() goes back to seeing changes).
+        """
+        self.preloaded = {}
+        for table, column in tables:
+            groups = {}
+            for row in self.select('* FROM %s WHERE %s IS NOT NULL' % (table, column)):
+                # (select matches its params as unicode, so we do too)
+                groups.setdefault(unicode(row[column]), []).append(row)
+            self.preloaded[(table, column)] = groups
+    
+    def end_preload(self):
+        self.preloaded = None
+    
+    def select_by(self, table, column, value):
+        """Return the rows of table whose column is value, as select()
+        would -- from what we've preloaded, if we've preloaded that table.
+        """
+        if self.preloaded is not None and (table, column) in self.preloaded:
+            return self.preloaded[(table, column)].get(unicode(value), [])
+        return self.select('* FROM %s WHERE %s=?' % (table, column), [value])
+    
     def update(self, query, params=None):
         """    Change data in the database.
         If successful, returns the number of rows updated (may be zero if no matches).
         If there is a problem with the query, it will raise an exception.
+        (With a writer, the update is just queued, and None is returned.)
         """
+        if self._hand_off('update', (query, params))[0]:
+            return None
         cursor = self.conn.cursor()
+        start = time.time()
         try:
             if params:
                 cursor.execute("update " + query, params)
             else:
                 cursor.execute("update " + query)
         except Exception, e:
-            self.conn.rollback()
-            raise Exception(str(e) + '\n%s\n%s' % (query, repr(params)))
+            raise self._failed(e, '\n%s\n%s' % (query, repr(params)))
         else:
-            self.conn.commit()
+            self._commit()
             return cursor.rowcount
+        finally:
+            self._record('update', start)
     
     def update_from_dict(self, table, d):
         if 'dbid' in d:
-            query = table + " SET "
-            attributes = []
-            values = []
-            for key, val in d.items():
-                if key != 'dbid':
-                    attributes.append(unicode(key) + "=?")
-                    values.append(val)
-            query = query + ','.join(attributes) + " WHERE dbid=?"
-            values.append(d['dbid'])
-            self.log.debug('Updating %s: \n%s' % (table, query))
-            return self.update(query, values)
+            columns = sorted([key for key in d if key != 'dbid'])
+            query = self._statement('update', table, columns)
+            self.log.debug('Updating %s: \n%s', table, query)
+            return self.update(query, [d[key] for key in columns] + [d['dbid']])
         else:
             raise Exception("Cannot update unsaved entity.")
     
+    def update_many(self, table, dicts):
+        """Update a batch of rows in table, one for each dictionary in dicts
+        (which must all have a dbid, as with update_from_dict). Rows that are
+        having the same columns changed are updated together with a single
+        executemany.
+        Returns the number of rows updated.
+        """
+        if self._hand_off('update_many', (table, dicts))[0]:
+            return None
+        groups = {}
+        for d in dicts:
+            if 'dbid' not in d:
+                raise Exception("Cannot update unsaved entity.")
+            columns = tuple(sorted([key for key in d if key != 'dbid']))
+            groups.setdefault(columns, []).append([d[key] for key in columns] + [d['dbid']])
+        cursor = self.conn.cursor()
+        start = time.time()
+        count = 0
+        try:
+            for columns, rows in groups.items():
+                query = self._statement('update', table, columns)
+                self.log.debug('Updating %s rows of %s: \n%s', len(rows), table, query)
+                cursor.executemany("update " + query, rows)
+                count += cursor.rowcount
+        except Exception, e:
+            raise self._failed(e, '\n%s' % table)
+        else:
+            self._commit()
+            return count
+        finally:
+            self._record('update', start)
+    
     def delete(self, query, params=None):
         """    Delete rows from a table.
         If successful, returns the number of rows deleted (may be zero if no matches).
         If there is a problem with the query, it will raise an exception.
+        (With a writer, the delete is just queued, and None is returned.)
         """
+        if self._hand_off('delete', (query, params))[0]:
+            return None
         cursor = self.conn.cursor()
+        start = time.time()
         try:
             if params:
                 cursor.execute("delete " + query, params)
             else:
                 cursor.execute("delete " + query)
         except Exception, e:
-            self.conn.rollback()
-            raise Exception(str(e) + '\n%s\n%s' % (query, repr(params)))
+            raise self._failed(e, '\n%s\n%s' % (query, repr(params)))
         else:
-            self.conn.commit()
+            self._commit()
             return cursor.rowcount
+        finally:
+            self._record('delete', start)
     
@@ -0,0 +1,182 @@
+from shinymud.lib.db import DB
+
+from collections import deque
+import threading
+import Queue
+
+class Reply(object):
+    """The callback call() waits on: it's called from the writer thread, and
+    wakes up whoever's waiting for the write's result.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def __call__(self, result, error):
+        self.result = result
+        self.error = error
+        self.event.set()
+
+
+class DBWriter(object):
+    """A thread with its own connection to the database, that makes writes
+    for the main loop so it never has to wait on the disk.
+
+    submit() the name of a DB write method ('insert', 'update_from_dict'...)
+    and its arguments; the writer thread runs everything it's been given
+    since its last batch in one transaction. When a write has been committed,
+    its callback gets handed back to the main loop, which runs it (with the
+    write's result -- the new row's id for inserts, the number of rows changed
+    otherwise -- or the exception it raised) the next time it calls
+    run_callbacks(), just like the Executor's callbacks.
+
+    flush() waits until everything submitted so far has been committed, for
+    when we have to be sure (like shutting down), and call() makes a write and
+    waits for its result, for when we can't carry on without it.
+
+    Example:
+        def saved(result, error):
+            if error:
+                world.log.error('Lost a save: %s' % str(error))
+        writer.submit('update_from_dict', ('player', save_dict), saved)
+    """
+    # The most writes we'll put in one transaction
+    batch_size = 500
+    # How long (in seconds) call() waits for a write before giving up on it
+    timeout = 30
+
+    def __init__(self, path, log, wake=None):
+        self.path = path
+        self.log = log
+        # Called (from the writer thread) whenever there's a callback waiting
+        self.wake = wake
+        self.writes = Queue.Queue()
+        self.done = deque()
+        self.thread = None
+        # Our connection's DB.query_stats, once the thread's made it (the
+        # metrics add these to the main connection's)
+        self.query_stats = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, method, args=(), callback=None):
+        """Queue up a call to the DB method named method, with args."""
+        self.writes.put((method, args, callback))
+
+    def flush(self, timeout=None):
+        """Wait until every write submitted so far has been committed.
+        Returns False if that took longer than timeout seconds.
+        """
+        if not self.thread:
+            return True
+        barrier = threading.Event()
+        self.writes.put(barrier)
+        barrier.wait(timeout)
+        return barrier.isSet()
+
+    def call(self, method, args=()):
+        """Make a write, and wait for it to be committed. Returns the write's
+        result, or raises the exception it raised. This blocks the main loop
+        until everything submitted before it has been written, too, so save it
+        for when we really can't carry on without the result. No one else's
+        callbacks get run while we wait; they're left for run_callbacks().
+        """
+        reply = Reply()
+        self.submit(method, args, reply)
+        if not reply.event.wait(self.timeout):
+            raise Exception('Gave up waiting for the database writer to %s.'
+                            % method)
+        if reply.error:
+            raise reply.error
+        return reply.result
+    
+    def stop(self):
+        """Finish off the writes we've been given, and stop the thread."""
+        if not self.thread:
+            return
+        self.writes.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _work(self):
+        # (sqlite connections can only be used by the thread that made them)
+        db = DB(self.log, self.path)
+        self.query_stats = db.query_stats
+        try:
+            while 1:
+                batch = [self.writes.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.writes.get_nowait())
+                    except Queue.Empty:
+                        break
+                writes = [w for w in batch if isinstance(w, tuple)]
+                if writes:
+                    self._write(db, writes)
+                for item in batch:
+                    if item is None:
+                        return
+                    if not isinstance(item, tuple):
+                        item.set()
+        finally:
+            db.conn.close()
+
+    def _write(self, db, writes):
+        """Make a batch of writes in one transaction -- or, if one of them
+        fails, make them again one at a time (still in one transaction), so
+        the bad write doesn't take the rest down with it.
+        """
+        results = []
+        db.begin()
+        try:
+            for method, args, callback in writes:
+                results.append((callback, getattr(db, method)(*args), None))
+        except Exception, e:
+            db.rollback()
+            results = []
+            db.begin()
+            for method, args, callback in writes:
+                result = error = None
+                try:
+                    result = getattr(db, method)(*args)
+                except Exception, e:
+                    error = e
+                    if not callback:
+                        self.log.error('Database write failed: %s' % str(e))
+                results.append((callback, result, error))
+            try:
+                db.commit()
+            except Exception, e:
+                db.rollback()
+                self.log.error('Database write failed: %s' % str(e))
+                results = [(r[0], None, r[2] or e) for r in results]
+        else:
+            db.commit()
+        results = [r for r in results if r[0]]
+        for callback, result, error in results:
+            # (Someone's waiting in call() for these, so answer them now)
+            if isinstance(callback, Reply):
+                callback(result, error)
+        results = [r for r in results if not isinstance(r[0], Reply)]
+        if results:
+            self.done.extend(results)
+            if self.wake:
+                self.wake()
+
+    def has_callbacks(self):
+        return bool(self.done)
+
+    def run_callbacks(self):
+        """Run the callbacks of any writes that have been committed. Returns
+        the number of callbacks run.
+        """
+        ran = 0
+        while self.done:
+            callback, result, error = self.done.popleft()
+            callback(result, error)
+            ran += 1
+        return ran
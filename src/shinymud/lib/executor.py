@@ -0,0 +1,89 @@
+from collections import deque
+import threading
+import Queue
+
+class Executor(object):
+    """A pool of worker threads for blocking work (like sending email) that
+    shouldn't hold up the world's turns.
+
+    submit() a function, and a worker thread runs it. When it's done, its
+    callback is handed back to the main loop, which runs it (with the result,
+    or the exception the function raised) the next time it calls
+    run_callbacks() -- so callbacks, unlike the functions themselves, are free
+    to mess with the game.
+
+    With no workers, functions are just run (and their callbacks called)
+    straight away.
+
+    Example:
+        def sent(result, error):
+            if error:
+                player.update_output('Your mail could not be sent.')
+        world.executor.submit(mail.send, callback=sent)
+    """
+    def __init__(self, workers=2, wake=None):
+        self.workers = workers
+        # Called (from a worker thread) whenever there's a callback waiting,
+        # so a sleeping main loop knows to wake up and run it
+        self.wake = wake
+        self.jobs = Queue.Queue()
+        self.done = deque()
+        self.threads = [] # (started when the first job is submitted)
+
+    def submit(self, func, args=(), callback=None):
+        """Run func(*args) in a worker thread, and then callback(result,
+        error) in the main loop.
+        """
+        if not self.workers:
+            self._run((func, args, callback))
+            self.run_callbacks()
+            return
+        if not self.threads:
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        self.jobs.put((func, args, callback))
+
+    def _run(self, job):
+        func, args, callback = job
+        result = error = None
+        try:
+            result = func(*args)
+        except Exception, e:
+            error = e
+        if callback:
+            self.done.append((callback, result, error))
+            if self.wake:
+                self.wake()
+
+    def _work(self):
+        while 1:
+            job = self.jobs.get()
+            if job is None:
+                return
+            self._run(job)
+
+    def has_callbacks(self):
+        return bool(self.done)
+
+    def run_callbacks(self):
+        """Run the callbacks of any jobs that have finished. Returns the number
+        of callbacks run.
+        """
+        ran = 0
+        while self.done:
+            callback, result, error = self.done.popleft()
+            callback(result, error)
+            ran += 1
+        return ran
+
+    def shutdown(self):
+        """Let the workers finish what they're doing, and stop them."""
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.workers = 0
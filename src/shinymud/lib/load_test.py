@@ -0,0 +1,556 @@
+"""A headless bot-swarm load generator for ShinyMUD.
+
+The load test starts a private game server (with an in-memory database and
+the built-in areas) in a separate process, then connects swarms of scripted
+bots to its TelnetHandler and WebsocketHandler over real sockets. Each bot
+creates a new character through InitMode and then plays the game with a mix
+of common commands (look, go, say, chat, get, drop, buy), waiting a little
+between commands like a real player would.
+
+For each swarm size we report command round-trip latency percentiles,
+command throughput and the server's tick stats, so that the numbers from one
+release can be compared with the next. Run it with:
+    python main.py loadtest --bots 10,100,1000
+(see "python main.py loadtest --help" for the rest of the options).
+
+A command's round-trip time is measured from when the bot sends it until the
+bot has seen both the reply to that command (see COMMANDS) and the prompt
+that follows it. Waiting for the reply, not just the next prompt, keeps other
+bots' chatter from counting as our answer.
+"""
+from shinymud.data.config import PREPACK, DEFAULT_LOCATION, item_color, \
+                                 clear_fcolor
+from shinymud.lib.reactor import Reactor
+from shinymud.lib.scheduler import Scheduler
+from shinymud.lib.tick_stats import TickStats, percentile
+from shinymud.lib.connection_handlers.websocket_frames import encode_frame, \
+     accept_key, MessageDeflater, FrameParser, ProtocolError, TEXT
+
+from optparse import OptionParser
+from multiprocessing import Process, Pipe
+import random
+import base64
+import socket
+import errno
+import json
+import time
+import re
+
+HOST = '127.0.0.1'
+
+# The prompts a new player sees while creating a character, and what our bots
+# answer them with
+LOGIN_SCRIPT = [('Name: ', 'new'),
+                ('using only letters', '%(name)s'),
+                ('choose a password', '%(password)s'),
+                ('Re-enter', '%(password)s'),
+                ('Gender: ', 'male'),
+                ('(Y/N): ', 'no')
+               ]
+
+# command name: (weight, regexp that matches the reply to this command)
+COMMANDS = {'look': (30, r'exits: '),
+            'go': (25, r'exits: |The door is closed|can\'t go that way'),
+            'say': (15, None), # We listen for the bot's own words
+            'chat': (5, None),
+            'get': (10, r'You get|doesn\'t exist|can\'t take that'),
+            'drop': (10, r'You drop|You don\'t have that'),
+            'buy': (5, r'merchants here|sale list|anything for sale')
+           }
+
+PROMPT_REGEXP = re.compile(r'<HP:\d+/\d+ MP:\d+/\d+> ')
+EXITS_REGEXP = re.compile(r'exits: ([a-z, ]+)')
+ITEM_REGEXP = re.compile(re.escape(item_color) + r'(.*?)' +
+                         re.escape(clear_fcolor))
+# Telnet negotiations (option requests, subnegotiations and other commands)
+TELNET_REGEXP = re.compile(r'\xff[\xfb-\xfe].|\xff\xfa.*?\xff\xf0|\xff[^\xfa]',
+                           re.S)
+
+def bot_name(index):
+    """Return a unique (letters-only) player name for bot number index."""
+    letters = ''
+    while True:
+        index, r = divmod(index, 26)
+        letters = chr(ord('a') + r) + letters
+        if not index:
+            break
+    return 'bot' + letters
+
+def random_bytes(count):
+    return ''.join([chr(random.randint(0, 255)) for i in range(count)])
+
+
+class Bot(object):
+    """A scripted client that logs a new character in and plays the game."""
+
+    def __init__(self, swarm, index, transport):
+        self.swarm = swarm
+        self.name = bot_name(index)
+        self.password = 'shiny' + self.name
+        self.transport = transport
+        self.sock = None
+        self.state = 'connecting'
+        self.raw = '' # bytes we haven't been able to decode yet
+        self.buffer = '' # decoded text we haven't matched against yet
+        self.login_step = 0
+        self.connect_time = None
+        self.exits = []
+        self.room_items = []
+        self.inventory = []
+        self.seq = 0
+        self.pending = None # (command, reply regexp, argument, time sent)
+        self.reply_end = None # where the reply to our command ended
+        self.timeout = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def connect(self, port):
+        self.connect_time = time.time()
+        self.sock = socket.create_connection((HOST, port))
+        self.sock.setblocking(0)
+        self.swarm.reactor.register(self, self)
+        if self.transport == 'websocket':
+            key = base64.b64encode(random_bytes(16))
+            self.ws_answer = accept_key(key)
+            self.state = 'handshake'
+            self.sock.sendall('GET / HTTP/1.1\r\n'
+                              'Upgrade: websocket\r\n'
+                              'Connection: Upgrade\r\n'
+                              'Host: %s:%s\r\n'
+                              'Origin: http://%s\r\n'
+                              'Sec-WebSocket-Version: 13\r\n'
+                              'Sec-WebSocket-Key: %s\r\n'
+                              'Sec-WebSocket-Extensions: permessage-deflate\r\n'
+                              '\r\n' % (HOST, port, HOST, key))
+        else:
+            self.state = 'login'
+
+    def send_line(self, line):
+        if self.transport == 'websocket':
+            data = encode_frame(TEXT, line, mask=random_bytes(4))
+        else:
+            data = line + '\r\n'
+        try:
+            self.sock.sendall(data)
+        except socket.error:
+            self.close('send failed')
+
+    def close(self, reason=None):
+        if self.state == 'closed':
+            return
+        if reason and self.state != 'done':
+            self.swarm.errors.append('%s: %s' % (self.name, reason))
+        self.state = 'closed'
+        if self.timeout:
+            self.timeout.cancel()
+        self.swarm.reactor.unregister(self)
+        self.sock.close()
+
+    def handle_read(self):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self.close(str(e))
+            return
+        if not data:
+            self.close('connection closed by the server')
+            return
+        self.raw += data
+        if self.transport == 'websocket':
+            self.buffer += self.decode_websocket()
+        else:
+            self.buffer += self.decode_telnet()
+        if self.state in ('login', 'entering'):
+            self.do_login()
+        elif self.state == 'playing':
+            self.check_reply()
+
+    def decode_telnet(self):
+        """Strip telnet negotiations out of our raw data (answering any that
+        need an answer) and return what's left.
+        """
+        # Hold onto a negotiation that's been split between reads
+        cut = self.raw.rfind('\xff', -2)
+        if cut != -1 and not (cut == len(self.raw) - 2 and
+                              self.raw[cut + 1] < '\xfa'):
+            data, self.raw = self.raw[:cut], self.raw[cut:]
+        else:
+            data, self.raw = self.raw, ''
+        # The server asks about linemode, window size and compression; we
+        # don't want any of them
+        if '\xff\xfb\x22' in data:
+            self.sock.sendall('\xff\xfe\x22') # IAC DONT LINEMODE
+        if '\xff\xfb\x56' in data:
+            self.sock.sendall('\xff\xfe\x56') # IAC DONT COMPRESS2
+        if '\xff\xfb\xc9' in data:
+            self.sock.sendall('\xff\xfe\xc9') # IAC DONT GMCP
+        if '\xff\xfd\x1f' in data:
+            self.sock.sendall('\xff\xfc\x1f') # IAC WONT NAWS
+        return TELNET_REGEXP.sub('', data)
+
+    def decode_websocket(self):
+        """Pull complete websocket messages out of our raw data and return
+        their text.
+        """
+        if self.state == 'handshake':
+            end = self.raw.find('\r\n\r\n')
+            if end == -1:
+                return ''
+            headers = self.raw[:end]
+            if 'Sec-WebSocket-Accept: %s' % self.ws_answer not in headers:
+                self.close('bad websocket handshake')
+                return ''
+            deflater = None
+            if 'permessage-deflate' in headers:
+                deflater = MessageDeflater()
+            self.ws_parser = FrameParser(deflater, masked=False,
+                                         max_size=1024 * 1024)
+            self.raw = self.raw[end + 4:]
+            self.state = 'login'
+        data, self.raw = self.raw, ''
+        try:
+            messages = self.ws_parser.feed(data)
+        except ProtocolError, e:
+            self.close(str(e))
+            return ''
+        return ''.join([payload + '\n' for opcode, payload in messages
+                        if opcode == TEXT])
+
+    def do_login(self):
+        if self.state == 'login':
+            expect, answer = LOGIN_SCRIPT[self.login_step]
+            if expect in self.buffer:
+                self.buffer = ''
+                self.login_step += 1
+                if self.login_step == len(LOGIN_SCRIPT):
+                    self.state = 'entering'
+                self.send_line(answer % {'name': self.name,
+                                         'password': self.password})
+        elif 'exits: ' in self.buffer and PROMPT_REGEXP.search(self.buffer):
+            # We've made it into the world!
+            self.parse_room(self.buffer)
+            self.buffer = ''
+            self.state = 'playing'
+            self.swarm.logged_in(self, time.time() - self.connect_time)
+            self.think()
+
+    def think(self):
+        """Wait a bit (like a real player would) before our next command."""
+        t = self.swarm.think_time
+        self.swarm.scheduler.call_later(random.uniform(0.5 * t, 1.5 * t),
+                                        self.send_command)
+
+    def choose_command(self):
+        """Pick a command from our mix and return (command, argument)."""
+        total = sum([weight for weight, reply in COMMANDS.values()])
+        pick = random.uniform(0, total)
+        for name, (weight, reply) in sorted(COMMANDS.items()):
+            pick -= weight
+            if pick <= 0:
+                break
+        self.seq += 1
+        if name == 'go' and not self.exits:
+            name = 'look'
+        if name == 'drop' and not self.inventory:
+            name = 'get'
+        if name == 'go':
+            return name, random.choice(self.exits)
+        if name in ('say', 'chat'):
+            return name, '%sx%s' % (self.name, self.seq)
+        if name == 'get':
+            words = ' '.join(self.room_items).split() or ['thing']
+            return name, random.choice(words).strip('.,!').lower()
+        if name == 'drop':
+            return name, random.choice(self.inventory)
+        return name, ''
+
+    def send_command(self):
+        if self.state != 'playing':
+            return
+        command, arg = self.choose_command()
+        reply = COMMANDS[command][1] or re.escape(arg)
+        self.pending = (command, re.compile(reply), arg, time.time())
+        self.reply_end = None
+        self.buffer = ''
+        self.timeout = self.swarm.scheduler.call_later(self.swarm.cmd_timeout,
+                                                       self.timed_out)
+        self.send_line((command + ' ' + arg).strip())
+
+    def check_reply(self):
+        if not self.pending:
+            # Nobody asked, but keep track of where we are
+            self.parse_room(self.buffer)
+            self.buffer = ''
+            return
+        command, reply, arg, sent = self.pending
+        if self.reply_end is None:
+            match = reply.search(self.buffer)
+            if not match:
+                return
+            self.reply_end = match.end()
+        if PROMPT_REGEXP.search(self.buffer, self.reply_end):
+            self.swarm.command_done(command, time.time() - sent)
+            self.timeout.cancel()
+            self.timeout = None
+            self.pending = None
+            self.parse_room(self.buffer)
+            if command == 'get' and 'You get' in self.buffer:
+                self.inventory.append(arg)
+            elif command == 'drop' and 'You drop' in self.buffer:
+                self.inventory.remove(arg)
+            self.buffer = ''
+            self.think()
+
+    def timed_out(self):
+        self.timeout = None
+        self.swarm.command_timed_out(self.pending[0])
+        self.pending = None
+        self.think()
+
+    def parse_room(self, text):
+        """Remember the exits and items of the room we're in (if text is a
+        description of it).
+        """
+        match = EXITS_REGEXP.search(text)
+        if match:
+            self.exits = [e.strip() for e in match.group(1).split(',')
+                          if e.strip() and e.strip() != 'None']
+            self.room_items = ITEM_REGEXP.findall(text)
+
+
+class Swarm(object):
+    """A group of bots connected to the server at the same time, along with
+    the measurements we've taken of them.
+    """
+    def __init__(self, size, options):
+        self.size = size
+        self.options = options
+        self.think_time = options.think
+        self.cmd_timeout = options.timeout
+        self.reactor = Reactor()
+        self.scheduler = Scheduler()
+        self.bots = []
+        self.login_times = []
+        self.latencies = {}
+        self.timeouts = 0
+        self.errors = []
+        self.measuring = False
+
+    def logged_in(self, bot, login_time):
+        self.login_times.append(login_time)
+
+    def command_done(self, command, latency):
+        if self.measuring:
+            self.latencies.setdefault(command, []).append(latency)
+
+    def command_timed_out(self, command):
+        if self.measuring:
+            self.timeouts += 1
+
+    def run(self, first_index, server):
+        """Connect our bots, wait for them to log in, then measure them for
+        options.duration seconds. server is the Pipe to the server process.
+        """
+        opts = self.options
+        ws_every = 0
+        if opts.websocket > 0:
+            ws_every = max(1, int(round(1 / opts.websocket)))
+        for i in range(self.size):
+            transport = 'telnet'
+            if ws_every and (i % ws_every) == (ws_every - 1):
+                transport = 'websocket'
+            self.bots.append(Bot(self, first_index + i, transport))
+        # Connect the bots gradually (opts.ramp per second), so we don't
+        # overflow the handlers' listen backlog
+        start = time.time()
+        for i, bot in enumerate(self.bots):
+            port = opts.websocket_port if bot.transport == 'websocket' else \
+                   opts.telnet_port
+            self.scheduler.call_at(start + float(i) / opts.ramp, bot.connect,
+                                   port)
+        login_deadline = start + float(self.size) / opts.ramp + opts.timeout
+        self.loop(lambda: len(self.login_times) + len(self.errors) < self.size
+                          and time.time() < login_deadline)
+
+        server.send('reset')
+        server.recv()
+        self.measuring = True
+        self.start = time.time()
+        self.loop(lambda: time.time() < self.start + opts.duration)
+        self.elapsed = time.time() - self.start
+        self.measuring = False
+        server.send('stats')
+        self.tick_stats = server.recv()
+
+        for bot in self.bots:
+            if bot.sock:
+                bot.state = 'done'
+                bot.close()
+        self.reactor.close()
+
+    def loop(self, keep_going):
+        while keep_going():
+            timeout = 0.1
+            deadline = self.scheduler.next_deadline()
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+            for bot, events in self.reactor.poll(timeout):
+                bot.handle_read()
+            self.scheduler.run_due()
+
+    def results(self):
+        """Return a dictionary of the results of this swarm's run."""
+        r = {'bots': self.size,
+             'websocket_bots': len([b for b in self.bots
+                                    if b.transport == 'websocket']),
+             'logged_in': len(self.login_times),
+             'login_ms': self.summarize(self.login_times),
+             'duration': self.elapsed,
+             'timeouts': self.timeouts,
+             'errors': len(self.errors),
+             'commands': {},
+             'tick_stats': self.tick_stats
+            }
+        every = []
+        for command, times in self.latencies.items():
+            r['commands'][command] = self.summarize(times)
+            every.extend(times)
+        r['latency_ms'] = self.summarize(every)
+        r['throughput'] = len(every) / self.elapsed
+        return r
+
+    def summarize(self, times):
+        values = sorted(times)
+        return {'p50': percentile(values, 50) * 1000,
+                'p95': percentile(values, 95) * 1000,
+                'p99': percentile(values, 99) * 1000,
+                'max': (values[-1] if values else 0) * 1000,
+                'count': len(values)
+               }
+
+
+def serve(telnet_port, websocket_port, pipe):
+    """Run a private game server with an in-memory database and the built-in
+    areas. We take orders ('reset', 'stats', 'stop') from the load test over
+    pipe.
+    """
+    from shinymud.lib.world import World
+    world = World(':memory:')
+    from shinymud.lib.setup import initialize_database
+    from shinymud.lib.sport import inport_dir
+    from shinymud.lib.connection_handlers import con_handlers
+
+    initialize_database()
+    inport_dir('area', source_path=PREPACK)
+    for area in world.areas.values():
+        area.reset()
+    world.default_location = world.get_location(DEFAULT_LOCATION[0],
+                                                DEFAULT_LOCATION[1])
+    listener = con_handlers.ConnectionListener(world)
+    listener.add_handler(con_handlers.TelnetHandler(telnet_port, HOST, world))
+    listener.add_handler(con_handlers.WebsocketHandler(websocket_port, HOST,
+                                                       world))
+    listener.start()
+
+    def check_orders():
+        while pipe.poll():
+            order = pipe.recv()
+            if order == 'reset':
+                world.tick_stats.reset()
+                pipe.send('ok')
+            elif order == 'stats':
+                pipe.send({'turns': world.tick_stats.turns,
+                           'phases': world.tick_stats.summary(),
+                           'counters': world.tick_stats.counter_summary()})
+            elif order == 'stop':
+                world.shutdown_flag = True
+                return
+        world.scheduler.call_later(0.1, check_orders)
+    check_orders()
+    pipe.send('ready')
+    world.start_turning()
+
+def report(r):
+    """Return a human-readable report of a swarm's results."""
+    lines = [(' %s bots ' % r['bots']).center(70, '-'),
+             'bots: %s (%s over websocket), %s logged in, %s errors' %
+                (r['bots'], r['websocket_bots'], r['logged_in'], r['errors']),
+             'login: p50 %(p50).1fms, p95 %(p95).1fms, max %(max).1fms' %
+                r['login_ms'],
+             'commands: %s in %.1fs (%.1f/sec), %s timed out' %
+                (r['latency_ms']['count'], r['duration'], r['throughput'],
+                 r['timeouts']),
+             '%-10s%10s%10s%10s%10s%10s' % ('latency', 'count', 'p50(ms)',
+                                            'p95(ms)', 'p99(ms)', 'max(ms)')
+            ]
+    rows = sorted(r['commands'].items()) + [('all', r['latency_ms'])]
+    for name, s in rows:
+        lines.append('%-10s%10s%10.2f%10.2f%10.2f%10.2f' %
+                     (name, s['count'], s['p50'], s['p95'], s['p99'], s['max']))
+    ticks = r['tick_stats']
+    lines.append('%-10s%10s%10s%10s%10s%10s' % ('tick', 'turns', 'p50(ms)',
+                                                'p95(ms)', 'p99(ms)', 'max(ms)'))
+    for phase in TickStats.PHASES + ['turn']:
+        s = ticks['phases'][phase]
+        lines.append('%-10s%10s%10.2f%10.2f%10.2f%10.2f' %
+                     (phase, s['count'], s['p50'], s['p95'], s['p99'], s['max']))
+    for name, c in sorted(ticks['counters'].items()):
+        lines.append('%s per turn: p50 %s, p95 %s, max %s' % (name, c['p50'],
+                                                              c['p95'], c['max']))
+    return '\n'.join(lines)
+
+def main(args):
+    parser = OptionParser(usage='python main.py loadtest [options]')
+    parser.add_option('-b', '--bots', default='10,100,1000',
+                      help='comma-separated swarm sizes to run [%default]')
+    parser.add_option('-d', '--duration', type='float', default=30,
+                      help='seconds to measure each swarm for [%default]')
+    parser.add_option('-w', '--websocket', type='float', default=0.2,
+                      help='fraction of bots to connect over websocket '
+                           '[%default]')
+    parser.add_option('--think', type='float', default=2.0,
+                      help='average seconds bots wait between commands '
+                           '[%default]')
+    parser.add_option('--ramp', type='float', default=100,
+                      help='bots to connect per second [%default]')
+    parser.add_option('--timeout', type='float', default=10,
+                      help='seconds to wait for a reply [%default]')
+    parser.add_option('--telnet-port', type='int', default=4211)
+    parser.add_option('--websocket-port', type='int', default=4212)
+    parser.add_option('-o', '--output',
+                      help='append the results to this file as JSON lines')
+    options, args = parser.parse_args(args)
+    sizes = [int(s) for s in options.bots.split(',')]
+
+    pipe, server_pipe = Pipe()
+    server = Process(target=serve, args=(options.telnet_port,
+                                         options.websocket_port, server_pipe))
+    server.start()
+    pipe.recv()
+    print 'Load test server running on ports %s (telnet) and %s (websocket).' %\
+          (options.telnet_port, options.websocket_port)
+    index = 0
+    try:
+        for size in sizes:
+            swarm = Swarm(size, options)
+            swarm.run(index, pipe)
+            index += size
+            results = swarm.results()
+            results['time'] = time.time()
+            print report(results)
+            for error in swarm.errors[:10]:
+                print 'ERROR ' + error
+            if options.output:
+                f = open(options.output, 'a')
+                f.write(json.dumps(results) + '\n')
+                f.close()
+            # Give the server a moment to log the last swarm out
+            time.sleep(1)
+    finally:
+        pipe.send('stop')
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
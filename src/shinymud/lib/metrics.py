@@ -0,0 +1,135 @@
+"""Game metrics, for the MetricsHandler to serve.
+
+The world calls snapshot() every METRICS_INTERVAL seconds (if a handler that
+wants them is running) and keeps the result as world.metrics. A snapshot is a
+plain dictionary (of things JSON can handle) that nothing else holds a
+reference to, so the connection handlers' thread can turn it into Prometheus
+text (see format_prometheus) or JSON whenever it's asked to, without ever
+touching the live player list, areas or stats. The server's memory use isn't
+part of the snapshot; whoever serves it adds rss_bytes() when asked.
+"""
+import resource
+import time
+import os
+
+def rss_bytes():
+    """Return how much memory the server is using (its resident set size), in
+    bytes.
+    """
+    try:
+        f = open('/proc/self/statm')
+        try:
+            pages = int(f.read().split()[1])
+        finally:
+            f.close()
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        # No /proc (not linux); settle for the most we've ever used, which
+        # getrusage gives in kilobytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def snapshot(world):
+    """Return a dictionary of the world's current metrics."""
+    players = []
+    connections = {}
+    for player in world.player_list.values():
+        if isinstance(player.name, basestring):
+            players.append(player.name)
+        kind = player.conn.__class__.__name__
+        connections[kind] = connections.get(kind, 0) + 1
+    areas = {}
+    for name, area in world.areas.items():
+        areas[name] = {'rooms': len(area.rooms), 'items': len(area.items),
+                       'npcs': len(area.npcs), 'scripts': len(area.scripts)}
+    stats = world.tick_stats
+    tick = {}
+    for phase in stats.PHASES + ['turn']:
+        buckets, total, count = stats.histogram(phase)
+        # (JSON has no infinity)
+        buckets[-1] = ('+Inf', buckets[-1][1])
+        tick[phase] = {'buckets': buckets, 'sum': total, 'count': count}
+    db = {}
+    query_stats = [world.db.query_stats]
+    if world.db_writer:
+        # (Most of our writes are made by the db_writer's connection)
+        query_stats.append(world.db_writer.query_stats)
+    for conn_stats in query_stats:
+        for kind, (count, seconds) in conn_stats.items():
+            totals = db.setdefault(kind, {'count': 0, 'seconds': 0.0})
+            totals['count'] += count
+            totals['seconds'] += seconds
+    return {'time': time.time(),
+            'uptime': world.uptime,
+            'turns': stats.turns,
+            'players': sorted(players),
+            'connections': connections,
+            'reaped': dict(world.reaped),
+            'battles': len(world.battles),
+            'active_npcs': len(world.active_npcs),
+            'areas': areas,
+            'tick': tick,
+            'db': db
+           }
+
+def escape(label):
+    """Escape a label value for the Prometheus text format."""
+    return str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_prometheus(snap):
+    """Return a snapshot in the Prometheus text exposition format."""
+    lines = []
+    def metric(name, kind, help, samples):
+        lines.append('# HELP shinymud_%s %s' % (name, help))
+        lines.append('# TYPE shinymud_%s %s' % (name, kind))
+        for labels, value in samples:
+            label_string = ''
+            if labels:
+                label_string = '{%s}' % ','.join(['%s="%s"' % (k, escape(v))
+                                                  for k, v in labels])
+            lines.append('shinymud_%s%s %s' % (name, label_string, value))
+
+    metric('start_time_seconds', 'gauge',
+           'When the server was started, in seconds since the epoch.',
+           [((), snap['uptime'])])
+    metric('players_online', 'gauge', 'Players who have logged in.',
+           [((), len(snap['players']))])
+    metric('connections', 'gauge', 'Open player connections.',
+           [((('type', kind),), count)
+            for kind, count in sorted(snap['connections'].items())])
+    metric('sessions_reaped_total', 'counter',
+           'Idle sessions (and stalled logins) that have been disconnected.',
+           [((('reason', reason),), count)
+            for reason, count in sorted(snap['reaped'].items())])
+    metric('battles_active', 'gauge', 'Battles being fought.',
+           [((), snap['battles'])])
+    metric('npcs_active', 'gauge', 'Npcs with commands waiting to be run.',
+           [((), snap['active_npcs'])])
+    samples = []
+    for area, counts in sorted(snap['areas'].items()):
+        for kind, count in sorted(counts.items()):
+            samples.append(((('area', area), ('kind', kind)), count))
+    metric('area_objects', 'gauge', 'Rooms, items, npcs and scripts per area.',
+           samples)
+
+    lines.append('# HELP shinymud_tick_seconds How long each phase of the '
+                 'world\'s turns took.')
+    lines.append('# TYPE shinymud_tick_seconds histogram')
+    for phase, histogram in sorted(snap['tick'].items()):
+        for bound, count in histogram['buckets']:
+            lines.append('shinymud_tick_seconds_bucket{phase="%s",le="%s"} %s'
+                         % (phase, bound, count))
+        lines.append('shinymud_tick_seconds_sum{phase="%s"} %s' %
+                     (phase, histogram['sum']))
+        lines.append('shinymud_tick_seconds_count{phase="%s"} %s' %
+                     (phase, histogram['count']))
+
+    metric('db_queries_total', 'counter', 'Database queries run.',
+           [((('kind', kind),), stats['count'])
+            for kind, stats in sorted(snap['db'].items())])
+    metric('db_query_seconds_total', 'counter',
+           'Time spent running database queries.',
+           [((('kind', kind),), stats['seconds'])
+            for kind, stats in sorted(snap['db'].items())])
+    metric('resident_memory_bytes', 'gauge', 'Resident memory size.',
+           [((), snap['rss_bytes'])])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,41 @@
+import time
+
+class TokenBucket(object):
+    """A token bucket rate limiter.
+
+    The bucket holds up to burst tokens, and refills at rate tokens per
+    second. Each thing we want to limit (like a line of input from a player)
+    costs a token; when the bucket's empty, the limit has been hit.
+
+    Example:
+        bucket = TokenBucket(5, 20) # 5 per second, in bursts of up to 20
+        if not bucket.consume():
+            player.update_output('Slow down!')
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time()
+
+    def _refill(self, now):
+        if now is None:
+            now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def consume(self, count=1, now=None):
+        """Take count tokens from the bucket. Returns False (and takes
+        nothing) if there aren't enough.
+        """
+        self._refill(now)
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+    def full(self, now=None):
+        """Return True if the bucket has refilled completely."""
+        self._refill(now)
+        return self.tokens >= self.burst
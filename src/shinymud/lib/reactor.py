@@ -0,0 +1,172 @@
+import select
+import errno
+import fcntl
+import time
+import os
+
+# Event masks. These share their values with the poll/epoll constants on
+# every platform we care about, but we define them ourselves so the select()
+# fallback can use them too.
+READ = getattr(select, 'POLLIN', 1)
+WRITE = getattr(select, 'POLLOUT', 4)
+ERROR = getattr(select, 'POLLERR', 8) | getattr(select, 'POLLHUP', 16) |\
+        getattr(select, 'POLLNVAL', 32)
+
+class Reactor(object):
+    """The Reactor watches a set of connections and reports which of them are
+    ready to be read from or written to.
+
+    The World uses a Reactor (instead of sleeping between turns and polling
+    every player's socket) so that it only wakes up when a client actually
+    has something to say, or when it's time for the next game turn.
+
+    Anything that has a fileno() function can be registered, along with a
+    handler object that poll() hands back when that connection is ready. We use
+    the best polling mechanism this platform has to offer: epoll if it's
+    available, then poll, then plain old select.
+    
+    Other threads can call wake() to make a poll() that's in progress return
+    right away.
+    """
+    def __init__(self):
+        self.handlers = {} # fileno -> handler
+        self.events = {} # fileno -> event mask
+        if hasattr(select, 'epoll'):
+            self.backend = 'epoll'
+            self._poller = select.epoll()
+        elif hasattr(select, 'poll'):
+            self.backend = 'poll'
+            self._poller = select.poll()
+        else:
+            self.backend = 'select'
+            self._poller = None
+        # A pipe that we write a byte to when we want to interrupt poll()
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.handlers[self._wake_r] = self
+        self.events[self._wake_r] = READ
+        if self._poller:
+            self._poller.register(self._wake_r, READ)
+
+    def register(self, conn, handler, events=READ):
+        """Start watching conn for the given events. When conn becomes ready,
+        poll() will return handler.
+        Registering a connection that is already being watched just updates
+        its handler and events.
+        """
+        fd = conn.fileno()
+        if fd in self.handlers:
+            self.handlers[fd] = handler
+            self.modify(conn, events)
+            return
+        self.handlers[fd] = handler
+        self.events[fd] = events
+        if self._poller:
+            self._poller.register(fd, events)
+
+    def modify(self, conn, events):
+        """Change the events we are watching conn for."""
+        fd = conn.fileno()
+        if fd not in self.handlers or self.events.get(fd) == events:
+            return
+        self.events[fd] = events
+        if self._poller:
+            self._poller.modify(fd, events)
+
+    def unregister(self, conn):
+        """Stop watching conn. It's safe to call this on a connection that
+        isn't registered (or has already been closed).
+        """
+        try:
+            fd = conn.fileno()
+        except Exception:
+            return
+        self._forget(fd)
+
+    def _forget(self, fd):
+        if fd not in self.handlers:
+            return
+        del self.handlers[fd]
+        del self.events[fd]
+        if self._poller:
+            try:
+                self._poller.unregister(fd)
+            except (KeyError, IOError, OSError, ValueError):
+                # The fd was closed out from under us -- epoll has already
+                # dropped it.
+                pass
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds for any registered connection to become
+        ready. Returns a list of (handler, events) tuples.
+        """
+        if timeout < 0:
+            timeout = 0
+        try:
+            if self.backend == 'epoll':
+                ready = self._poller.poll(timeout)
+            elif self.backend == 'poll':
+                ready = self._poller.poll(int(timeout * 1000))
+            else:
+                ready = self._select(timeout)
+        except (select.error, IOError, OSError), e:
+            # A signal interrupted our nap; just report that nothing happened
+            if e.args and e.args[0] == errno.EINTR:
+                return []
+            raise
+        result = []
+        for fd, events in ready:
+            handler = self.handlers.get(fd)
+            if handler is None:
+                continue
+            if fd == self._wake_r:
+                self._drain_wakeups()
+                continue
+            if events & getattr(select, 'POLLNVAL', 32):
+                # This fd was closed without being unregistered
+                self._forget(fd)
+                continue
+            result.append((handler, events))
+        return result
+
+    def wake(self):
+        """Make poll() return as soon as possible. This is safe to call from
+        any thread.
+        """
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError:
+            # The pipe is full, so poll() has plenty of wakeups waiting already
+            pass
+    
+    def _drain_wakeups(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except OSError:
+            pass
+    
+    def _select(self, timeout):
+        rlist = [fd for fd, ev in self.events.items() if ev & READ]
+        wlist = [fd for fd, ev in self.events.items() if ev & WRITE]
+        if not (rlist or wlist):
+            # select() on empty lists is an error on some platforms
+            time.sleep(timeout)
+            return []
+        r, w, x = select.select(rlist, wlist, [], timeout)
+        ready = {}
+        for fd in r:
+            ready[fd] = ready.get(fd, 0) | READ
+        for fd in w:
+            ready[fd] = ready.get(fd, 0) | WRITE
+        return ready.items()
+
+    def close(self):
+        if self.backend == 'epoll':
+            self._poller.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+        self.handlers.clear()
+        self.events.clear()
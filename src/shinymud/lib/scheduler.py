@@ -0,0 +1,119 @@
+import heapq
+import itertools
+import time
+
+class Timer(object):
+    """A callback that has been scheduled to run at a later time. Keep hold
+    of it if you might want to cancel() it before it runs.
+    """
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        self.callback(*self.args)
+
+class Scheduler(object):
+    """The Scheduler keeps track of callbacks that should be run at some point
+    in the future.
+
+    Timers are kept in a heap ordered by when they're due, so each world turn
+    only has to look at the timers that have actually expired rather than
+    checking everything that might ever need doing. Cancelled timers are just
+    flagged, and thrown away when they reach the top of the heap.
+
+    Example:
+        timer = world.scheduler.call_later(30, npc.perform, 'say Hello!')
+        # Changed our mind!
+        timer.cancel()
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count() # breaks ties between equal times
+
+    def __len__(self):
+        return len([t for _, _, t in self._heap if not t.cancelled])
+
+    def call_later(self, delay, callback, *args):
+        """Schedule callback(*args) to be run in delay seconds. Returns a
+        Timer object that can be used to cancel the callback.
+        """
+        return self.call_at(time.time() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        """Schedule callback(*args) to be run at (or shortly after) when,
+        given in seconds since the epoch. Returns a Timer object.
+        """
+        timer = Timer(when, callback, args)
+        heapq.heappush(self._heap, (when, self._counter.next(), timer))
+        return timer
+
+    def next_deadline(self):
+        """Return the time the next timer is due, or None if there aren't any
+        timers scheduled.
+        """
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def run_due(self, now=None):
+        """Run every timer that is due. Returns the number of timers run."""
+        if now is None:
+            now = time.time()
+        ran = 0
+        while self._heap and self._heap[0][0] <= now:
+            when, _, timer = heapq.heappop(self._heap)
+            if not timer.cancelled:
+                timer.run()
+                ran += 1
+        return ran
+
+class ActiveSet(object):
+    """An ordered set of objects that have work to do this turn (like npcs
+    with commands waiting in their cmdq).
+
+    Adding an object that's already in the set does nothing, so an object
+    gets ticked at most once per turn no matter how many times it was woken
+    up. Objects are ticked in the order they were added.
+    """
+    def __init__(self):
+        self._items = []
+        self._members = set()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, obj):
+        return obj in self._members
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def add(self, obj):
+        """Add obj to the end of the set, if it isn't already in it."""
+        if obj not in self._members:
+            self._members.add(obj)
+            self._items.append(obj)
+
+    def discard(self, obj):
+        """Remove obj from the set, if it's in it."""
+        if obj in self._members:
+            self._members.remove(obj)
+            self._items.remove(obj)
+
+    def drain(self):
+        """Empty the set, returning a list of everything that was in it.
+        Anything added while the drained objects are being processed goes into
+        the (now empty) set to be handled next turn.
+        """
+        items = self._items
+        self._items = []
+        self._members = set()
+        return items
@@ -13,7 +13,6 @@ EXISTING_TABLES = {}
 
 def initialize_database():
     world = World.get_world()
-    world.db.conn.cursor().execute('PRAGMA foreign_keys = true')
     db_table_names = [x['name'] for x in world.db.select("name from sqlite_master where type='table'")]
     for table_name in db_table_names:
         columns = world.db.select("* from %s limit 1" % table_name)
@@ -27,6 +26,8 @@ def initialize_database():
         for col in mod.db_columns:
             if col.name not in EXISTING_TABLES[mod.db_table_name]:
                 add_column(mod, col.name)
+    for mod in model_list.values():
+        create_indexes(mod)
 
 def create_table(model):
     if model.db_table_name in EXISTING_TABLES:
@@ -81,3 +82,14 @@ def add_column(mod, col):
         cursor = World.get_world().db.conn.cursor()
         cursor.execute(alter_stmt)
         EXISTING_TABLES[mod.db_table_name].append(col)
+
+def create_indexes(model):
+    """Create any of a model's column indexes that the database doesn't have
+    yet.
+    """
+    cursor = World.get_world().db.conn.cursor()
+    for col in model.db_columns:
+        if col.index:
+            cursor.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)' %
+                           (model.db_table_name, col.name,
+                            model.db_table_name, col.name))
@@ -2,7 +2,6 @@ from shinymud.lib.world import World
 # Initialize the World
 world = World()
 from shinymud.lib.setup import initialize_database
-from shinymud.models.area import Area
 from shinymud.data.config import *
 from shinymud.lib.connection_handlers import con_handlers
 
@@ -13,20 +12,17 @@ initialize_database()
 world.db.delete('from game_item where (owner is null or owner=\'None\') and container is null')
 
 # load the entities in the world from the database
-# This should probably happen inside the world itself...
-for area in world.db.select("* from area"):
-    world.area_add(Area.create(area))
-for area in world.areas.values():
-    area.load()
+world.load_areas()
 
 world.default_location = world.get_location(DEFAULT_LOCATION[0],
                                             DEFAULT_LOCATION[1])
 
-# Start up all of our connection handlers
+# Start listening with all of our connection handlers
+listener = con_handlers.ConnectionListener(world)
 for port, conn_handler in CONNECTIONS:
     handler_class = getattr(con_handlers, conn_handler)
-    handler_obj = handler_class(port, HOST, world)
-    handler_obj.start()
+    listener.add_handler(handler_class(port, HOST, world))
+listener.start()
 
 world.log.info('Started the connection handlers. Now listening for Players.')
 world.log.debug('The world is about to start turning.')
@@ -0,0 +1,199 @@
+from collections import deque
+
+import bisect
+import json
+import math
+import time
+
+def percentile(values, pct):
+    """Return the pct-th percentile (nearest-rank) of a sorted list of
+    values, or 0 if the list is empty.
+    """
+    if not values:
+        return 0
+    index = int(math.ceil(pct / 100.0 * len(values))) - 1
+    index = max(0, min(index, len(values) - 1))
+    return values[index]
+
+class TickStats(object):
+    """TickStats times each phase of every world turn.
+
+    The World calls start_turn() at the beginning of a turn, lap(phase) after
+    each phase finishes, and end_turn() when the turn is done. We keep the
+    last window_size timings of each phase so we can report rolling
+    percentiles, and every dump_interval seconds we append a summary of them
+    to a JSON-lines file (one JSON object per line) so slow turns can be
+    tracked down after the fact.
+
+    The world can also tally(name, value) per-turn counts (like how many
+    npcs were ticked); these get the same rolling percentiles as the timings.
+    
+    Every timing is also counted into a histogram (with HISTOGRAM_BUCKETS as
+    the upper bounds of its buckets) that covers every turn since the stats
+    were last reset, for the metrics endpoint to export.
+
+    All times are kept in seconds, but reported in milliseconds.
+    """
+    PHASES = ['npcs', 'players', 'cleanup', 'output', 'battles', 'timers',
+              'saves']
+    HISTOGRAM_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                         0.25, 0.5, 1.0]
+
+    def __init__(self, window_size=1000, logfile=None, dump_interval=60):
+        self.window_size = window_size
+        self.logfile = logfile
+        self.dump_interval = dump_interval
+        self._turn_start = None
+        self._lap_start = None
+        self.reset()
+
+    def reset(self):
+        """Forget all of the timings we've collected so far. This is safe to
+        call in the middle of a turn.
+        """
+        self.timings = {}
+        self.histograms = {}
+        for phase in self.PHASES + ['turn']:
+            self.timings[phase] = deque(maxlen=self.window_size)
+            # Counts for each bucket (plus one for times over the last
+            # bucket), and the sum of all the times counted
+            self.histograms[phase] = {'counts': [0] * (len(self.HISTOGRAM_BUCKETS) + 1),
+                                      'sum': 0.0}
+        self.counters = {}
+        self.turns = 0
+        self.last_turn = {}
+        self.last_dump = time.time()
+
+    def start_turn(self):
+        self._turn_start = self._lap_start = time.time()
+        self.last_turn = {}
+
+    def lap(self, phase):
+        """Record the time spent in phase since the last lap (or since the
+        turn started).
+        """
+        now = time.time()
+        elapsed = now - self._lap_start
+        self.timings[phase].append(elapsed)
+        self.observe(phase, elapsed)
+        self.last_turn[phase] = elapsed
+        self._lap_start = now
+
+    def observe(self, phase, elapsed):
+        """Count a time (in seconds) into phase's histogram."""
+        histogram = self.histograms[phase]
+        histogram['counts'][bisect.bisect_left(self.HISTOGRAM_BUCKETS, elapsed)] += 1
+        histogram['sum'] += elapsed
+    
+    def histogram(self, phase):
+        """Return phase's histogram as (buckets, sum, count), buckets being a
+        list of (upper bound, number of times <= that bound) pairs -- the last
+        bound being infinity.
+        """
+        histogram = self.histograms[phase]
+        buckets = []
+        total = 0
+        for bound, count in zip(self.HISTOGRAM_BUCKETS + [float('inf')],
+                                histogram['counts']):
+            total += count
+            buckets.append((bound, total))
+        return buckets, histogram['sum'], total
+    
+    def tally(self, name, value):
+        """Record a count for this turn under name."""
+        if name not in self.counters:
+            self.counters[name] = deque(maxlen=self.window_size)
+        self.counters[name].append(value)
+    
+    def end_turn(self):
+        """Record the time of the whole turn, and dump our stats to the
+        logfile if it's time to. Returns the length of the turn (in seconds).
+        """
+        now = time.time()
+        elapsed = now - self._turn_start
+        self.timings['turn'].append(elapsed)
+        self.observe('turn', elapsed)
+        self.last_turn['turn'] = elapsed
+        self.turns += 1
+        if self.logfile and (now - self.last_dump) >= self.dump_interval:
+            self.dump()
+        return elapsed
+
+    def summary(self):
+        """Return a dictionary of phase: {'p50', 'p95', 'p99', 'max', 'count'}
+        for each phase (and the turn as a whole), with times in milliseconds.
+        """
+        s = {}
+        for phase, times in self.timings.items():
+            values = sorted(times)
+            s[phase] = {'p50': percentile(values, 50) * 1000,
+                        'p95': percentile(values, 95) * 1000,
+                        'p99': percentile(values, 99) * 1000,
+                        'max': (values[-1] if values else 0) * 1000,
+                        'count': len(values)
+                       }
+        return s
+
+    def counter_summary(self):
+        """Return a dictionary of counter: {'p50', 'p95', 'max', 'last'} for
+        each of the counters that have been tallied.
+        """
+        s = {}
+        for name, counts in self.counters.items():
+            values = sorted(counts)
+            s[name] = {'p50': percentile(values, 50),
+                       'p95': percentile(values, 95),
+                       'max': values[-1] if values else 0,
+                       'last': counts[-1] if counts else 0
+                      }
+        return s
+
+    def dump(self):
+        """Append a summary of our current stats to the logfile."""
+        self.last_dump = time.time()
+        record = {'time': self.last_dump,
+                  'turns': self.turns,
+                  'phases': self.summary(),
+                  'counters': self.counter_summary()
+                 }
+        try:
+            f = open(self.logfile, 'a')
+        except IOError:
+            return
+        try:
+            f.write(json.dumps(record) + '\n')
+        finally:
+            f.close()
+
+    def format_last_turn(self):
+        """Return a one-line string of how long each phase of the last turn
+        took, for logging slow turns.
+        """
+        return ', '.join(['%s: %.1fms' % (p, self.last_turn[p] * 1000)
+                          for p in self.PHASES + ['turn'] if p in self.last_turn])
+
+    def display(self):
+        """Return a human-readable table of our rolling percentiles."""
+        s = self.summary()
+        table = ' Tick Stats '.center(50, '-') + '\n'
+        table += '%-9s%10s%10s%10s%10s\n' % ('phase', 'p50(ms)', 'p95(ms)',
+                                               'p99(ms)', 'max(ms)')
+        for phase in self.PHASES + ['turn']:
+            stats = s[phase]
+            table += '%-9s%10.2f%10.2f%10.2f%10.2f\n' % (phase, stats['p50'],
+                                                         stats['p95'],
+                                                         stats['p99'],
+                                                         stats['max'])
+        counters = self.counter_summary()
+        if counters:
+            table += '%-19s%10s%10s%10s\n' % ('counter (per turn)', 'p50', 'p95',
+                                               'max')
+            for name in sorted(counters):
+                c = counters[name]
+                table += '%-19s%10s%10s%10s\n' % (name, c['p50'], c['p95'],
+                                                   c['max'])
+        table += 'Turns recorded: %s (last %s kept)\n' % (self.turns,
+                                                         self.window_size)
+        table += '-'.center(50, '-')
+        return table
+
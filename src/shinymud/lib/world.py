@@ -1,9 +1,17 @@
+from collections import deque
 import threading
 import time
 import logging
 import logging.handlers
+import sqlite3
 
 from shinymud.lib.db import DB
+from shinymud.lib.reactor import Reactor, READ, WRITE
+from shinymud.lib.scheduler import Scheduler, ActiveSet
+from shinymud.lib.executor import Executor
+from shinymud.lib.db_writer import DBWriter
+from shinymud.lib.tick_stats import TickStats
+from shinymud.lib import metrics
 from shinymud.data.config import *
 
 class World(object):
@@ -25,6 +33,8 @@ class World(object):
         self.battles = {}
         self.battles_delete = []
         self.player_list_lock = threading.Lock()
+        self.new_players = deque() # players handed off by the listener thread
+        self.player_rotation = 0 # which player goes first in the next turn
         self.shutdown_flag = False
         self.areas = {}
         self.db = DB(self.log, conn=conn)
@@ -32,7 +42,30 @@ class World(object):
         self.currency_name = CURRENCY
         self.login_greeting = ''
         self.uptime = time.time()
-        self.active_npcs = []
+        self.active_npcs = ActiveSet()
+        self.reactor = None
+        self.scheduler = Scheduler()
+        self.executor = Executor(EXECUTOR_THREADS)
+        self.tick_stats = TickStats(TICK_STATS_WINDOW, TICK_STATS_LOGFILE,
+                                    TICK_STATS_INTERVAL)
+        # A snapshot of our metrics, published every METRICS_INTERVAL seconds
+        # for the connection handlers' thread to read (see lib/metrics.py) --
+        # but only if a handler that wants them sets publish_metrics
+        self.metrics = {}
+        self.publish_metrics = False
+        self.next_metrics = 0
+        # How many sessions the reaper has closed, and when it next runs
+        self.reaped = {'login': 0, 'idle': 0}
+        self.next_reap = time.time() + REAP_INTERVAL
+        # Models waiting to be saved, by (table, dbid) -- or None if models
+        # should save themselves straight away (see save_later)
+        self.pending_saves = None
+        self.next_save = 0
+        # The thread that makes those saves, while the game is running (if
+        # there's a database file for it to open)
+        self.db_writer = None
+        if self.db.path and DB_CHECKPOINT_INTERVAL:
+            self.scheduler.call_later(DB_CHECKPOINT_INTERVAL, self.checkpoint_db)
         
         try:
             greet_file = open(ROOT_DIR + '/login_greeting.txt', 'r')
@@ -75,48 +108,177 @@ class World(object):
         """Do any cleanup that needs to be done after a turn. This includes
         deleting players from the playerlist if they have logged out."""
         for player in self.player_delete:
-            del self.player_list[player]
+            # (A player whose connection died twice in one turn may be on the
+            # delete list twice)
+            self.player_list.pop(player, None)
         self.player_delete = []
         for battle in self.battles_delete:
             del self.battles[battle]
         self.battles_delete = []
     
+    def turn(self, poll_input=True):
+        """Perform a single turn of game-time: tick the active npcs and the
+        players, send everyone their output, fight any battles and run any
+        scheduled timers (such as area resets) that are due.
+        poll_input -- whether players should check their connections for new
+        input during this turn (the reactor loop reads input as it arrives).
+        """
+        stats = self.tick_stats
+        stats.start_turn()
+        # Go through active npcs. Npcs that still have commands queued up
+        # after their tick go back in the set for next turn.
+        active = self.active_npcs.drain()
+        for npc in active:
+            if npc.do_tick(NPC_CMD_BUDGET):
+                self.active_npcs.add(npc)
+        stats.tally('npcs ticked', len(active))
+        stats.lap('npcs')
+        # Manage player list
+        self.player_list_lock.acquire()
+        self.add_new_players()
+        list_keys = self.player_list.keys()
+        if list_keys:
+            # Players take it in turns to go first, so the same players
+            # aren't always the ones whose commands run before everyone else's
+            start = self.player_rotation % len(list_keys)
+            list_keys = list_keys[start:] + list_keys[:start]
+            self.player_rotation += 1
+        for key in list_keys:
+            self.player_list[key].do_tick(poll_input)
+        if REAP_INTERVAL and time.time() >= self.next_reap:
+            self.reap_idle()
+        stats.lap('players')
+        self.cleanup()
+        stats.lap('cleanup')
+        list_keys = self.player_list.keys()
+        for key in list_keys:
+            self.player_list[key].send_output()
+        self.player_list_lock.release()
+        stats.lap('output')
+        
+        # Perform round actions for active battles
+        for key in self.battles.keys():
+            self.battles[key].perform_round()
+        stats.lap('battles')
+        
+        # Run any timers that are due (area resets, delayed callbacks), and
+        # the callbacks of any work the executor has finished
+        self.scheduler.run_due()
+        self.executor.run_callbacks()
+        if self.db_writer:
+            self.db_writer.run_callbacks()
+        stats.lap('timers')
+        if self.pending_saves and time.time() >= self.next_save:
+            self.flush_saves()
+            self.next_save = time.time() + SAVE_INTERVAL
+        stats.lap('saves')
+        if stats.end_turn() >= 1:
+            self.log.critical('WORLD: Turn took longer than a sec! (%s)' %
+                              stats.format_last_turn())
+        if self.publish_metrics and time.time() >= self.next_metrics:
+            self.metrics = metrics.snapshot(self)
+            self.next_metrics = time.time() + METRICS_INTERVAL
+    
     def start_turning(self):
+        if WRITE_BEHIND:
+            self.pending_saves = {}
+            if DB_WRITER and self.db.path:
+                self.db_writer = DBWriter(self.db.path, self.log)
+                self.db_writer.start()
+                # (So models' inserts and deletes go through it too)
+                self.db.use_writer(self.db_writer)
+        try:
+            if EVENT_LOOP == 'reactor':
+                self.react()
+            else:
+                self.tick()
+        finally:
+            # Whatever stopped us, don't lose anyone's changes
+            self.flush_saves()
+            self.pending_saves = None
+            if self.db_writer:
+                writer = self.db_writer
+                self.db_writer = None
+                self.db.use_writer(None)
+                writer.stop()
+                writer.run_callbacks()
+        self.listening = False
+    
+    def tick(self):
+        """The compatibility event loop: take a turn every TURN_INTERVAL
+        seconds, polling every player's connection for input each turn.
+        """
         while not self.shutdown_flag:
             start = time.time()
-            # Go through active npcs
-            for i in reversed(xrange(len(self.active_npcs))):
-                if not self.active_npcs[i].do_tick():
-                    del self.active_npcs[i]
-            # Manage player list
-            self.player_list_lock.acquire()
-            list_keys = self.player_list.keys()
-            for key in list_keys:
-                self.player_list[key].do_tick()
-            self.cleanup()
-            list_keys = self.player_list.keys()
-            for key in list_keys:
-                self.player_list[key].send_output()
-            self.player_list_lock.release()
-            
-            # Perform round actions for active battles
-            for key in self.battles.keys():
-                self.battles[key].perform_round()
-            
-            # Reset areas that have had activity
-            for area in self.areas.values():
-                if area.times_visited_since_reset > 0:
-                    now = time.time()
-                    if (now - area.time_of_last_reset) >= RESET_INTERVAL:
-                        area.reset()
-                        self.log.info('Area %s has been reset.' % area.name)
-            
+            self.turn()
             finish = time.time() - start
-            if finish >= 1:
-                self.log.critical('WORLD: Turn took longer than a sec!')
-            elif finish < 0.25:
-                time.sleep(0.25 - finish)
-        self.listening = False
+            if finish < TURN_INTERVAL:
+                time.sleep(TURN_INTERVAL - finish)
+    
+    def react(self):
+        """The reactor event loop: sleep until a player's connection has
+        something for us to read (and handle it right away), or until it's
+        time for the next game turn.
+        """
+        self.reactor = Reactor()
+        self.executor.wake = self.reactor.wake
+        if self.db_writer:
+            self.db_writer.wake = self.reactor.wake
+        self.player_list_lock.acquire()
+        for player in self.player_list.values():
+            self.io_register(player)
+        self.player_list_lock.release()
+        self.log.info('World is using the %s reactor.' % self.reactor.backend)
+        next_turn = time.time()
+        while not self.shutdown_flag:
+            now = time.time()
+            if now >= next_turn:
+                self.turn(poll_input=False)
+                finish = time.time()
+                next_turn += TURN_INTERVAL
+                if next_turn < finish:
+                    # We've fallen behind -- don't try to make up the
+                    # missed turns all at once
+                    next_turn = finish + TURN_INTERVAL
+                continue
+            ready = self.reactor.poll(next_turn - now)
+            writes_done = self.db_writer and self.db_writer.has_callbacks()
+            if ready or self.new_players or self.executor.has_callbacks() or \
+               writes_done:
+                self.player_list_lock.acquire()
+                self.add_new_players()
+                self.executor.run_callbacks()
+                if writes_done:
+                    self.db_writer.run_callbacks()
+                for player, events in ready:
+                    if events & WRITE:
+                        player.handle_output()
+                    if events & ~WRITE:
+                        player.handle_input()
+                self.player_list_lock.release()
+    
+    def io_register(self, player):
+        """Ask the reactor (if we're using one) to wake us up when this
+        player's connection has input for us.
+        """
+        if self.reactor and hasattr(player.conn, 'fileno'):
+            self.reactor.register(player.conn, player)
+    
+    def io_want_write(self, player):
+        """Ask the reactor to tell us when this player's connection is
+        writable, if (and only if) it has output that's still waiting to be
+        sent.
+        """
+        if self.reactor and hasattr(player.conn, 'fileno'):
+            if player.conn.has_output():
+                self.reactor.modify(player.conn, READ | WRITE)
+            else:
+                self.reactor.modify(player.conn, READ)
+    
+    def io_unregister(self, conn):
+        """Stop watching a connection (usually because it's being closed)."""
+        if self.reactor and hasattr(conn, 'fileno'):
+            self.reactor.unregister(conn)
     
     def has_location(self, area_name, room_id):
         """Check if a location (room) exists given an area name and a room id.
@@ -138,6 +300,185 @@ class World(object):
         room = self.areas.get(area_name).get_room(str(room_id))
         return room
     
+# ************************ Save Functions ************************
+# Here exist the functions that the world uses to batch up saves, so
+# that a turn's worth of changes costs one database transaction instead of
+# one per change.
+    
+    def save_later(self, model):
+        """Remember that model needs saving, to be written out the next time
+        we flush_saves(). Returns False if we aren't holding saves back (in
+        which case the model should save itself now).
+        """
+        if self.pending_saves is None:
+            return False
+        self.pending_saves[(model.db_table_name, model.dbid)] = model
+        return True
+    
+    def cancel_save(self, model):
+        """Forget about saving a model (it's being deleted)."""
+        if self.pending_saves:
+            self.pending_saves.pop((model.db_table_name, model.dbid), None)
+    
+    def flush_saves(self, table=None):
+        """Write all of the models waiting to be saved (or just the ones from
+        table), in one transaction (or hand them to our db_writer to write, if
+        we have one). Returns the number of models saved.
+        Anything that's about to read models back from the database should
+        use sync_saves() first, or it won't see the changes we're holding
+        back.
+        """
+        if not self.pending_saves:
+            return 0
+        if table:
+            models = [self.pending_saves.pop(key) for key in
+                      self.pending_saves.keys() if key[0] == table]
+        else:
+            models = self.pending_saves.values()
+            self.pending_saves = {}
+        # Each table's changed models, and their changes
+        updates = {}
+        for model in models:
+            save_dict = model.take_changes()
+            if save_dict:
+                changed, dicts = updates.setdefault(model.db_table_name, ([], []))
+                changed.append(model)
+                dicts.append(save_dict)
+        if self.db_writer:
+            for table, (changed, dicts) in updates.items():
+                self.db_writer.submit('update_many', (table, dicts),
+                                      self.saves_written(changed))
+            return len(models)
+        self.db.begin()
+        try:
+            for table, (changed, dicts) in updates.items():
+                self.db.update_many(table, dicts)
+        except Exception, e:
+            self.db.rollback()
+            self.log.error('Saving %s models failed (%s); saving them one at '
+                           'a time instead.' % (len(models), str(e)))
+            # (Still in one transaction: a failed update only undoes itself,
+            # so the models that can be saved still get saved together)
+            changed = []
+            for table_changed, dicts in updates.values():
+                changed.extend(table_changed)
+            saved = []
+            self.db.begin()
+            for model in changed:
+                # (Rolling back may have undone changes the model thinks it
+                # has written, so write it all again)
+                model.saved_values = None
+                try:
+                    model.save_now()
+                except Exception, e:
+                    self.save_failed(model, e)
+                else:
+                    saved.append(model)
+            try:
+                self.db.commit()
+            except Exception, e:
+                self.db.rollback()
+                for model in saved:
+                    self.save_failed(model, e)
+            else:
+                self.saves_succeeded(saved)
+        else:
+            self.db.commit()
+            for table, (changed, dicts) in updates.items():
+                self.saves_succeeded(changed)
+        return len(models)
+    
+    def sync_saves(self, table=None):
+        """Flush the saves waiting for table (or all of them), and wait until
+        they've been written -- along with everything else our db_writer has
+        been given -- so that the database is up to date for whoever's about
+        to read from it.
+        """
+        count = self.flush_saves(table)
+        if self.db_writer and not self.db_writer.flush(self.db_writer.timeout):
+            self.log.error('Gave up waiting for the database writer to catch '
+                           'up.')
+        return count
+    
+    def save_failed(self, model, error):
+        """Log that a model couldn't be saved, and hold on to it to try again
+        with the next flush (so its changes aren't lost just because nobody
+        happens to save it again). A model that breaks one of the database's
+        constraints is never going to save, and one that's failed SAVE_RETRIES
+        times in a row probably isn't either, so those are given up on --
+        otherwise they'd fail every flush they're in, and take the models
+        being saved with them down the slow path every time.
+        """
+        model.saved_values = None
+        model.save_failures += 1
+        if not isinstance(error, sqlite3.IntegrityError) and \
+           model.save_failures < SAVE_RETRIES and self.save_later(model):
+            self.log.error('Could not save %s %s (will try again): %s' %
+                           (model.db_table_name, model.dbid, str(error)))
+            return
+        model.save_failures = 0
+        self.log.error('Could not save %s %s (giving up on it): %s' %
+                       (model.db_table_name, model.dbid, str(error)))
+    
+    def saves_succeeded(self, models):
+        """Reset the failure count of any of models that had failed to
+        save before.
+        """
+        for model in models:
+            if model.save_failures:
+                model.save_failures = 0
+    
+    def saves_written(self, models):
+        """Return a callback for the db_writer to call once it's written a
+        batch of models' changes. If the batch failed, each model gets
+        written again on its own, so one bad row doesn't lose everyone's
+        changes.
+        """
+        def written(result, error):
+            if not error:
+                self.saves_succeeded(models)
+                return
+            self.log.error('Saving %s models failed (%s); saving them one at '
+                           'a time instead.' % (len(models), str(error)))
+            for model in models:
+                model.saved_values = None
+                if not self.db_writer:
+                    # (We're shutting down, and the writer's already gone)
+                    try:
+                        model.save_now()
+                    except Exception, e:
+                        self.save_failed(model, e)
+                    continue
+                self.db_writer.submit('update_from_dict',
+                                      (model.db_table_name, model.take_changes()),
+                                      self.save_written(model))
+        return written
+
+    
+    def save_written(self, model):
+        """Return a callback for the db_writer to call once it's written a
+        single model's changes.
+        """
+        def written(result, error):
+            if error:
+                self.save_failed(model, error)
+            else:
+                self.saves_succeeded([model])
+        return written
+    
+    def checkpoint_db(self):
+        """Have one of the executor's threads checkpoint the database's
+        write-ahead log, and do it again in DB_CHECKPOINT_INTERVAL seconds.
+        """
+        self.scheduler.call_later(DB_CHECKPOINT_INTERVAL, self.checkpoint_db)
+        self.executor.submit(self.db.checkpoint, callback=self.checkpoint_done)
+    
+    def checkpoint_done(self, result, error):
+        if error:
+            self.log.error('Checkpointing the database failed: %s' % str(error))
+        else:
+            self.log.debug('Checkpointed the database: %s' % repr(result))
+    
 # ************************ Area Functions ************************
 # Here exist all the functions that the world uses to manage the areas
 # it contains.
@@ -166,6 +507,30 @@ class World(object):
             return self.areas[area_name]
         return None
     
+    def load_areas(self):
+        """Load every area (and everything in them) from the database.
+        Instead of each room asking the database for its exits, each item for
+        its item types and so on, the tables they all come from are fetched
+        in one go first (see DB.preload).
+        """
+        from shinymud.models.area import Area
+        from shinymud.models.item_types import ITEM_TYPES
+        from shinymud.models.npc_ai_packs import NPC_AI_PACKS
+        tables = [('build_item', 'area'), ('script', 'area'), ('npc', 'area'),
+                  ('room', 'area'), ('room_exit', 'room'),
+                  ('room_spawns', 'room'), ('npc_event', 'prototype'),
+                  ('merchandise_list', 'merchant')]
+        tables += [(key, 'build_item') for key in ITEM_TYPES]
+        tables += [(key, 'npc') for key in NPC_AI_PACKS]
+        self.db.preload(tables)
+        try:
+            for area in self.db.select("* from area"):
+                self.area_add(Area.create(area))
+            for area in self.areas.values():
+                area.load()
+        finally:
+            self.db.end_preload()
+    
     def destroy_area(self, area_name, playername):
         """Destroy an entire area! TODO: whoa nelly, they want to destroy a
         whole area! We should really make sure that's what they want by adding
@@ -209,6 +574,8 @@ class World(object):
         for room in room_keys:
             self.log.debug(area.destroy_room(room))
         self.log.debug('Should have destroyed the rooms')
+        if area.reset_timer:
+            area.reset_timer.cancel()
         area.destruct()
         del self.areas[area.name]
         area.name = None
@@ -255,6 +622,65 @@ class World(object):
         if isinstance(key, basestring):
             key = key.lower()
         self.player_list[key] = player
+        self.io_register(player)
+    
+    def player_handoff(self, player):
+        """Queue a newly connected player to be added to the world by the
+        main loop. Connection handlers call this from their own thread; it
+        doesn't need the player_list_lock.
+        """
+        self.new_players.append(player)
+        if self.reactor:
+            self.reactor.wake()
+    
+    def add_new_players(self):
+        """Add the players that have been handed off to us since we last
+        checked, and greet them right away (or as soon as their connections
+        have finished negotiating with their clients). The caller should be
+        holding the player_list_lock.
+        """
+        while self.new_players:
+            player = self.new_players.popleft()
+            self.player_add(player)
+            if player.conn.negotiated or player.negotiate():
+                player.run_mode()
+                player.send_output()
+    
+    def reap_idle(self, now=None):
+        """Disconnect anyone who's been sitting at the login prompts for
+        longer than LOGIN_TIMEOUT seconds, and save and disconnect players
+        who haven't sent us anything in IDLE_TIMEOUT seconds. The world calls
+        this every REAP_INTERVAL seconds, while holding the
+        player_list_lock. Returns the number of players disconnected.
+        """
+        if now is None:
+            now = time.time()
+        self.next_reap = now + REAP_INTERVAL
+        reaped = 0
+        for key, player in self.player_list.items():
+            if key in self.player_delete:
+                # Already on their way out
+                continue
+            if not player.dbid:
+                if not LOGIN_TIMEOUT or now - player.connected_at < LOGIN_TIMEOUT:
+                    continue
+                kind = 'login'
+                message = 'You took too long to log in. Goodbye!'
+            else:
+                if not IDLE_TIMEOUT or now - player.last_input < IDLE_TIMEOUT:
+                    continue
+                kind = 'idle'
+                message = 'You have been idle for too long. Goodbye!'
+            self.log.info('Reaping %s (%s timeout).' % (str(player.name), kind))
+            player.update_output(message)
+            player.send_output()
+            # (send_output logs the player out itself if their connection
+            # turns out to be dead)
+            if key not in self.player_delete:
+                player.player_logout()
+            self.reaped[kind] += 1
+            reaped += 1
+        return reaped
     
     def player_remove(self, playername):
         """Add a player's name to the world's delete list so they get removed
@@ -281,6 +707,12 @@ class World(object):
 # ********************** NPC Functions **********************
 # Here exist all the function that the world uses to manage active npcs
     def npc_subscribe(self, npc):
-        """Add an npc to the world's active_npcs list."""
-        self.active_npcs.append(npc)
+        """Add an npc to the world's active npcs, so it gets ticked next turn.
+        Subscribing an npc that's already active does nothing.
+        """
+        self.active_npcs.add(npc)
+    
+    def npc_unsubscribe(self, npc):
+        """Stop ticking an npc (if it's active)."""
+        self.active_npcs.discard(npc)
     
@@ -201,7 +201,11 @@ def setup_stub_world():
 
 def main():
 # Then we check input for 'start' 'restart' and 'stop' (maybe 'help' later?)
-    if len(sys.argv) == 2:
+    if len(sys.argv) >= 2 and sys.argv[1].lower() == 'loadtest':
+        # The load test has options of its own
+        from shinymud.lib.load_test import main as load_test
+        load_test(sys.argv[2:])
+    elif len(sys.argv) == 2:
         option = sys.argv[1].lower()
         if option == 'start':
             print start()
@@ -225,9 +229,9 @@ def main():
         elif option == 'clean':
             clean()
         else:
-            print "options: start | stop | restart | setup | create_god | clean\n"
+            print "options: start | stop | restart | setup | create_god | clean | loadtest\n"
     else:
-        print "options: start | stop | restart | setup | create_god | clean\n"
+        print "options: start | stop | restart | setup | create_god | clean | loadtest\n"
 
 if __name__ == '__main__':
     main()
@@ -4,6 +4,10 @@ import json
 
 model_list = ModelRegister()
 
+# Column values that can only be changed by being set all over again (unlike
+# lists, dictionaries and other models, which can be changed in place)
+PLAIN_TYPES = (basestring, int, long, float, bool, type(None))
+
 class Column(object):
     """Columns are used by Models to handle how data will be stored and
     retrieved from the database. The main functions used here are 'read'
@@ -37,6 +41,10 @@ class Column(object):
         self.write = args.get('write', lambda x: None if x is None else unicode(x))
         #Allows for ON UPDATE or ON DELETE cascading
         self.cascade = args.get('cascade')
+        #Should the database keep an index on this column? Foreign keys get one
+        #by default, since that's what we look up the rows of other tables by
+        self.index = args.get('index', bool(self.foreign_key) and not
+                              (self.primary_key or self.unique))
         self.copy = args.get('copy', lambda x: x)
     
     def __str__(self):
@@ -111,6 +119,14 @@ class Model(object):
         )
     ]
     db_extras = []
+    # What's in the database for each of our columns, as of our last save,
+    # so saving only has to write the columns that have changed (see
+    # changed_columns). None if we don't know, in which case we write them all.
+    saved_values = None
+    # How many times in a row the world has failed to save us (see
+    # World.save_failed)
+    save_failures = 0
+    
     def __init__(self, args={}):
         """Go through each of the columns in our decendent model, and set them as real
         attributes in our class. If a column doesn't have a name, check if it has default
@@ -126,6 +142,20 @@ class Model(object):
                     setattr(self, col.name, col.default)
         if hasattr(self, 'dbid'):
             if self.dbid:
+                # We were loaded from the database, so args is what's in it
+                # (give or take the odd model our parent has filled in)
+                saved = {}
+                for col in self.db_columns:
+                    val = getattr(self, col.name)
+                    # (A column that's empty in the database gets its default,
+                    # which doesn't count as saved unless it's empty too)
+                    if not (isinstance(val, PLAIN_TYPES) and
+                            (args.get(col.name) or not val)):
+                        val = args.get(col.name)
+                        if not isinstance(val, PLAIN_TYPES):
+                            val = col.write(val)
+                    saved[col.name] = val
+                self.saved_values = saved
                 self.load_extras()
     
     def load_extras(self):
@@ -156,16 +186,81 @@ class Model(object):
     
     def save(self):
         """Save model data to the database. This function should be freely used by decendent
-        models to save changes."""
-        save_dict = self.create_save_dict()
+        models to save changes.
+        Once the game is running, changes to models that are already in the
+        database are held back by the world and written along with everyone
+        else's (see World.save_later); use save_now() to write them straight
+        away."""
+        if self.dbid and self.world.save_later(self):
+            return
+        self.save_now()
+    
+    def save_now(self):
+        """Write model data to the database right away. Only the columns that
+        have changed since we were last saved get written (and if none have,
+        nothing does).
+        """
+        if self.dbid and self.saved_values is not None:
+            save_dict, saved = self.changed_columns(self.saved_values)
+            if not save_dict:
+                return
+            save_dict['dbid'] = self.dbid
+            self.world.db.update_from_dict(self.db_table_name, save_dict)
+            self.saved_values.update(saved)
+            return
+        save_dict, saved = self.changed_columns({})
         if self.dbid:
                 self.world.db.update_from_dict(self.db_table_name, save_dict)
         else:
             if 'dbid' in save_dict:
                 del save_dict['dbid']
             self.dbid = self.world.db.insert_from_dict(self.db_table_name, save_dict)
+            saved['dbid'] = self.dbid
+        self.saved_values = saved
+    
+    def take_changes(self):
+        """Return the columns that have changed since we were last saved
+        (like create_save_dict, plus our dbid), for someone else to write to
+        the database -- or None if nothing has changed. From here on, the
+        changes count as saved; if writing them fails, set saved_values to
+        None so that everything gets written next time.
+        """
+        save_dict, saved = self.changed_columns(self.saved_values or {})
+        if not save_dict:
+            return None
+        save_dict['dbid'] = self.dbid
+        if self.saved_values is None:
+            self.saved_values = {}
+        self.saved_values.update(saved)
+        return save_dict
+    
+    def changed_columns(self, saved_values):
+        """Compare our columns to saved_values (see Model.saved_values), and
+        return (save_dict, saved): save_dict being like create_save_dict()'s,
+        but only for the columns that have changed, and saved what
+        saved_values should be updated with once they've been written.
+        Plain values (strings and numbers) are compared as they are, so they
+        only get written out for the database if they've changed; anything
+        else has to be written out to tell.
+        """
+        save_dict = {}
+        saved = {}
+        for col in self.db_columns:
+            val = getattr(self, col.name, col.default)
+            if isinstance(val, PLAIN_TYPES):
+                if col.name in saved_values and saved_values[col.name] == val:
+                    continue
+                saved[col.name] = val
+                save_dict[col.name] = col.write(val) if val else None
+            else:
+                val = col.write(val) if val else None
+                if col.name in saved_values and saved_values[col.name] == val:
+                    continue
+                saved[col.name] = save_dict[col.name] = val
+        return save_dict, saved
     
     def destruct(self):
         if self.dbid:
+            self.world.cancel_save(self)
             self.world.db.delete('FROM %s WHERE dbid=?' % self.db_table_name, [self.dbid])
     
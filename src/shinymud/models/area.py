@@ -6,6 +6,8 @@ from shinymud.models.npc import Npc
 from shinymud.models.script import Script
 from shinymud.modes.text_edit_mode import TextEditMode
 from shinymud.lib.world import World
+from shinymud.data.config import RESET_INTERVAL, RESET_JITTER
+import random
 import time
 
 class Area(Model):
@@ -27,23 +29,24 @@ class Area(Model):
         self.scripts = {}
         self.time_of_last_reset = 0
         self.times_visited_since_reset = 0
+        self.reset_timer = None
     
     def load(self):
         """Load all of this area's objects from the database."""
         if self.dbid:
-            items = self.world.db.select("* from build_item where area=?", [self.name])
+            items = self.world.db.select_by('build_item', 'area', self.name)
             for item in items:
                 item['area'] = self
                 self.items[str(item['id'])] = BuildItem(item)
-            scripts = self.world.db.select("* from script where area=?", [self.name])
+            scripts = self.world.db.select_by('script', 'area', self.name)
             for script in scripts:
                 script['area'] = self
                 self.scripts[str(script['id'])] = Script(script)
-            npcs = self.world.db.select("* from npc where area=?", [self.name])
+            npcs = self.world.db.select_by('npc', 'area', self.name)
             for npc in npcs:
                 npc['area'] = self
                 self.npcs[str(npc['id'])] = Npc(npc)
-            rooms = self.world.db.select("* from room where area=?", [self.name])
+            rooms = self.world.db.select_by('room', 'area', self.name)
             for room in rooms:
                 room['area'] = self
                 new_room = Room(room)
@@ -79,21 +82,43 @@ Description: \n    %s""" % (self.name,
         return area_list
     
     def get_id(self, id_type):
-        """Generate a new id for an item, npc, or room associated with this area."""
-        if id_type in ['room', 'build_item', 'npc', 'script']:
-            rows = self.world.db.select("max(CAST(id AS INT)) as id from " + id_type +" where area=?", [self.name])
-            max_id = rows[0]['id']
-            if max_id:
-                your_id = int(max_id) + 1
-            else:
-                your_id = 1
-            return str(your_id)
+        """Generate a new id for an item, npc, or room associated with this area.
+        (All of them are loaded with the area, so we can count them here,
+        without asking the database -- which may not have the newest ones yet,
+        if they're still waiting on the db writer.)
+        """
+        loaded = {'room': self.rooms, 'build_item': self.items,
+                  'npc': self.npcs, 'script': self.scripts}.get(id_type)
+        if loaded is not None:
+            return str(max([0] + [int(i) for i in loaded if str(i).isdigit()]) + 1)
     
     def reset(self):
         """Tell all of this area's rooms to reset."""
+        if self.reset_timer:
+            self.reset_timer.cancel()
+            self.reset_timer = None
         for room in self.rooms.values():
             room.reset()
         self.time_of_last_reset = time.time()
+        self.times_visited_since_reset = 0
+    
+    def add_visit(self):
+        """Count a player's visit to one of this area's rooms.
+        The first visit since the area's last reset schedules the next one.
+        Each area gets a random bit of extra time (up to RESET_JITTER seconds)
+        so that areas don't all reset on the same turn.
+        """
+        self.times_visited_since_reset += 1
+        if not self.reset_timer:
+            delay = RESET_INTERVAL + random.uniform(0, RESET_JITTER)
+            self.reset_timer = self.world.scheduler.call_later(delay,
+                                                               self.timed_reset)
+    
+    def timed_reset(self):
+        """Reset this area because its reset timer went off."""
+        self.reset_timer = None
+        self.reset()
+        self.world.log.info('Area %s has been reset.' % self.name)
     
 # ***** BuildMode Accessor Functions *****
     @classmethod
@@ -231,6 +256,7 @@ Description: \n    %s""" % (self.name,
         npc = self.get_npc(npc_id)
         if not npc:
             return 'That npc doesn\'t exist.'
+        self.world.npc_unsubscribe(npc)
         npc.destruct()
         for elist in npc.events.values():
             for event in elist:
@@ -72,8 +72,7 @@ class BuildItem(Item):
     
     def load_extras(self):
         for key, value in ITEM_TYPES.items():
-            row = self.world.db.select('* FROM %s WHERE build_item=?' % key,
-                                       [self.dbid])
+            row = self.world.db.select_by(key, 'build_item', self.dbid)
             if row:
                 row[0]['build_item'] = self
                 self.item_types[key] = value(row[0])
@@ -254,8 +253,7 @@ class GameItem(Item):
     
     def load_extras(self):
         for key, value in ITEM_TYPES.items():
-            row = self.world.db.select('* FROM %s WHERE game_item=?' % key,
-                                       [self.dbid])
+            row = self.world.db.select_by(key, 'game_item', self.dbid)
             if row:
                 row[0]['game_item'] = self
                 self.item_types[key] = value(row[0])
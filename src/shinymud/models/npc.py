@@ -113,12 +113,15 @@ description:
         if len(self.actionq) > self.LOG_LINES:
             del self.actionq[0]
     
-    def do_tick(self):
-        """Cycle through this npc's commands, if it has any."""
-        if not self.cmdq:
-            return False
-        self.cmdq.pop(0).run()
-        return True
+    def do_tick(self, budget=1):
+        """Cycle through this npc's commands, if it has any.
+        budget -- the most commands this npc may run this turn.
+        Returns True if this npc still has commands waiting to be run.
+        """
+        while self.cmdq and budget > 0:
+            self.cmdq.pop(0).run()
+            budget -= 1
+        return bool(self.cmdq)
     
 # ***** BuildMode accessor functions *****
     def build_set_description(self, description, player=None):
@@ -195,7 +198,7 @@ description:
 # ***** Event functions *****
     def load_events(self):
         """Load the events associated with this NPC."""
-        events = self.world.db.select('* FROM npc_event WHERE prototype=?', [self.dbid])
+        events = self.world.db.select_by('npc_event', 'prototype', self.dbid)
         self.world.log.debug(events)
         for event in events:
             self.new_event(event)
@@ -307,8 +310,7 @@ description:
 # ***** ai pack functions *****
     def load_ai_packs(self):
         for key, value in NPC_AI_PACKS.items():
-            row = self.world.db.select('* FROM %s WHERE npc=?' % key,
-                                       [self.dbid])
+            row = self.world.db.select_by(key, 'npc', self.dbid)
             if row:
                 row[0]['npc'] = self
                 self.ai_packs[key] = value(row[0])
@@ -257,7 +257,7 @@ The Merchant AI pack is meant to give NPCs the ability to become merchants.
             
     def load_extras(self):
         #Load the merchandise list for the Merchant
-        merchl = self.world.db.select('* FROM merchandise_list WHERE merchant=?', [self.dbid])
+        merchl = self.world.db.select_by('merchandise_list', 'merchant', self.dbid)
         if merchl:
             merchl[0]['merchant'] = self 
             self.sale_items = MerchandiseList(merchl[0])
@@ -10,7 +10,9 @@ from shinymud.models import Model, Column, model_list
 from shinymud.models.shiny_types import *
 from shinymud.models.item import GameItem
 from shinymud.models.character import Character
+from shinymud.lib.rate_limit import TokenBucket
 
+import time
 import re
 from socket import error as socket_error
 
@@ -37,7 +39,19 @@ class Player(Character):
         self.name = self.conn
         self.inq = []
         self.outq = []
+        # How many more of their queued commands the player may run this turn
+        self.commands_left = PLAYER_CMD_BUDGET
+        self.input_bucket = TokenBucket(FLOOD_RATE, FLOOD_BURST)
+        self.flood_strikes = 0
+        # When the player connected, and when they last sent us anything (the
+        # World's reaper disconnects players who've been idle for too long)
+        self.connected_at = time.time()
+        self.last_input = self.connected_at
         self.quit_flag = False
+        # The player's last prompt, and what it was built from (see
+        # get_prompt), and the last vitals we sent their client
+        self.prompt_cache = (None, None)
+        self.last_vitals = None
         self.mode = InitMode(self)
         self.last_mode = None
         self.dbid = None
@@ -76,38 +90,164 @@ class Player(Character):
             self.outq += data
     
     def get_input(self):
-        """Gets raw input from the player and queues it for later processing."""
+        """Gets raw input from the player and queues it for later processing.
+        Returns True if any new input was queued (or if our connection has just
+        finished negotiating with the client, so there's something to do).
+        """
+        negotiated = False
+        if not self.conn.negotiated:
+            if not self.negotiate():
+                return False
+            # The client may have sent its first lines along with the end of
+            # the negotiation; they're already buffered, so don't leave them
+            # waiting for the client to send something else
+            negotiated = True
         data = self.conn.recv()
         if data:
             if isinstance(data, basestring):
-                self.inq.append(data)
-
-            elif isinstance(data, list):
-                self.inq += data
+                data = [data]
+            self.queue_input(data)
+            return True
         
         elif data is None:
             self.player_logout(True)
+            return False
+        return negotiated
+    
+    def queue_input(self, lines):
+        """Add lines of input to the player's inq, enforcing our flood limits:
+        each line costs a token from the player's input_bucket, and the inq
+        can't grow past INPUT_QUEUE_MAX lines. Lines over either limit are
+        thrown away with a warning; a player who keeps it up FLOOD_STRIKES
+        times without letting their bucket refill gets disconnected.
+        
+        Lines typed into the text editor don't cost tokens -- they're text,
+        not commands, and pasting in a long description is what the editor's
+        for -- but the inq can still only hold EDITOR_QUEUE_MAX of them (and
+        any that are left over when the player leaves the editor have to go
+        through the limits after all; see run_mode).
+        """
+        self.last_input = time.time()
+        if self.flood_strikes and self.input_bucket.full():
+            self.flood_strikes = 0
+        if isinstance(self.mode, TextEditMode):
+            accepted = min(len(lines), max(0, EDITOR_QUEUE_MAX - len(self.inq)))
+        else:
+            room = max(0, INPUT_QUEUE_MAX - len(self.inq))
+            accepted = 0
+            for line in lines[:room]:
+                if not self.input_bucket.consume():
+                    break
+                accepted += 1
+        self.inq += lines[:accepted]
+        dropped = len(lines) - accepted
+        if not dropped:
+            return
+        self.flood_strikes += 1
+        self.world.log.debug('%s is flooding (strike %s, %s lines dropped).' %
+                             (str(self.name), self.flood_strikes, dropped))
+        if self.flood_strikes > FLOOD_STRIKES:
+            self.update_output('You have been disconnected for flooding.')
+            self.quit_flag = True
+        else:
+            self.update_output("You're sending commands too fast! The last %s "
+                               "were ignored." % dropped)
+    
+    def take_commands(self):
+        """Return the queued lines of input the player gets to run right
+        now, removing them from their inq. Players may only run
+        PLAYER_CMD_BUDGET commands a turn -- the rest wait in the inq for
+        later turns, so nobody can hog a turn by pasting in a pile of commands.
+        """
+        count = min(len(self.inq), self.commands_left)
+        commands = self.inq[:count]
+        del self.inq[:count]
+        self.commands_left -= count
+        return commands
+    
+    def negotiate(self):
+        """Move our connection's negotiation with the client along. Returns
+        True once the connection is ready for the game; if the negotiation
+        failed, the player is logged out.
+        """
+        status = self.conn.negotiate()
+        if status is None:
+            self.player_logout(True)
+        return bool(status)
+    
+    def handle_input(self):
+        """Read and act on the player's input as soon as it arrives, instead
+        of waiting for the next world turn. The World calls this when its
+        reactor says this player's connection is readable.
+        """
+        if self.get_input():
+            if not self.quit_flag:
+                self.run_mode()
+            self.send_output()
     
     def send_output(self):
         """Sends all data from the player's output queue to the player."""
         if (len(self.outq) > 0):
             self.enqueue_prompt()
+            self.send_status()
             alive = self.conn.send(self.outq)
-        
-            if not alive:
-                # Sending failed - the connection is no longer alive. We should log
-                # the player out
-                self.player_logout(True)
+        elif self.conn.has_output():
+            # Try again to send what didn't fit last time
+            alive = self.conn.flush()
+        else:
+            return
+        if not alive:
+            # Sending failed - the connection is no longer alive. We should log
+            # the player out
+            self.player_logout(True)
+        else:
+            self.world.io_want_write(self)
+    
+    def handle_output(self):
+        """Send the output that's been waiting for our connection to become
+        writable. The World calls this when its reactor says it is.
+        """
+        if not self.conn.flush():
+            self.player_logout(True)
+        else:
+            self.world.io_want_write(self)
     
     def enqueue_prompt(self):
         """Get a prompt for the player."""
-        if hasattr(self, 'hp'):
-            default = '<HP:%s/%s MP:%s/%s> ' % (str(self.hp), str(self.max_hp), str(self.mp), str(self.max_mp))
-        else:
-            default = '> '
-            
+        prompt = self.get_prompt()
+        if prompt:
+            self.outq.append(prompt)
+    
+    def get_prompt(self):
+        """Return the player's prompt (or None if their mode doesn't have one).
+        Prompts only get rebuilt when something in them has changed; see
+        prompt_key.
+        """
+        key = self.prompt_key()
+        if key != self.prompt_cache[0]:
+            self.prompt_cache = (key, self.render_prompt())
+        return self.prompt_cache[1]
+    
+    def prompt_key(self):
+        """Return everything the player's prompt depends on, so we can tell
+        whether it needs rebuilding.
+        """
+        mode = self.mode
+        if not mode:
+            return (None, getattr(self, 'hp', None), getattr(self, 'max_hp', None),
+                    getattr(self, 'mp', None), getattr(self, 'max_mp', None))
+        if mode.name == 'BuildMode':
+            area = mode.edit_area
+            obj = mode.edit_object
+            return (mode.name, area, area and area.name, obj, obj and obj.id)
+        return (mode.name,)
+    
+    def render_prompt(self):
+        """Build the player's prompt from scratch."""
         if not self.mode:
-            self.outq.append(default)
+            if hasattr(self, 'hp'):
+                return '<HP:%s/%s MP:%s/%s> ' % (str(self.hp), str(self.max_hp), str(self.mp), str(self.max_mp))
+            return '> '
         
         elif self.mode.name == 'BuildMode':
             prompt = '<Build'
@@ -116,20 +256,34 @@ class Player(Character):
             if self.mode.edit_object:
                 prompt += ' ' + self.mode.edit_object.__class__.__name__ + ' ' + str(self.mode.edit_object.id)
             prompt += '> '
-            self.outq.append(prompt)
+            return prompt
             
         elif self.mode.name == 'TextEditMode':
-            self.outq.append('> ')
+            return '> '
         elif self.mode.name == 'PassChangeMode':
-            self.outq.append('> ')
+            return '> '
+        return None
+    
+    def send_status(self):
+        """Send the player's vitals to their client as a GMCP Char.Vitals
+        message, if the client wants them and they've changed since we last
+        sent them.
+        """
+        if not getattr(self.conn, 'gmcp', False) or not hasattr(self, 'hp'):
+            return
+        vitals = (self.hp, self.max_hp, self.mp, self.max_mp)
+        if vitals != self.last_vitals:
+            self.last_vitals = vitals
+            self.conn.send_status('Char.Vitals',
+                                  {'hp': self.hp, 'maxhp': self.max_hp,
+                                   'mp': self.mp, 'maxmp': self.max_mp})
     
     
     def parse_command(self):
         """Parses the lines in the player's input buffer and then calls
         the appropriate commands (if they exist)"""
         
-        while len(self.inq) > 0:
-            raw_string = self.inq.pop(0)
+        for raw_string in self.take_commands():
             match = re.search(r'\s*(\w+)([ ](.+))?$', raw_string)
             if match:
                 cmd_name, _, args = match.groups()
@@ -140,28 +294,51 @@ class Player(Character):
                     # The command the player sent was invalid... tell them so
                     self.update_output("I don't understand \"%s\"\n" % raw_string)
     
-    def do_tick(self):
-        """What should happen to the player everytime the world ticks."""
+    def do_tick(self, poll_input=True):
+        """What should happen to the player everytime the world ticks.
+        poll_input -- whether we should check the player's connection for new
+        input. The World's reactor reads input as soon as it arrives, so it
+        doesn't need us to poll for it.
+        """
+        self.commands_left = PLAYER_CMD_BUDGET
         if self.quit_flag:
             self.player_logout()
         else:
             if self.dbid:
                 self.cycle_effects()
-            self.get_input()
-            if not self.mode:
-                self.parse_command()
-            elif self.mode.active:
-                self.mode.state()
-                if not self.mode.active:
-                    if self.last_mode:
-                        self.mode = self.last_mode
-                    else:
-                        self.mode = None
-            else:
-                # If we get here somehow (where the state of this mode is not
-                # active, but the mode has not been cleared), just clear the
-                # mode.
-                self.mode = None
+            if poll_input or not self.conn.negotiated:
+                # (Negotiations get checked every turn so their deadlines
+                # are noticed even if the client never sends anything)
+                self.get_input()
+            if self.conn.negotiated:
+                self.run_mode()
+    
+    def run_mode(self):
+        """Hand the player's queued input to whichever mode they're in (or
+        parse it as normal commands if they aren't in a mode).
+        """
+        if not self.mode:
+            self.parse_command()
+        elif self.mode.active:
+            self.mode.state()
+            if not self.mode.active:
+                editing = isinstance(self.mode, TextEditMode)
+                if self.last_mode:
+                    self.mode = self.last_mode
+                else:
+                    self.mode = None
+                if editing and self.inq:
+                    # Whatever the player typed after they finished editing
+                    # got in without being flood limited; it's commands again
+                    # now, so it has to go through the limits like any others
+                    leftover = self.inq
+                    self.inq = []
+                    self.queue_input(leftover)
+        else:
+            # If we get here somehow (where the state of this mode is not
+            # active, but the mode has not been cleared), just clear the
+            # mode.
+            self.mode = None
     
     def player_logout(self, broken_pipe=False):
         # If this player doesn't have a dbid, that means this player got
@@ -169,7 +346,12 @@ class Player(Character):
         # process. Don't save the incomplete data.
         if self.dbid:
             self.save()
+            # Don't leave the player's changes (or anyone else's) waiting for
+            # the end of the turn -- they should be in the database by the
+            # time the player can log back in
+            self.world.sync_saves()
             
+            self.world.io_unregister(self.conn)
             if not broken_pipe:
                 self.world.play_log.info('%s has exited.' % self.fancy_name())
             else:
@@ -181,6 +363,7 @@ class Player(Character):
             self.world.tell_players("%s has left the world." % self.fancy_name())
         else:
             # If they didn't make it through the CC process, just close the connection
+            self.world.io_unregister(self.conn)
             self.conn.close()
             self.world.player_remove(self.name)
             self.world.log.debug("Logging out an unnamed player.")
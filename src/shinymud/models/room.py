@@ -203,7 +203,7 @@ spawns: %s""" % (self.name, self.description, nice_exits, spawns)
         self.exits[exit_dict['direction']] = new_exit
     
     def load_exits(self):
-        rows = self.world.db.select("* from room_exit where room=?", [self.dbid])
+        rows = self.world.db.select_by('room_exit', 'room', self.dbid)
         for row in rows:
             row['room'] = self
             self.exits[row['direction']] = RoomExit(row)
@@ -268,13 +268,9 @@ spawns: %s""" % (self.name, self.description, nice_exits, spawns)
         return spawn
     
     def get_spawn_id(self):
-        rows = self.world.db.select("max(id) as id from room_spawns where room=?", [self.dbid])
-        max_id = rows[0]['id']
-        if max_id:
-            your_id = int(max_id) + 1
-        else:
-            your_id = 1
-        return str(your_id)
+        """Generate a new id for one of this room's spawns (from the ones
+        we've loaded, like Area.get_id)."""
+        return str(max([0] + [int(i) for i in self.spawns if str(i).isdigit()]) + 1)
     
     def load_spawns(self, spawn_list=None):
         """
@@ -282,7 +278,7 @@ spawns: %s""" % (self.name, self.description, nice_exits, spawns)
         or the database.
         """
         if not spawn_list:
-            spawn_list = self.world.db.select('* FROM room_spawns WHERE room=?', [self.dbid])
+            spawn_list = self.world.db.select_by('room_spawns', 'room', self.dbid)
         self.world.log.debug(spawn_list) 
         #Build a dictionary of what spawns where (room, another item, an npc) which we will
         #call the dependencies. We need to build this list since self.new_spawn() needs 
@@ -375,7 +371,7 @@ spawns: %s""" % (self.name, self.description, nice_exits, spawns)
             self.npcs.append(char)
         else:
             self.players[char.name] = char
-            self.area.times_visited_since_reset += 1
+            self.area.add_visit()
             self.fire_event('pc_enter', {'player': char, 'from': prev_room})
     
     def remove_char(self, char):
@@ -9,7 +9,7 @@ class Script(Model):
     """A model that represents an in-game script object."""
     db_table_name = 'script'
     db_columns = Model.db_columns + [
-        Column('area', type="INTEGER", read=read_area, write=write_area),
+        Column('area', type="INTEGER", read=read_area, write=write_area, index=True),
         Column('name', default='New Script'),
         Column('body', default=''),
         Column('id')
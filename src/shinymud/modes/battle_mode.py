@@ -10,8 +10,7 @@ class BattleMode(object):
         self.name = 'BattleMode'
     
     def parse_command(self):
-        while len(self.player.inq) > 0:
-            raw_string = self.player.inq.pop(0)
+        for raw_string in self.player.take_commands():
             match = re.search(r'\s*(\w+)([ ](.+))?$', raw_string)
             if match:
                 cmd_name, _, args = match.groups()
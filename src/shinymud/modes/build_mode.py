@@ -16,8 +16,7 @@ class BuildMode(object):
         """Parses the lines in the player's input buffer and then calls
         the appropriate commands (if they exist)"""
         
-        while len(self.player.inq) > 0:
-            raw_string = self.player.inq.pop(0)
+        for raw_string in self.player.take_commands():
             match = re.search(r'\s*(\w+)([ ](.+))?$', raw_string)
             if match:
                 cmd_name, _, args = match.groups()
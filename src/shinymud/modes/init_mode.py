@@ -107,6 +107,10 @@ class InitMode(object):
                 self.player.update_output(['Please choose a name. It should be a single word, using only letters.', 'Name: '])
             else:
                 self.playername = playername
+                # (No waiting on the db writer here, for a client that hasn't
+                # proven who it is yet: players' saves are written before
+                # they finish logging out, so the passwords of everyone who's
+                # offline are already in the database)
                 row = self.world.db.select('password,dbid FROM player WHERE name=?', [self.playername])
                 if row:
                     # Awesome, a player with this name does exist! Let's check their password!
@@ -137,6 +141,7 @@ class InitMode(object):
         password = hashlib.sha1(arg).hexdigest()
         if password == self.password:
             # Wicked cool, our player exists AND the right person is self.world.logging in
+            self.world.sync_saves()
             self.player.playerize(self.world.db.select('* FROM player WHERE dbid=?', [self.dbid])[0])
             # Make sure that we clear the concealed text effect that we 
             # initiated when we moved to the password state
@@ -155,7 +160,8 @@ class InitMode(object):
         they are out of luck, but they can still log on as another character.
 
         PREV STATE: self.verify_password
-        NEXT STATE: self.verify_playername
+        NEXT STATE: self.mail_sent, OR self.verify_playername if the player
+                    has no e-mail address
         """
         self.state = self.get_input
         player_email = self.world.db.select('email,name FROM player WHERE dbid=?', [self.dbid])[0]['email']
@@ -165,29 +171,46 @@ class InitMode(object):
             self.player.update_output(['', 'Until then you can log on with another character if you like: '])
             self.next_state = self.verify_playername
             return
-        try:
-            if not EMAIL_ENABLED:
-                raise Exception("%s email is not configured! %s could not reset their password!" %
-                                                         (GAME_NAME, self.player.name))
-            self.conf_code = random.randint(99999, 1000000)
-            subject = '%s Password Reset' % GAME_NAME
-            message = 'Hello %s, \n\nYou have recently requested a password reset. ' % self.playername
-            message += 'Please enter the code below into your game prompt to reset your password.\n '
-            message += 'Code: %s\n\nThanks, \n\n\n\n%s' % (self.conf_code, GAME_NAME)
-            mail = ShinyMail([player_email], subject, message)
-            mail.send()
+        self.player_email = player_email
+        if not EMAIL_ENABLED:
+            self.mail_sent(None, Exception("%s email is not configured! %s could not reset their password!" %
+                                           (GAME_NAME, self.player.name)))
+            return
+        self.conf_code = random.randint(99999, 1000000)
+        subject = '%s Password Reset' % GAME_NAME
+        message = 'Hello %s, \n\nYou have recently requested a password reset. ' % self.playername
+        message += 'Please enter the code below into your game prompt to reset your password.\n '
+        message += 'Code: %s\n\nThanks, \n\n\n\n%s' % (self.conf_code, GAME_NAME)
+        # Talking to the mail server can take a while, so we let one of the
+        # world's worker threads do it, and wait here until it's done
+        self.state = self.wait
+        self.world.executor.submit(ShinyMail([player_email], subject, message).send,
+                                   callback=self.mail_sent)
+    
+    def wait(self):
+        """Do nothing (until something else changes our state)."""
+        pass
+    
+    def mail_sent(self, result, error):
+        """Tell the player whether their password reset e-mail made it out.
+        
+        PREV STATE: self.reset_password
+        NEXT STATE: self.confirm_code if the e-mail was sent, OR
+                    self.verify_playername if it wasn't
+        """
+        self.state = self.get_input
+        if not error:
             self.player.update_output(CLEAR + 'An e-mail has been sent to %s with a six digit number inside.' %
-                                                                             player_email)
+                                                                             self.player_email)
             self.player.update_output('Copy the code here to continue: ')
             self.next_state = self.confirm_code
-            return
-        except Exception, e:
+        else:
             #We had a problem sending email! Most likely, we don't have email set up in the config.py file
-            self.player.update_output(CLEAR + 'We were unable to send an e-mail to %s. ' % player_email)
+            self.player.update_output(CLEAR + 'We were unable to send an e-mail to %s. ' % self.player_email)
             self.player.update_output('This could be a problem with our internal e-mail sender.' + \
             'Please contact the administrator of the game. We\'re sorry for the inconvenience.')
             self.player.update_output(['', 'You can log in with another player if you like: '])
-            self.log.error("Password email reset Fail: " + str(e))
+            self.log.error("Password email reset Fail: " + str(error))
             self.next_state = self.verify_playername
 
     def confirm_code(self, arg):
@@ -201,6 +224,7 @@ class InitMode(object):
         if arg.isdigit() and int(arg) == self.conf_code:
             #We have now verified this is the correct person, grab their player info and
             #reset their password
+            self.world.sync_saves()
             self.player.playerize(self.world.db.select('* FROM player WHERE dbid=?', [self.dbid])[0])
             self.player.update_output(CLEAR + 'Type in your new password: ' + CONCEAL)
             self.password = None
@@ -287,7 +311,9 @@ class InitMode(object):
         """
         if arg.isalpha():
             row = self.world.db.select("dbid from player where name=?", [arg.lower()])
-            if row:
+            # (A player who's only just been created may still be on their way
+            # to the database, but they'll be in the game)
+            if row or self.world.get_player(arg.lower()):
                 self.player.update_output('That playername is already taken.')
                 self.player.update_output('Please choose a playername. It should be a single word, using only letters.')
             else:
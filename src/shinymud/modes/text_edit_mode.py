@@ -30,7 +30,9 @@ class TextEditMode(object):
         self.state = self.process_input
     
     def process_input(self):
-        if self.pc.inq:
+        # Take everything that's waiting (a pasted description comes in all
+        # at once), unless one of the lines finishes the editing
+        while self.pc.inq and self.active:
             line = self.pc.inq[0]
             if line.startswith('@'):
                 # player is submitting a command, parse it!
@@ -0,0 +1,85 @@
+"""ShinyBench is a set of microbenchmarks for the code that ShinyMUD runs
+thousands of times a minute.
+
+Each benchmark builds a small synthetic world (with an in-memory database)
+in its setup(), then we time its run() function. Results can be saved to a
+JSON baseline file and later runs compared against it, so that we know if a
+change made things faster or slower. See shinybench/run.py for how to run
+them.
+"""
+import time
+
+class Benchmark(object):
+    """The base class for all benchmarks.
+    
+    name -- the name results are saved under
+    number -- how many times run() is called per timing
+    """
+    name = None
+    number = 100
+    
+    def setup(self):
+        """Build a fresh world to run the benchmark in. Subclasses should call
+        this before building what they need.
+        """
+        import sys
+        remove = [m for m in sys.modules.keys() if 'shinymud' in m]
+        for r in remove:
+            del sys.modules[r]
+        from shinymud.lib.world import World
+        self.world = World(':memory:')
+        from shinymud.lib.setup import initialize_database
+        initialize_database()
+    
+    def prepare(self):
+        """Called (untimed) before each batch of number calls to run()."""
+        pass
+    
+    def run(self):
+        raise NotImplementedError
+    
+    def teardown(self):
+        self.world.db.conn.close()
+        from shinymud.lib.world import World
+        World._instance = None
+    
+
+def time_benchmark(bench, repeat=5):
+    """Time a benchmark, returning a dictionary of the best, median and worst
+    time (in microseconds) that a single call to its run() function took.
+    """
+    bench.setup()
+    try:
+        timings = []
+        for i in range(repeat):
+            bench.prepare()
+            start = time.time()
+            for j in xrange(bench.number):
+                bench.run()
+            timings.append((time.time() - start) / bench.number * 1000000)
+    finally:
+        bench.teardown()
+    timings.sort()
+    return {'best': timings[0],
+            'median': timings[len(timings) / 2],
+            'worst': timings[-1],
+            'number': bench.number,
+            'repeat': repeat
+           }
+
+def compare(results, baseline, threshold=10):
+    """Compare results against a baseline (both as returned by
+    time_benchmark, keyed by benchmark name). Returns a list of
+    (name, baseline usec, new usec, percent change, regressed) tuples.
+    A benchmark has regressed if its best time is more than threshold percent
+    slower than the baseline's.
+    """
+    report = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['best']
+        new = results[name]['best']
+        change = (new - old) / old * 100
+        report.append((name, old, new, change, change > threshold))
+    return report
@@ -0,0 +1,224 @@
+from shinybench import Benchmark
+
+import random
+
+def make_player(name, room=None):
+    """Return a logged-in (but unconnected) player named name, standing in
+    room (if given).
+    """
+    from shinymud.models.player import Player
+    player = Player((name, 'bar'))
+    player.playerize({'name': name})
+    player.mode = None
+    if room:
+        player.location = room
+        room.add_char(player)
+    player.outq = []
+    return player
+
+def make_npc(area, name, room=None):
+    """Return a game npc (loaded from a new prototype in area)."""
+    proto = area.new_npc()
+    proto.characterize({'name': name, 'keywords': name,
+                        'title': '%s is standing here.' % name})
+    npc = proto.load()
+    if room:
+        npc.location = room
+        room.add_char(npc)
+    return npc
+
+
+class ParseCommand(Benchmark):
+    """Player.parse_command dispatching a mix of common commands."""
+    name = 'player.parse_command'
+    commands = ['look', 'say Hello there!', 'inventory', 'emote waves.',
+                'north', 'south', 'who', 'foo']
+    
+    def setup(self):
+        Benchmark.setup(self)
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'bench'})
+        north = area.new_room()
+        south = area.new_room()
+        north.link_exits('south', south)
+        self.player = make_player('bob', south)
+        for i in range(5):
+            make_player('watcher' + 'abcde'[i], south)
+    
+    def run(self):
+        self.player.inq = list(self.commands)
+        self.player.commands_left = len(self.commands)
+        self.player.parse_command()
+        del self.player.outq[:]
+    
+
+class LookAtRoom(Benchmark):
+    """Player.look_at_room in a busy room."""
+    name = 'player.look_at_room'
+    number = 1000
+    
+    def setup(self):
+        Benchmark.setup(self)
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'bench'})
+        room = area.new_room()
+        for direction in ['north', 'south', 'east', 'west']:
+            room.link_exits(direction, area.new_room())
+        for i in range(10):
+            proto = area.new_item()
+            room.item_add(proto.load())
+        for i in range(5):
+            make_npc(area, 'npc%s' % i, room)
+        for i in range(20):
+            make_player('player' + chr(ord('a') + i), room)
+        self.player = make_player('bob', room)
+    
+    def run(self):
+        self.player.look_at_room()
+    
+
+class TellRoom(Benchmark):
+    """Room.tell_room with a roomful of listeners."""
+    name = 'room.tell_room'
+    number = 200
+    listeners = 100
+    
+    def setup(self):
+        Benchmark.setup(self)
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'bench'})
+        self.room = area.new_room()
+        self.players = []
+        for i in range(self.listeners):
+            name = 'p' + ''.join([chr(ord('a') + int(d)) for d in str(i)])
+            self.players.append(make_player(name, self.room))
+    
+    def prepare(self):
+        for player in self.players:
+            del player.outq[:]
+    
+    def run(self):
+        self.room.tell_room('Bob says, "Hello everybody!"', ['pa'])
+    
+
+class RoomReset(Benchmark):
+    """Room.reset respawning npcs, items and containers full of items."""
+    name = 'room.reset'
+    number = 50
+    
+    def setup(self):
+        Benchmark.setup(self)
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'bench'})
+        self.room = area.new_room()
+        # Spawn ids are compared as text, so keep this room under 10 spawns
+        for i in range(2):
+            container = area.new_item()
+            container.build_add_type('container')
+            self.room.build_add_spawn('for item %s' % container.id)
+            container_spawn = len(self.room.spawns)
+            for j in range(2):
+                item = area.new_item()
+                self.room.build_add_spawn('for item %s in spawn %s' %
+                                          (item.id, container_spawn))
+        item = area.new_item()
+        self.room.build_add_spawn('for item %s' % item.id)
+        for i in range(2):
+            npc = area.new_npc()
+            self.room.build_add_spawn('for npc %s' % npc.id)
+    
+    def run(self):
+        # Pretend the players have cleared out the room since the last reset
+        self.room.npcs = []
+        self.room.items = [i for i in self.room.items
+                           if i.has_type('container')]
+        self.room.reset()
+    
+
+class BattleRound(Benchmark):
+    """Battle.perform_round with two large teams."""
+    name = 'battle.perform_round'
+    number = 20
+    team_size = 20
+    
+    def setup(self):
+        Benchmark.setup(self)
+        from shinymud.models.area import Area
+        from shinymud.lib.battle import Battle
+        random.seed(42)
+        area = Area.create({'name': 'bench'})
+        room = area.new_room()
+        self.battle = Battle()
+        teams = (self.battle.teamA, self.battle.teamB)
+        for i in range(self.team_size * 2):
+            npc = make_npc(area, 'fighter%s' % i, room)
+            # Nobody dies, so each round does the same amount of work
+            npc.hp = npc.max_hp = 1000000000
+            npc.battle = self.battle
+            teams[i % 2].append(npc)
+        for i, npc in enumerate(self.battle.teamA):
+            npc.battle_target = self.battle.teamB[i]
+            self.battle.teamB[i].battle_target = npc
+        self.world.battle_add(self.battle)
+    
+    def prepare(self):
+        for npc in self.battle.teamA + self.battle.teamB:
+            npc.actionq = []
+    
+    def run(self):
+        self.battle.perform_round()
+    
+
+class ParseScript(Benchmark):
+    """EventHandler.parse_script on a script with conditionals and continued
+    lines."""
+    name = 'event_handler.parse_script'
+    number = 1000
+    body = '\n'.join(['if remember #target_name',
+                      '  say Hello #target_name, it\'s nice to see you again.',
+                      'else',
+                      '  record #target_name',
+                      '  say Welcome to the Library, #target_name.',
+                      '  if equal foo foo',
+                      '    emote smiles.',
+                      '  endif',
+                      'endif',
+                      'say This is a very long line that goes on and on and +',
+                      'on for a while.',
+                      'load item 1 bench',
+                      'give card to #target_name'])
+    
+    def setup(self):
+        Benchmark.setup(self)
+        from shinymud.models.area import Area
+        from shinymud.lib.event_handler import EventHandler
+        area = Area.create({'name': 'bench'})
+        room = area.new_room()
+        script = area.new_script({'name': 'greeting', 'body': self.body})
+        npc = make_npc(area, 'greeter', room)
+        self.handler = EventHandler({'obj': npc, 'script': script,
+                                     'probability': 100})
+        self.handler.personalize({'#target_name': 'bob'})
+    
+    def run(self):
+        self.handler.parse_script()
+    
+
+class DBSelect(Benchmark):
+    """DB.select turning rows into dictionaries."""
+    name = 'db.select'
+    number = 50
+    
+    def setup(self):
+        Benchmark.setup(self)
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'bench'})
+        for i in range(200):
+            area.new_item()
+    
+    def run(self):
+        self.world.db.select('* FROM build_item WHERE area=?', ['bench'])
+    
+
+benchmarks = [ParseCommand, LookAtRoom, TellRoom, RoomReset, BattleRound,
+              ParseScript, DBSelect]
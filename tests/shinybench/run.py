@@ -0,0 +1,69 @@
+"""Run ShinyMUD's microbenchmarks.
+
+From the tests directory:
+    PYTHONPATH=../src:. python -m shinybench.run
+To save the results as a baseline:
+    PYTHONPATH=../src:. python -m shinybench.run --save baseline.json
+To compare a run against a saved baseline (exits with a non-zero status if
+any benchmark got more than --threshold percent slower):
+    PYTHONPATH=../src:. python -m shinybench.run --compare baseline.json
+"""
+from shinybench import time_benchmark, compare
+from shinybench.benchmarks import benchmarks
+
+from optparse import OptionParser
+import json
+import sys
+
+def main(args):
+    parser = OptionParser(usage='python -m shinybench.run [options]')
+    parser.add_option('-k', '--keyword',
+                      help='only run benchmarks whose name contains this')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='how many times to time each benchmark [%default]')
+    parser.add_option('-s', '--save', metavar='FILE',
+                      help='save the results to FILE as a baseline')
+    parser.add_option('-c', '--compare', metavar='FILE',
+                      help='compare the results with the baseline in FILE')
+    parser.add_option('-t', '--threshold', type='float', default=10,
+                      help='percent slower than the baseline that counts as '
+                           'a regression [%default]')
+    options, args = parser.parse_args(args)
+    
+    results = {}
+    print '%-30s%12s%12s%12s' % ('benchmark', 'best(us)', 'median(us)',
+                                 'worst(us)')
+    for bench_class in benchmarks:
+        if options.keyword and options.keyword not in bench_class.name:
+            continue
+        r = time_benchmark(bench_class(), options.repeat)
+        results[bench_class.name] = r
+        print '%-30s%12.1f%12.1f%12.1f' % (bench_class.name, r['best'],
+                                           r['median'], r['worst'])
+    
+    if options.save:
+        f = open(options.save, 'w')
+        f.write(json.dumps(results, indent=4, sort_keys=True))
+        f.close()
+        print 'Saved results to %s.' % options.save
+    
+    if options.compare:
+        f = open(options.compare)
+        baseline = json.loads(f.read())
+        f.close()
+        print '\nCompared with %s:' % options.compare
+        regressed = False
+        for name, old, new, change, slower in compare(results, baseline,
+                                                      options.threshold):
+            flag = ''
+            if slower:
+                flag = '  REGRESSION'
+                regressed = True
+            print '%-30s%12.1f ->%10.1f  (%+.1f%%)%s' % (name, old, new,
+                                                         change, flag)
+        if regressed:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
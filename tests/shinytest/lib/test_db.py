@@ -18,3 +18,82 @@ class TestDB(ShinyTestCase):
         self.assertEqual(row.get('val2'), 55, 'Bad value: "%s" should be "%s"' % (row.get('val2'), str(55)))
         
 
+    
+    def test_batch(self):
+        db = self.world.db
+        db.begin()
+        db.insert("into foo (val1, val2) values (?,?)", ['bar', 1])
+        db.begin()
+        db.insert("into foo (val1, val2) values (?,?)", ['baz', 2])
+        db.commit()
+        # Still inside the outer batch, so nothing's been committed yet
+        db.rollback()
+        self.assertEqual(db.select("* from foo"), [])
+        self.assertEqual(db.batch_depth, 0)
+        db.begin()
+        db.insert("into foo (val1, val2) values (?,?)", ['bar', 1])
+        db.update("foo SET val2=? WHERE val1=?", [3, 'bar'])
+        db.commit()
+        db.rollback()
+        rows = db.select("* from foo")
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['val2'], 3)
+    
+    def test_configure(self):
+        import tempfile
+        import shutil
+        import os
+        from shinymud.lib.db import DB
+        tmp = tempfile.mkdtemp()
+        try:
+            db = DB(self.world.log, os.path.join(tmp, 'test.db'))
+            settings = db.configure([('journal_mode', 'WAL'),
+                                     ('synchronous', 'NORMAL'),
+                                     ('temp_store', 'MEMORY')])
+            self.assertEqual(settings['journal_mode'].lower(), 'wal')
+            self.assertEqual(settings['synchronous'], 1)
+            self.assertEqual(settings['temp_store'], 2)
+            self.assertRaises(Exception, db.configure, [('foo; drop table', 1)])
+            db.conn.execute("CREATE TABLE foo (id INTEGER PRIMARY KEY, val TEXT)")
+            db.insert("into foo (val) values (?)", ['bar'])
+            busy, pages, checkpointed = db.checkpoint()
+            self.assertEqual(busy, 0)
+            self.assertEqual(pages, checkpointed)
+            db.conn.close()
+        finally:
+            shutil.rmtree(tmp)
+    
+    def test_indexes(self):
+        from shinymud.lib.setup import initialize_database
+        db = self.world.db
+        indexes = [row['name'] for row in
+                   db.select("name FROM sqlite_master WHERE type='index'")]
+        for index in ['game_item_owner', 'game_item_container',
+                      'npc_event_prototype', 'room_spawns_room',
+                      'container_build_item', 'container_game_item']:
+            self.assertTrue(index in indexes)
+        # Missing indexes get made for databases that already exist
+        db.conn.execute('DROP INDEX game_item_owner')
+        initialize_database()
+        plan = db.conn.execute('EXPLAIN QUERY PLAN SELECT * FROM game_item '
+                               'WHERE owner=?', [1]).fetchall()
+        self.assertTrue('game_item_owner' in str(plan))
+    
+    def test_update_many(self):
+        db = self.world.db
+        for val in ['a', 'b', 'c']:
+            db.insert_from_dict('foo', {'val1': val, 'val2': 0})
+        db.conn.execute("ALTER TABLE foo ADD COLUMN dbid INTEGER")
+        db.conn.execute("UPDATE foo SET dbid=id")
+        count = db.update_many('foo', [{'dbid': 1, 'val2': 10},
+                                       {'dbid': 2, 'val2': 20},
+                                       {'dbid': 3, 'val1': 'z', 'val2': 30}])
+        self.assertEqual(count, 3)
+        rows = db.select('* from foo')
+        self.assertEqual([(r['val1'], r['val2']) for r in rows],
+                         [('a', 10), ('b', 20), ('z', 30)])
+        # The same changes always get the same SQL
+        self.assertEqual(db._statement('update', 'foo', ['val2']),
+                         'foo SET val2=? WHERE dbid=?')
+        self.assertTrue(db._statement('update', 'foo', ['val2']) is
+                        db.statements[('update', 'foo', ('val2',))])
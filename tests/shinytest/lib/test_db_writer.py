@@ -0,0 +1,190 @@
+from shinytest import ShinyTestCase
+
+import threading
+import tempfile
+import shutil
+import os
+
+class TestDBWriter(ShinyTestCase):
+    def setUp(self):
+        ShinyTestCase.setUp(self)
+        from shinymud.lib.db import DB
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'test.db')
+        self.db = DB(self.world.log, self.path)
+        self.db.conn.execute("CREATE TABLE foo (id INTEGER PRIMARY KEY, val TEXT UNIQUE)")
+    
+    def tearDown(self):
+        self.db.conn.close()
+        shutil.rmtree(self.tmp)
+        ShinyTestCase.tearDown(self)
+    
+    def test_writes(self):
+        from shinymud.lib.db_writer import DBWriter
+        woken = threading.Event()
+        writer = DBWriter(self.path, self.world.log, woken.set)
+        writer.start()
+        results = []
+        main_thread = threading.currentThread()
+        def done(result, error):
+            self.assertTrue(threading.currentThread() is main_thread)
+            results.append((result, error))
+        writer.submit('insert_from_dict', ('foo', {'val': 'bar'}), done)
+        writer.submit('insert_from_dict', ('foo', {'val': 'baz'}))
+        self.assertTrue(writer.flush(5))
+        self.assertTrue(woken.isSet())
+        # Everything's been committed, so we can see it from our connection
+        self.assertEqual(len(self.db.select('* from foo')), 2)
+        self.assertEqual(writer.run_callbacks(), 1)
+        self.assertEqual(results, [(1, None)])
+        
+        # A bad write doesn't stop the rest of its batch from being made
+        writer.submit('insert_from_dict', ('foo', {'val': 'bar'}), done)
+        writer.submit('update_from_dict', ('foo', {'dbid': 2, 'val': 'qux'}))
+        writer.submit('update', ('foo SET val=? WHERE id=?', ['qux', 2]), done)
+        writer.stop()
+        writer.run_callbacks()
+        self.assertTrue(results[1][1])
+        self.assertEqual(results[2], (1, None))
+        self.assertEqual(self.db.select('val from foo WHERE id=2'), [{'val': 'qux'}])
+        self.assertFalse(writer.has_callbacks())
+    
+    def test_db_hands_off_writes(self):
+        from shinymud.lib.db_writer import DBWriter
+        self.db.conn.execute("CREATE TABLE qux (dbid INTEGER PRIMARY KEY, "
+                             "val TEXT UNIQUE)")
+        self.db.insert_from_dict('qux', {'val': 'old'})
+        ours = dict((kind, self.db.query_stats[kind][0])
+                    for kind in ['insert', 'update', 'delete'])
+        writer = DBWriter(self.path, self.world.log)
+        writer.start()
+        self.db.use_writer(writer)
+        # Inserts are given their dbids up front, and just queued...
+        self.assertEqual(self.db.insert_from_dict('qux', {'val': 'bar'}), 2)
+        self.assertEqual(self.db.insert_from_dict('qux', {'val': 'baz'}), 3)
+        # (so one that breaks a constraint only fails once it's written)
+        self.assertEqual(self.db.insert_from_dict('qux', {'val': 'bar'}), 4)
+        # ...as are updates and deletes
+        self.assertEqual(self.db.update('qux SET val=? WHERE dbid=?',
+                                        ['qux', 2]), None)
+        self.db.delete('FROM qux WHERE dbid=?', [1])
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(self.db.select('dbid,val FROM qux'),
+                         [{'dbid': 2, 'val': 'qux'}, {'dbid': 3, 'val': 'baz'}])
+        # None of which were written with our own connection
+        for kind in ['insert', 'update', 'delete']:
+            self.assertEqual(self.db.query_stats[kind][0], ours[kind])
+        # ...but they still count in the world's metrics
+        from shinymud.lib.metrics import snapshot
+        self.world.db_writer = writer
+        deletes = self.world.db.query_stats['delete'][0]
+        self.assertEqual(snapshot(self.world)['db']['delete']['count'],
+                         deletes + 1)
+        self.world.db_writer = None
+        # A raw insert waits for sqlite3 to pick its row's id, and the dbids
+        # we hand out afterwards carry on from there
+        self.assertEqual(self.db.insert('into qux (val) values (?)', ['raw']), 4)
+        self.assertEqual(self.db.insert_from_dict('qux', {'val': 'new'}), 5)
+        self.db.use_writer(None)
+        writer.stop()
+    
+    def test_call_runs_only_its_own_callback(self):
+        from shinymud.lib.db_writer import DBWriter
+        writer = DBWriter(self.path, self.world.log)
+        writer.start()
+        results = []
+        def done(result, error):
+            results.append((result, error))
+        writer.submit('insert_from_dict', ('foo', {'val': 'bar'}), done)
+        self.assertEqual(writer.call('insert_from_dict', ('foo', {'val': 'baz'})),
+                         2)
+        self.assertRaises(Exception, writer.call, 'insert_from_dict',
+                          ('foo', {'val': 'baz'}))
+        # The first write's callback is still waiting for the main loop
+        self.assertEqual(results, [])
+        self.assertEqual(writer.run_callbacks(), 1)
+        self.assertEqual(results, [(1, None)])
+        writer.stop()
+    
+    def test_cascades(self):
+        from shinymud.lib.db_writer import DBWriter
+        self.db.conn.execute("CREATE TABLE bar (id INTEGER PRIMARY KEY, "
+                             "foo INTEGER REFERENCES foo(id) ON DELETE CASCADE)")
+        self.db.insert_from_dict('foo', {'val': 'parent'})
+        self.db.insert_from_dict('bar', {'foo': 1})
+        writer = DBWriter(self.path, self.world.log)
+        writer.start()
+        self.db.use_writer(writer)
+        # The writer's connection enforces foreign keys, just like ours
+        self.db.delete('FROM foo WHERE id=?', [1])
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(self.db.select('* FROM bar'), [])
+        self.db.use_writer(None)
+        writer.stop()
+    
+    def test_world_uses_writer(self):
+        from shinymud.lib.db_writer import DBWriter
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'foo'})
+        room = area.new_room()
+        other = area.new_room()
+        calls = []
+        class FakeWriter(object):
+            def submit(self, method, args=(), callback=None):
+                calls.append((method, args, callback))
+        self.world.db_writer = FakeWriter()
+        self.world.pending_saves = {}
+        room.name = 'A new name'
+        room.save()
+        other.save()
+        self.assertEqual(self.world.flush_saves(), 2)
+        # Only the room that changed gets written, in a batch for its table
+        method, args, callback = calls[0]
+        self.assertEqual((method, args), ('update_many',
+                         ('room', [{'dbid': room.dbid, 'name': 'A new name'}])))
+        # If the batch fails, the room gets written again on its own, in full
+        callback(None, Exception('disk on fire'))
+        method, args, callback = calls[1]
+        self.assertEqual(method, 'update_from_dict')
+        self.assertEqual(args[1]['name'], 'A new name')
+        self.assertTrue(len(args[1]) > 2)
+        callback(None, None)
+        self.assertEqual(len(calls), 2)
+        self.world.db_writer = None
+    
+    def test_new_ids_dont_wait_on_the_database(self):
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'foo'})
+        room = area.new_room()
+        area.new_room()
+        # (New rooms' and spawns' ids come from the ones we've loaded, so
+        # they're right even before the db writer has caught up)
+        selects = self.world.db.query_stats['select'][0]
+        self.assertEqual(area.get_id('room'), '3')
+        self.assertEqual(room.get_spawn_id(), '1')
+        self.assertEqual(self.world.db.query_stats['select'][0], selects)
+    
+    def test_sync_saves(self):
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'foo'})
+        room = area.new_room()
+        flushed = []
+        class FakeWriter(object):
+            timeout = 30
+            def submit(self, method, args=(), callback=None):
+                pass
+            def flush(self, timeout=None):
+                flushed.append(timeout)
+                return True
+        self.world.db_writer = FakeWriter()
+        self.world.pending_saves = {}
+        room.name = 'A new name'
+        room.save()
+        # Flushing only queues the writes; syncing waits for them, too
+        self.assertEqual(self.world.flush_saves(), 1)
+        self.assertEqual(flushed, [])
+        room.name = 'Another name'
+        room.save()
+        self.assertEqual(self.world.sync_saves('room'), 1)
+        self.assertEqual(flushed, [30])
+        self.world.db_writer = None
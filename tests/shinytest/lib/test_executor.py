@@ -0,0 +1,47 @@
+from shinytest import ShinyTestCase
+
+import threading
+
+class TestExecutor(ShinyTestCase):
+    def test_inline(self):
+        from shinymud.lib.executor import Executor
+        executor = Executor(0)
+        results = []
+        executor.submit(lambda x: x * 2, (21,),
+                        lambda result, error: results.append((result, error)))
+        self.assertEqual(results, [(42, None)])
+    
+    def test_workers(self):
+        from shinymud.lib.executor import Executor
+        woken = threading.Event()
+        executor = Executor(2, woken.set)
+        results = []
+        main_thread = threading.currentThread()
+        def work(x):
+            # This shouldn't be running in the main thread...
+            self.assertFalse(threading.currentThread() is main_thread)
+            if x < 0:
+                raise ValueError('negative!')
+            return x * 2
+        def done(result, error):
+            # ...but this should
+            self.assertTrue(threading.currentThread() is main_thread)
+            results.append((result, error))
+        executor.submit(work, (21,), done)
+        executor.submit(work, (-1,), done)
+        woken.wait(5)
+        self.assertTrue(woken.isSet())
+        executor.shutdown()
+        self.assertEqual(executor.run_callbacks(), 2)
+        self.assertEqual(results[0], (42, None))
+        self.assertTrue(isinstance(results[1][1], ValueError))
+        self.assertFalse(executor.has_callbacks())
+    
+    def test_world_runs_callbacks(self):
+        results = []
+        self.world.executor.submit(len, ('hello',),
+                                   lambda result, error: results.append(result))
+        self.world.executor.shutdown()
+        self.assertEqual(results, [])
+        self.world.turn()
+        self.assertEqual(results, [5])
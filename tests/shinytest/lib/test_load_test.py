@@ -0,0 +1,45 @@
+from shinytest import ShinyTestCase
+
+import socket
+
+class TestLoadTest(ShinyTestCase):
+    def test_bot_name(self):
+        from shinymud.lib.load_test import bot_name
+        names = [bot_name(i) for i in range(2000)]
+        self.assertEqual(len(set(names)), 2000)
+        for name in names:
+            self.assertTrue(name.isalpha())
+    
+    def test_decode_websocket(self):
+        from shinymud.lib.load_test import Bot
+        from shinymud.lib.connection_handlers.websocket_frames import \
+             encode_frame, MessageDeflater, TEXT
+        bot = Bot(None, 0, 'websocket')
+        bot.state = 'handshake'
+        bot.ws_answer = 'abc='
+        deflater = MessageDeflater()
+        frame = encode_frame(TEXT, deflater.compress('Hello\r\nName: '),
+                             rsv1=True)
+        bot.raw = ('HTTP/1.1 101 Switching Protocols\r\n'
+                   'Sec-WebSocket-Accept: abc=\r\n'
+                   'Sec-WebSocket-Extensions: permessage-deflate\r\n\r\n' +
+                   frame[:5])
+        self.assertEqual(bot.decode_websocket(), '')
+        self.assertEqual(bot.state, 'login')
+        bot.raw += frame[5:]
+        self.assertEqual(bot.decode_websocket(), 'Hello\r\nName: \n')
+    
+    def test_decode_telnet(self):
+        from shinymud.lib.load_test import Bot
+        a, b = socket.socketpair()
+        bot = Bot(None, 0, 'telnet')
+        bot.sock = a
+        # IAC WILL LINEMODE, split across two reads
+        bot.raw = 'Hello\xff\xfb'
+        self.assertEqual(bot.decode_telnet(), 'Hello')
+        bot.raw += '\x22\r\nName: '
+        self.assertEqual(bot.decode_telnet(), '\r\nName: ')
+        # We should have told the server we don't want linemode
+        self.assertEqual(b.recv(16), '\xff\xfe\x22')
+        a.close()
+        b.close()
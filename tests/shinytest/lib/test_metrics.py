@@ -0,0 +1,121 @@
+from shinytest import ShinyTestCase
+
+import socket
+import json
+
+class TestMetrics(ShinyTestCase):
+    def test_snapshot(self):
+        from shinymud.lib.metrics import snapshot, format_prometheus, rss_bytes
+        from shinymud.models.area import Area
+        from shinymud.models.player import Player
+        area = Area.create({'name': 'foo'})
+        area.new_room()
+        area.new_room()
+        self.world.area_add(area)
+        class FakeConn(object):
+            negotiated = True
+            def recv(self):
+                return False
+            def has_output(self):
+                return False
+        bob = Player(FakeConn())
+        bob.name = 'bob'
+        bob.mode = None
+        self.world.player_add(bob)
+        # Nobody wants the metrics, so they aren't worked out
+        self.world.turn()
+        self.assertEqual(self.world.metrics, {})
+        self.world.publish_metrics = True
+        self.world.turn()
+        snap = self.world.metrics
+        self.assertEqual(snap['players'], ['bob'])
+        self.assertEqual(snap['connections'], {'FakeConn': 1})
+        self.assertEqual(snap['areas']['foo']['rooms'], 2)
+        self.assertEqual(snap['tick']['turn']['count'], 2)
+        self.assertEqual(snap['tick']['turn']['buckets'][-1], ('+Inf', 2))
+        self.assertTrue(snap['db']['insert']['count'] >= 3)
+        self.assertTrue(rss_bytes() > 0)
+        # ...and aren't worked out again until METRICS_INTERVAL is up
+        self.world.turn()
+        self.assertTrue(self.world.metrics is snap)
+        # The snapshot is a copy, not a view of the live game
+        self.world.player_list = {}
+        self.assertEqual(snap['players'], ['bob'])
+        
+        snap['rss_bytes'] = rss_bytes()
+        text = format_prometheus(snap)
+        self.assertTrue('shinymud_players_online 1\n' in text)
+        self.assertTrue('shinymud_area_objects{area="foo",kind="rooms"} 2\n' in text)
+        self.assertTrue('shinymud_tick_seconds_bucket{phase="turn",le="+Inf"} 2\n'
+                        in text)
+        self.assertTrue('# TYPE shinymud_db_queries_total counter\n' in text)
+    
+    def test_metrics_handler(self):
+        from shinymud.lib.connection_handlers.con_handlers import \
+             MetricsHandler, ConnectionListener
+        listener = ConnectionListener(self.world)
+        handler = MetricsHandler(0, '', self.world)
+        listener.add_handler(handler)
+        self.assertTrue(self.world.publish_metrics)
+        handler.listen()
+        listener.reactor.register(handler, handler)
+        port = handler.listener.getsockname()[1]
+        def get(path):
+            client = socket.create_connection(('127.0.0.1', port))
+            client.send('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % path)
+            # Accept the client, then read its request
+            for i in range(2):
+                for ready, events in listener.reactor.poll(1):
+                    ready.handle_ready()
+            client.settimeout(1)
+            response = ''
+            data = client.recv(65536)
+            while data:
+                response += data
+                data = client.recv(65536)
+            client.close()
+            return response.split('\r\n\r\n', 1)
+        # No metrics until the world's first turn
+        headers, body = get('/metrics')
+        self.assertTrue(headers.startswith('HTTP/1.0 503'))
+        self.world.turn()
+        headers, body = get('/metrics')
+        self.assertTrue(headers.startswith('HTTP/1.0 200 OK'))
+        self.assertTrue('shinymud_players_online 0\n' in body)
+        self.assertTrue('shinymud_resident_memory_bytes ' in body)
+        headers, body = get('/status')
+        self.assertTrue('application/json' in headers)
+        self.assertEqual(json.loads(body)['players'], [])
+        headers, body = get('/nothing')
+        self.assertTrue(headers.startswith('HTTP/1.0 404'))
+        self.assertEqual(handler.requests, [])
+        
+        # Clients that never finish their request get hung up on
+        client = socket.create_connection(('127.0.0.1', port))
+        client.send('GET /met')
+        for i in range(2):
+            for ready, events in listener.reactor.poll(1):
+                ready.handle_ready()
+        self.assertEqual(len(handler.requests), 1)
+        handler.requests[0].deadline = 0
+        handler.idle()
+        self.assertEqual(handler.requests, [])
+        client.settimeout(1)
+        self.assertEqual(client.recv(100), '')
+        client.close()
+        
+        # Nor do we hang on to clients whose connections break
+        import struct
+        client = socket.create_connection(('127.0.0.1', port))
+        client.send('GET /met')
+        for ready, events in listener.reactor.poll(1):
+            ready.handle_ready()
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                          struct.pack('ii', 1, 0))
+        client.close()
+        for i in range(2):
+            for ready, events in listener.reactor.poll(0.1):
+                ready.handle_ready()
+        self.assertEqual(handler.requests, [])
+        handler.listener.close()
+        listener.reactor.close()
@@ -0,0 +1,19 @@
+from shinytest import ShinyTestCase
+
+class TestRateLimit(ShinyTestCase):
+    def test_token_bucket(self):
+        from shinymud.lib.rate_limit import TokenBucket
+        bucket = TokenBucket(2, 3)
+        now = bucket.last
+        for i in range(3):
+            self.assertTrue(bucket.consume(now=now))
+        self.assertFalse(bucket.consume(now=now))
+        self.assertFalse(bucket.full(now=now))
+        # Two tokens a second
+        self.assertTrue(bucket.consume(now=now + 0.5))
+        self.assertFalse(bucket.consume(now=now + 0.5))
+        self.assertFalse(bucket.consume(2, now=now + 1))
+        # ...but never more than the burst size
+        self.assertTrue(bucket.full(now=now + 100))
+        self.assertFalse(bucket.consume(4, now=now + 100))
+        self.assertTrue(bucket.consume(3, now=now + 100))
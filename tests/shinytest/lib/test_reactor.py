@@ -0,0 +1,43 @@
+from shinytest import ShinyTestCase
+
+import socket
+
+class TestReactor(ShinyTestCase):
+    def test_poll_readable(self):
+        from shinymud.lib.reactor import Reactor, READ
+        reactor = Reactor()
+        a, b = socket.socketpair()
+        reactor.register(a, 'bob')
+        self.assertEqual(reactor.poll(0), [])
+        b.send('hello')
+        ready = reactor.poll(1)
+        self.assertEqual(len(ready), 1)
+        self.assertEqual(ready[0][0], 'bob')
+        self.assertTrue(ready[0][1] & READ)
+        # Registering again should just replace the handler
+        reactor.register(a, 'alice')
+        self.assertEqual(reactor.poll(1)[0][0], 'alice')
+        reactor.unregister(a)
+        self.assertEqual(reactor.poll(0), [])
+        a.close()
+        b.close()
+        reactor.close()
+
+    def test_wake(self):
+        from shinymud.lib.reactor import Reactor
+        import threading
+        import time
+        reactor = Reactor()
+        threading.Timer(0.1, reactor.wake).start()
+        start = time.time()
+        # The wakeup itself isn't reported as a ready connection
+        self.assertEqual(reactor.poll(5), [])
+        self.assertTrue(time.time() - start < 4)
+        # ...and it's used up once poll() has returned
+        reactor.wake()
+        reactor.poll(0)
+        start = time.time()
+        reactor.poll(0.2)
+        self.assertTrue(time.time() - start >= 0.15)
+        reactor.close()
+    
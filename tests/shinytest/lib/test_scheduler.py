@@ -0,0 +1,65 @@
+from shinytest import ShinyTestCase
+
+import time
+
+class TestScheduler(ShinyTestCase):
+    def test_run_due(self):
+        from shinymud.lib.scheduler import Scheduler
+        scheduler = Scheduler()
+        ran = []
+        now = time.time()
+        scheduler.call_at(now + 2, ran.append, 'second')
+        scheduler.call_at(now + 1, ran.append, 'first')
+        cancelled = scheduler.call_at(now + 1, ran.append, 'cancelled')
+        scheduler.call_at(now + 10, ran.append, 'later')
+        cancelled.cancel()
+        self.assertEqual(len(scheduler), 3)
+        self.assertEqual(scheduler.next_deadline(), now + 1)
+        self.assertEqual(scheduler.run_due(now), 0)
+        self.assertEqual(scheduler.run_due(now + 5), 2)
+        self.assertEqual(ran, ['first', 'second'])
+        self.assertEqual(scheduler.next_deadline(), now + 10)
+        self.assertEqual(len(scheduler), 1)
+    
+    def test_area_reset_scheduled_on_visit(self):
+        from shinymud.models.area import Area
+        from shinymud.models.player import Player
+        area = Area.create({'name': 'foo'})
+        room = area.new_room()
+        self.assertEqual(area.reset_timer, None)
+        bob = Player(('bob', 'bar'))
+        bob.playerize({'name': 'bob', 'password': 'pork'})
+        room.add_char(bob)
+        timer = area.reset_timer
+        self.assertTrue(timer)
+        self.assertEqual(area.times_visited_since_reset, 1)
+        # Further visits shouldn't schedule another reset
+        room.remove_char(bob)
+        room.add_char(bob)
+        self.assertTrue(area.reset_timer is timer)
+        self.assertEqual(len(self.world.scheduler), 1)
+        # When the timer goes off, the area resets and waits for another visit
+        self.world.scheduler.run_due(timer.when)
+        self.assertEqual(area.reset_timer, None)
+        self.assertEqual(area.times_visited_since_reset, 0)
+        self.assertTrue(area.time_of_last_reset > 0)
+        # Resetting by hand cancels a pending reset
+        room.add_char(bob)
+        timer = area.reset_timer
+        area.reset()
+        self.assertTrue(timer.cancelled)
+        self.assertEqual(self.world.scheduler.next_deadline(), None)
+    
+    def test_active_set(self):
+        from shinymud.lib.scheduler import ActiveSet
+        active = ActiveSet()
+        for x in ['a', 'b', 'a', 'c', 'b']:
+            active.add(x)
+        self.assertEqual(list(active), ['a', 'b', 'c'])
+        active.discard('b')
+        active.discard('z')
+        self.assertFalse('b' in active)
+        self.assertEqual(active.drain(), ['a', 'c'])
+        self.assertEqual(len(active), 0)
+        active.add('a')
+        self.assertTrue('a' in active)
@@ -0,0 +1,239 @@
+from shinytest import ShinyTestCase
+
+import socket
+
+class TestShinyConnections(ShinyTestCase):
+    def make_telnet(self):
+        """Return a TelnetConnection (skipping option negotiation) and the
+        socket on the client's end of it.
+        """
+        from shinymud.lib.connection_handlers.shiny_connections import \
+             TelnetConnection
+        server, client = socket.socketpair()
+        # Don't wait around for answers to our telnet options
+        set_telnet_options = TelnetConnection.set_telnet_options
+        TelnetConnection.set_telnet_options = lambda self: None
+        try:
+            conn = TelnetConnection((server, 'test'), self.world.log)
+        finally:
+            TelnetConnection.set_telnet_options = set_telnet_options
+        return conn, client
+    
+    def read_all(self, sock):
+        sock.setblocking(0)
+        data = ''
+        try:
+            while 1:
+                data += sock.recv(65536)
+        except socket.error:
+            pass
+        return data
+    
+    def test_send_coalesces_lines(self):
+        conn, client = self.make_telnet()
+        queue = ['hello', 'world', '> ']
+        self.assertTrue(conn.send(queue))
+        self.assertEqual(queue, [])
+        self.assertEqual(client.recv(100), 'hello\r\nworld\r\n> ')
+        self.assertFalse(conn.has_output())
+    
+    def test_recv(self):
+        conn, client = self.make_telnet()
+        self.assertEqual(conn.recv(), False)
+        # Pipelined lines, with a window size change in the middle of them
+        client.send('north\r\nso\xff\xfa\x1f\x00\x64\x00\x30\xff\xf0uth\r')
+        self.assertEqual(conn.recv(), ['north', 'south'])
+        self.assertEqual(conn.win_size, (100, 48))
+        client.send('\nlook')
+        self.assertEqual(conn.recv(), False)
+        client.send('\r\n')
+        self.assertEqual(conn.recv(), ['look'])
+        client.close()
+        self.assertEqual(conn.recv(), None)
+    
+    def test_partial_sends(self):
+        conn, client = self.make_telnet()
+        conn.conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        line = 'x' * 1000
+        queue = [line] * 100
+        expected = '\r\n'.join(queue)
+        self.assertTrue(conn.send(queue))
+        # The socket can't hold it all, so some of it should be waiting
+        self.assertTrue(conn.has_output())
+        received = ''
+        while conn.has_output():
+            received += self.read_all(client)
+            self.assertTrue(conn.flush())
+        received += self.read_all(client)
+        self.assertEqual(received, expected)
+    
+    def test_high_water(self):
+        from shinymud.data.config import OUTPUT_HIGH_WATER
+        conn, client = self.make_telnet()
+        # Our client never reads, so eventually we should give up on it
+        alive = True
+        sent = 0
+        while alive and sent <= OUTPUT_HIGH_WATER * 2:
+            alive = conn.send(['x' * 10000])
+            sent += 10000
+        self.assertFalse(alive)
+        self.assertFalse(conn.has_output())
+    
+    def test_high_water_burst(self):
+        from shinymud.data.config import OUTPUT_HIGH_WATER
+        conn, client = self.make_telnet()
+        conn.conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                             OUTPUT_HIGH_WATER * 4)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                          OUTPUT_HIGH_WATER * 4)
+        # More than the high water mark in one go, but the socket takes most
+        # of it, so the client's still fine
+        self.assertTrue(conn.send(['x' * (OUTPUT_HIGH_WATER + 1000)]))
+        self.assertTrue(len(conn.out_buffer) <= OUTPUT_HIGH_WATER)
+    
+    def test_mccp(self):
+        import zlib
+        conn, client = self.make_telnet()
+        # Until the client agrees to MCCP2, output goes out as plain text
+        self.assertTrue(conn.send(['hello']))
+        self.assertEqual(client.recv(100), 'hello')
+        self.assertEqual(conn.compression_ratio(), 1.0)
+        # IAC DO COMPRESS2
+        client.send('\xff\xfd\x56')
+        self.assertEqual(conn.recv(), False)
+        self.assertTrue(conn.compressor)
+        lines = ['You see a goblin here.'] * 50
+        self.assertTrue(conn.send(list(lines)))
+        data = self.read_all(client)
+        # IAC SB COMPRESS2 IAC SE, then a zlib stream
+        self.assertEqual(data[:5], '\xff\xfa\x56\xff\xf0')
+        decompressor = zlib.decompressobj()
+        self.assertEqual(decompressor.decompress(data[5:]), '\r\n'.join(lines))
+        # Each send is flushed, so the client can decode it straight away
+        # with the same zlib stream
+        self.assertTrue(conn.send(['bye']))
+        self.assertEqual(decompressor.decompress(self.read_all(client)), 'bye')
+        self.assertTrue(conn.compression_ratio() > 2)
+    
+    def test_gmcp(self):
+        import json
+        conn, client = self.make_telnet()
+        # Nothing goes out until the client asks for GMCP
+        conn.send_status('Char.Vitals', {'hp': 10})
+        self.assertFalse(conn.has_output())
+        # IAC DO GMCP
+        client.send('\xff\xfd\xc9')
+        self.assertEqual(conn.recv(), False)
+        self.assertTrue(conn.gmcp)
+        conn.send_status('Char.Vitals', {'hp': 10})
+        self.assertTrue(conn.send(['> ']))
+        data = self.read_all(client)
+        # IAC SB GMCP <package> <json> IAC SE, then the normal output
+        self.assertTrue(data.startswith('\xff\xfa\xc9Char.Vitals '))
+        end = data.index('\xff\xf0')
+        self.assertEqual(json.loads(data[len('\xff\xfa\xc9Char.Vitals '):end]),
+                         {'hp': 10})
+        self.assertEqual(data[end + 2:], '> ')
+    
+    def test_telnet_negotiation(self):
+        from shinymud.lib.connection_handlers.shiny_connections import \
+             TelnetConnection
+        server, client = socket.socketpair()
+        conn = TelnetConnection((server, 'test'), self.world.log)
+        # Our options go out straight away, without waiting for an answer
+        self.assertTrue(client.recv(100).startswith('\xff\xfb\x22\xff\xfd\x1f'))
+        self.assertEqual(conn.negotiate(), False)
+        # IAC DONT LINEMODE, IAC WILL NAWS, then the window size...
+        client.send('\xff\xfe\x22\xff\xfb\x1f')
+        self.assertEqual(conn.negotiate(), False)
+        client.send('\xff\xfa\x1f\x00\x78\x00\x28\xff\xf0\xff\xfe\x56')
+        self.assertEqual(conn.negotiate(), False)
+        # ...and IAC DONT GMCP means everything's been answered
+        client.send('\xff\xfe\xc9')
+        self.assertEqual(conn.negotiate(), True)
+        self.assertEqual(conn.win_size, (120, 40))
+        self.assertFalse(conn.compressor)
+        self.assertFalse(conn.gmcp)
+        
+        # A client that never answers gets greeted once the deadline passes
+        server, client = socket.socketpair()
+        conn = TelnetConnection((server, 'test'), self.world.log)
+        self.assertEqual(conn.negotiate(), False)
+        conn.deadline = 0
+        self.assertEqual(conn.negotiate(), True)
+    
+    def test_websocket_handshake(self):
+        from shinymud.lib.connection_handlers.shiny_connections import \
+             WebsocketConnection
+        # The example handshake from RFC 6455
+        request = ('GET /chat HTTP/1.1\r\nHost: server.example.com\r\n'
+                   'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                   'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+                   'Origin: http://example.com\r\n'
+                   'Sec-WebSocket-Version: 13\r\n\r\n')
+        server, client = socket.socketpair()
+        conn = WebsocketConnection((server, 'test'), self.world.log,
+                                   'localhost', 4112)
+        # A handshake that dribbles in shouldn't hold anything up
+        self.assertEqual(conn.negotiate(), False)
+        client.send(request[:50])
+        self.assertEqual(conn.negotiate(), False)
+        client.send(request[50:])
+        self.assertEqual(conn.negotiate(), True)
+        response = self.read_all(client)
+        self.assertTrue(response.startswith('HTTP/1.1 101'))
+        self.assertTrue('Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n'
+                        in response)
+        self.assertFalse(conn.deflater)
+        
+        # ...but one that never finishes gets dropped
+        server, client = socket.socketpair()
+        conn = WebsocketConnection((server, 'test'), self.world.log,
+                                   'localhost', 4112)
+        client.send(request[:50])
+        self.assertEqual(conn.negotiate(), False)
+        conn.deadline = 0
+        self.assertEqual(conn.negotiate(), None)
+    
+    def test_websocket_frames(self):
+        from shinymud.lib.connection_handlers.shiny_connections import \
+             WebsocketConnection
+        from shinymud.lib.connection_handlers.websocket_frames import \
+             encode_frame, FrameParser, MessageDeflater, TEXT, PING, PONG, CLOSE
+        request = ('GET / HTTP/1.1\r\nHost: localhost\r\n'
+                   'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                   'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+                   'Sec-WebSocket-Extensions: permessage-deflate; '
+                   'client_max_window_bits\r\n'
+                   'Sec-WebSocket-Version: 13\r\n\r\n')
+        server, client = socket.socketpair()
+        conn = WebsocketConnection((server, 'test'), self.world.log,
+                                   'localhost', 4112)
+        client.send(request)
+        self.assertEqual(conn.negotiate(), True)
+        response = self.read_all(client)
+        self.assertTrue('Sec-WebSocket-Extensions: permessage-deflate\r\n'
+                        in response)
+        reader = FrameParser(MessageDeflater(), masked=False)
+        # A whole turn's output goes out as one compressed frame
+        lines = ['You see a goblin here.'] * 20 + ['> ']
+        self.assertTrue(conn.send(list(lines)))
+        data = self.read_all(client)
+        self.assertTrue(ord(data[0]) & 0x40)
+        self.assertEqual(reader.feed(data), [(TEXT, '\r\n'.join(lines))])
+        self.assertTrue(conn.compression_ratio() > 2)
+        # The deflate context carries on from one frame to the next
+        self.assertTrue(conn.send(['You see a goblin here.']))
+        self.assertEqual(reader.feed(self.read_all(client)),
+                         [(TEXT, 'You see a goblin here.')])
+        
+        # Masked input, several lines at once
+        client.send(encode_frame(TEXT, 'look\nsay hi\r\n', mask='abcd'))
+        self.assertEqual(conn.recv(), ['look', 'say hi'])
+        client.send(encode_frame(PING, 'hey', mask='abcd'))
+        self.assertEqual(conn.recv(), False)
+        self.assertEqual(reader.feed(self.read_all(client)), [(PONG, 'hey')])
+        client.send(encode_frame(CLOSE, '\x03\xe8', mask='abcd'))
+        self.assertEqual(conn.recv(), None)
+        self.assertEqual(reader.feed(self.read_all(client)),
+                         [(CLOSE, '\x03\xe8')])
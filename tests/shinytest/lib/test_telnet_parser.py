@@ -0,0 +1,37 @@
+from shinytest import ShinyTestCase
+
+class TestTelnetParser(ShinyTestCase):
+    def make_parser(self):
+        from shinymud.lib.connection_handlers.telnet_parser import TelnetParser
+        self.options = []
+        self.subnegs = []
+        return TelnetParser(lambda cmd, opt: self.options.append((cmd, opt)),
+                            lambda opt, payload: self.subnegs.append((opt, payload)))
+    
+    def test_lines(self):
+        parser = self.make_parser()
+        parser.feed('look\r\nget sword\r\n\r\nsa')
+        self.assertEqual(parser.take_lines(), ['look', 'get sword'])
+        self.assertEqual(parser.take_lines(), [])
+        parser.feed('y hi\r')
+        self.assertEqual(parser.take_lines(), ['say hi'])
+        # The \n that finishes off a \r\n split between reads isn't a new line
+        parser.feed('\nnorth\r\0south\n')
+        self.assertEqual(parser.take_lines(), ['north', 'south'])
+        # An escaped IAC is part of the text
+        parser.feed('a\xff\xffb\r\n')
+        self.assertEqual(parser.take_lines(), ['a\xffb'])
+    
+    def test_negotiations(self):
+        from shinymud.lib.connection_handlers.telnet_parser import DO, WONT, \
+             NAWS, COMPRESS2
+        parser = self.make_parser()
+        data = 'lo\xff\xfd\x56ok\xff\xfc\x22\r\n\xff\xfa\x1f\x00\xff\xff\x00\x18\xff\xf0'
+        # However the data gets split up, we should get the same result
+        for size in (1, 2, 3, len(data)):
+            self.options, self.subnegs = [], []
+            for i in range(0, len(data), size):
+                parser.feed(data[i:i + size])
+            self.assertEqual(parser.take_lines(), ['look'])
+            self.assertEqual(self.options, [(DO, COMPRESS2), (WONT, '\x22')])
+            self.assertEqual(self.subnegs, [(NAWS, '\x00\xff\x00\x18')])
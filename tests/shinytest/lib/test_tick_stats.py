@@ -0,0 +1,68 @@
+from shinytest import ShinyTestCase
+
+import json
+import os
+import tempfile
+
+class TestTickStats(ShinyTestCase):
+    def test_percentile(self):
+        from shinymud.lib.tick_stats import percentile
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([], 50), 0)
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_turn_phases(self):
+        from shinymud.lib.tick_stats import TickStats
+        fd, logfile = tempfile.mkstemp()
+        os.close(fd)
+        stats = TickStats(window_size=5, logfile=logfile, dump_interval=0)
+        for i in range(10):
+            stats.start_turn()
+            for phase in TickStats.PHASES:
+                stats.lap(phase)
+            stats.end_turn()
+        summary = stats.summary()
+        self.assertEqual(stats.turns, 10)
+        for phase in TickStats.PHASES + ['turn']:
+            self.assertEqual(summary[phase]['count'], 5)
+            self.assertTrue(summary[phase]['max'] >= summary[phase]['p50'])
+
+        lines = open(logfile).readlines()
+        os.remove(logfile)
+        self.assertEqual(len(lines), 10)
+        record = json.loads(lines[-1])
+        self.assertEqual(record['turns'], 10)
+        self.assertTrue('players' in record['phases'])
+
+        # The histograms count every turn, not just the window
+        buckets, total, count = stats.histogram('turn')
+        self.assertEqual(count, 10)
+        self.assertEqual(buckets[-1], (float('inf'), 10))
+        self.assertEqual(len(buckets), len(TickStats.HISTOGRAM_BUCKETS) + 1)
+        
+        stats.reset()
+        self.assertEqual(stats.turns, 0)
+        self.assertEqual(stats.histogram('turn')[2], 0)
+        self.assertEqual(stats.summary()['turn']['count'], 0)
+
+    def test_tickstats_command(self):
+        from shinymud.models.player import Player
+        from shinymud.commands.commands import TickStats
+        from shinymud.data.config import ADMIN
+        bob = Player(('bob', 'bar'))
+        bob.mode = None
+        bob.playerize({'name': 'bob', 'password': 'pork'})
+        bob.outq = []
+        TickStats(bob, None, 'tickstats').run()
+        self.assertEqual(bob.outq[-1], "You don't have the authority to do that!\n")
+        bob.permissions = bob.permissions | ADMIN
+        TickStats(bob, None, 'tickstats').run()
+        self.assertTrue('Tick Stats' in bob.outq[-2])
+        self.assertTrue('Connections' in bob.outq[-1])
+        TickStats(bob, 'reset', 'tickstats').run()
+        self.assertEqual(bob.outq[-1], 'Tick stats have been reset.')
+
@@ -0,0 +1,48 @@
+from shinytest import ShinyTestCase
+
+class TestWebsocketFrames(ShinyTestCase):
+    def test_unmask(self):
+        from shinymud.lib.connection_handlers.websocket_frames import unmask
+        # The masked "Hello" example from RFC 6455, 5.7
+        self.assertEqual(unmask('\x7f\x9f\x4d\x51\x58', '\x37\xfa\x21\x3d'),
+                         'Hello')
+        self.assertEqual(unmask('', 'abcd'), '')
+    
+    def test_fragmented_messages(self):
+        from shinymud.lib.connection_handlers.websocket_frames import \
+             FrameParser, ProtocolError, TEXT, PING
+        parser = FrameParser()
+        # "Hel" + ping + "lo", masked, fed to the parser a byte at a time
+        data = ('\x01\x83\x37\xfa\x21\x3d\x7f\x9f\x4d'
+                '\x89\x80\x00\x00\x00\x00'
+                '\x80\x82\x37\xfa\x21\x3d\x5b\x95')
+        messages = []
+        for byte in data:
+            messages += parser.feed(byte)
+        self.assertEqual(messages, [(PING, ''), (TEXT, 'Hello')])
+        # Clients have to mask their frames
+        self.assertRaises(ProtocolError, parser.feed, '\x81\x05Hello')
+        parser = FrameParser(max_size=10)
+        self.assertRaises(ProtocolError, parser.feed, '\x81\xfe\x00\x0b')
+    
+    def test_deflate_offers(self):
+        from shinymud.lib.connection_handlers.websocket_frames import \
+             parse_deflate_offer
+        self.assertEqual(parse_deflate_offer(''), None)
+        self.assertEqual(parse_deflate_offer('x-webkit-deflate-frame'), None)
+        self.assertEqual(parse_deflate_offer('permessage-deflate; client_max_window_bits'),
+                         ('permessage-deflate', 15, False))
+        # We skip offers we don't understand, and take the next one
+        self.assertEqual(parse_deflate_offer(
+                         'permessage-deflate; foo=1, permessage-deflate; '
+                         'server_no_context_takeover; server_max_window_bits=10'),
+                         ('permessage-deflate; server_no_context_takeover; '
+                          'server_max_window_bits=10', 10, True))
+        # We can't do a window of 8, and mustn't answer with more than was
+        # offered
+        self.assertEqual(parse_deflate_offer(
+                         'permessage-deflate; server_max_window_bits=8'), None)
+        self.assertEqual(parse_deflate_offer(
+                         'permessage-deflate; server_max_window_bits=8, '
+                         'permessage-deflate'),
+                         ('permessage-deflate', 15, False))
@@ -99,3 +99,195 @@ class TestReset(ShinyTestCase):
         self.assertEqual(len(db_scripts), 0)
         self.assertEqual(len(db_items), 0)
         self.assertEqual(len(db_item_types), 0)
+    
+    def test_player_handoff(self):
+        from shinymud.models.player import Player
+        class FakeConn(object):
+            addr = ('127.0.0.1', 1234)
+            negotiated = True
+            sent = []
+            def send(self, queue):
+                self.sent.extend(queue)
+                del queue[:]
+                return True
+        
+        conn = FakeConn()
+        bob = Player(conn)
+        self.world.player_handoff(bob)
+        self.assertEqual(self.world.player_list, {})
+        self.world.player_list_lock.acquire()
+        self.world.add_new_players()
+        self.world.player_list_lock.release()
+        self.assertTrue(self.world.player_list[conn] is bob)
+        self.assertEqual(len(self.world.new_players), 0)
+        # The new player should have been greeted right away
+        self.assertTrue('Name: ' in conn.sent)
+    
+    def test_reap_idle(self):
+        from shinymud.models.player import Player
+        from shinymud.data.config import LOGIN_TIMEOUT, IDLE_TIMEOUT
+        class FakeConn(object):
+            addr = ('127.0.0.1', 1234)
+            negotiated = True
+            closed = False
+            def send(self, queue):
+                del queue[:]
+                return True
+            def has_output(self):
+                return False
+            def close(self):
+                self.closed = True
+        
+        stalled = Player(FakeConn())
+        self.world.player_add(stalled)
+        bob = Player(FakeConn())
+        bob.mode = None
+        bob.playerize({'name': 'bob', 'password': 'pork'})
+        bob.save()
+        self.world.player_add(bob)
+        now = bob.last_input
+        # Nobody has been around long enough to be reaped yet
+        self.assertEqual(self.world.reap_idle(now + 1), 0)
+        self.assertEqual(self.world.reap_idle(now + LOGIN_TIMEOUT + 1), 1)
+        self.assertTrue(stalled.conn.closed)
+        self.assertFalse(bob.conn.closed)
+        bob.queue_input(['look'])
+        self.assertEqual(self.world.reap_idle(bob.last_input + 1), 0)
+        self.world.cleanup()
+        self.assertEqual(self.world.reap_idle(bob.last_input + IDLE_TIMEOUT + 1), 1)
+        self.assertTrue(bob.conn.closed)
+        self.assertEqual(self.world.reaped, {'login': 1, 'idle': 1})
+    
+    def test_write_behind(self):
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'foo'})
+        room = area.new_room()
+        self.world.pending_saves = {}
+        room.name = 'A new name'
+        room.save()
+        room.save()
+        # The save is held back until the world flushes its saves
+        row = self.world.db.select('* FROM room WHERE dbid=?', [room.dbid])[0]
+        self.assertNotEqual(row['name'], 'A new name')
+        self.assertEqual(len(self.world.pending_saves), 1)
+        self.assertEqual(self.world.flush_saves(), 1)
+        row = self.world.db.select('* FROM room WHERE dbid=?', [room.dbid])[0]
+        self.assertEqual(row['name'], 'A new name')
+        self.assertEqual(self.world.flush_saves(), 0)
+        # Models that haven't been saved before still get saved straight away
+        # (so they have a dbid), and deleted models are forgotten
+        new_room = area.new_room()
+        self.assertTrue(new_room.dbid)
+        new_room.save()
+        new_room.destruct()
+        self.assertEqual(self.world.pending_saves, {})
+        
+        # A table's saves can be flushed on their own, before it's read back
+        script = area.new_script()
+        script.name = 'A new script'
+        script.save()
+        room.name = 'Another name'
+        room.save()
+        self.assertEqual(self.world.flush_saves('room'), 1)
+        row = self.world.db.select('* FROM room WHERE dbid=?', [room.dbid])[0]
+        self.assertEqual(row['name'], 'Another name')
+        self.assertEqual(self.world.pending_saves.keys(),
+                         [('script', script.dbid)])
+        self.world.flush_saves()
+        
+        # Saves that fail are held on to, to try again later
+        def fail(*args):
+            raise Exception('Disk on fire')
+        self.world.db.update_many = fail
+        self.world.db.update_from_dict = fail
+        room.name = 'A third name'
+        room.save()
+        self.assertEqual(self.world.flush_saves(), 1)
+        self.assertEqual(self.world.pending_saves.values(), [room])
+        del self.world.db.update_many
+        del self.world.db.update_from_dict
+        self.assertEqual(self.world.flush_saves(), 1)
+        row = self.world.db.select('* FROM room WHERE dbid=?', [room.dbid])[0]
+        self.assertEqual(row['name'], 'A third name')
+        self.assertEqual(self.world.pending_saves, {})
+        self.assertEqual(room.save_failures, 0)
+        
+        # ...but not forever
+        from shinymud.data.config import SAVE_RETRIES
+        self.world.db.update_many = fail
+        self.world.db.update_from_dict = fail
+        room.name = 'A fourth name'
+        room.save()
+        for i in range(SAVE_RETRIES):
+            self.world.flush_saves()
+        self.assertEqual(self.world.pending_saves, {})
+        del self.world.db.update_many
+        del self.world.db.update_from_dict
+    
+    def test_poison_save(self):
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'foo'})
+        rooms = [area.new_room() for i in range(3)]
+        self.world.pending_saves = {}
+        # A room that can never be saved (rooms' ids are unique in an area)...
+        rooms[1].id = rooms[0].id
+        rooms[1].save()
+        rooms[0].name = 'A new name'
+        rooms[0].save()
+        rooms[2].name = 'Another name'
+        rooms[2].save()
+        self.world.flush_saves()
+        # ...doesn't stop the others being saved, and is given up on straight
+        # away
+        rows = self.world.db.select('name FROM room WHERE dbid IN (?, ?)',
+                                    [rooms[0].dbid, rooms[2].dbid])
+        self.assertEqual(sorted([row['name'] for row in rows]),
+                         ['A new name', 'Another name'])
+        self.assertEqual(self.world.pending_saves, {})
+        # So the next flush is one batch again, not a write per model
+        updates = self.world.db.query_stats['update'][0]
+        rooms[0].name = 'A third name'
+        rooms[0].save()
+        rooms[2].name = 'A fourth name'
+        rooms[2].save()
+        self.world.flush_saves()
+        self.assertEqual(self.world.db.query_stats['update'][0] - updates, 1)
+    
+    def test_load_areas(self):
+        from shinymud.models.area import Area
+        area = Area.create({'name': 'foo'})
+        rooms = [area.new_room() for i in range(5)]
+        rooms[0].new_exit({'direction': 'north', 'to_room': rooms[1]})
+        rooms[1].new_exit({'direction': 'south', 'to_room': rooms[0]})
+        item = area.new_item()
+        item.build_add_type('container')
+        rooms[0].build_add_spawn('for item %s' % item.id)
+        script = area.new_script()
+        npc = area.new_npc()
+        npc.build_add_ai('merchant')
+        npc.build_add_event('pc_enter call script %s' % script.id)
+        
+        def count_selects():
+            self.world.areas = {}
+            selects = self.world.db.query_stats['select'][0]
+            self.world.load_areas()
+            return self.world.db.query_stats['select'][0] - selects
+        selects = count_selects()
+        self.assertEqual(self.world.db.preloaded, None)
+        # One query for the areas, and one for each table we preload --
+        # however many rooms, items and npcs there are
+        for i in range(10):
+            room = area.new_room()
+            room.new_exit({'direction': 'up', 'to_room': rooms[0]})
+            area.new_item().build_add_type('container')
+            area.new_npc().build_add_ai('merchant')
+        self.assertEqual(count_selects(), selects)
+        loaded = self.world.get_area('foo')
+        self.assertEqual(len(loaded.rooms), 15)
+        room = loaded.get_room(str(rooms[0].id))
+        self.assertEqual(room.exits['north'].to_room.id, rooms[1].id)
+        self.assertEqual(len(room.spawns), 1)
+        self.assertTrue('container' in loaded.get_item(str(item.id)).item_types)
+        loaded_npc = loaded.get_npc(str(npc.id))
+        self.assertTrue('merchant' in loaded_npc.ai_packs)
+        self.assertEqual(loaded_npc.events.keys(), ['pc_enter'])
@@ -3,4 +3,37 @@ from shinytest import ShinyTestCase
 class TestItem(ShinyTestCase):    
     def test_something(self):
         pass
-
+    
+    def test_save_changed_columns(self):
+        from shinymud.models.area import Area
+        from shinymud.models.item import BuildItem
+        area = Area.create({'name': 'foo'})
+        item = area.new_item()
+        updates = []
+        update_from_dict = self.world.db.update_from_dict
+        def record(table, d):
+            updates.append(d)
+            return update_from_dict(table, d)
+        self.world.db.update_from_dict = record
+        # Nothing has changed, so there's nothing to write
+        item.save()
+        self.assertEqual(updates, [])
+        item.weight = 5
+        item.save()
+        self.assertEqual(updates, [{'dbid': item.dbid, 'weight': 5}])
+        # Setting a column to what it already was doesn't count as a change
+        item.weight = 5
+        item.save()
+        self.assertEqual(len(updates), 1)
+        # Lists changed in place get noticed too
+        item.keywords.append('shiny')
+        item.save()
+        self.assertEqual(sorted(updates[-1].keys()), ['dbid', 'keywords'])
+        # Items loaded from the database know what's in it already
+        row = self.world.db.select('* FROM build_item WHERE dbid=?', [item.dbid])[0]
+        row['area'] = area
+        loaded = BuildItem(row)
+        loaded.save()
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(loaded.keywords, item.keywords)
+        self.assertEqual(loaded.weight, 5)
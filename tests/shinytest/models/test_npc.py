@@ -196,3 +196,26 @@ class TestNpc(ShinyTestCase):
 
 
 
+    
+    def test_active_npcs(self):
+        """Make sure an npc is only ticked once per turn, no matter how many
+        times it is subscribed, and is dropped once its cmdq is empty."""
+        proto = self.area.new_npc()
+        proto.characterize({'name': 'bobert'})
+        npc = proto.load()
+        self.room.add_char(npc)
+        # bob has no real connection to tick
+        self.world.player_list = {}
+        npc.perform('say one')
+        npc.perform('say two')
+        npc.perform('say three')
+        self.assertEqual(len(self.world.active_npcs), 1)
+        self.world.turn()
+        self.assertEqual(len(npc.cmdq), 2)
+        self.assertTrue(npc in self.world.active_npcs)
+        self.world.turn()
+        self.world.turn()
+        self.assertEqual(len(npc.cmdq), 0)
+        self.assertFalse(npc in self.world.active_npcs)
+        self.assertEqual(list(self.world.tick_stats.counters['npcs ticked']),
+                         [1, 1, 1])
@@ -9,3 +9,141 @@ class TestPlayer(ShinyTestCase):
     def test_something(self):
         pass
     
+    def make_player(self, name):
+        from shinymud.models.player import Player
+        player = Player(('foo', 'bar'))
+        player.mode = None
+        player.playerize({'name': name, 'password': 'pork'})
+        player.outq = []
+        return player
+    
+    def test_command_budget(self):
+        from shinymud.data.config import PLAYER_CMD_BUDGET
+        bob = self.make_player('bob')
+        bob.inq = ['say hi'] * (PLAYER_CMD_BUDGET + 2)
+        bob.parse_command()
+        # Only a turn's worth of commands run; the rest wait for next turn
+        self.assertEqual(len(bob.inq), 2)
+        bob.parse_command()
+        self.assertEqual(len(bob.inq), 2)
+        bob.commands_left = PLAYER_CMD_BUDGET
+        bob.parse_command()
+        self.assertEqual(bob.inq, [])
+    
+    def test_input_after_negotiation(self):
+        import socket
+        from shinymud.models.player import Player
+        from shinymud.lib.connection_handlers.shiny_connections import \
+             TelnetConnection, WebsocketConnection
+        from shinymud.lib.connection_handlers.websocket_frames import \
+             encode_frame, TEXT
+        # The client's last answer and its first line arrive together
+        server, client = socket.socketpair()
+        player = Player(TelnetConnection((server, 'test'), self.world.log))
+        client.send('\xff\xfe\x22\xff\xfc\x1f\xff\xfe\x56\xff\xfe\xc9bob\r\n')
+        self.assertTrue(player.get_input())
+        self.assertEqual(player.inq, ['bob'])
+        
+        # Likewise a websocket client's handshake and first frame
+        server, client = socket.socketpair()
+        player = Player(WebsocketConnection((server, 'test'), self.world.log,
+                                            'localhost', 4112))
+        client.send('GET / HTTP/1.1\r\nUpgrade: websocket\r\n'
+                    'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+                    'Sec-WebSocket-Version: 13\r\n\r\n' +
+                    encode_frame(TEXT, 'bob', mask='abcd'))
+        self.assertTrue(player.get_input())
+        self.assertEqual(player.inq, ['bob'])
+    
+    def test_flood_control(self):
+        from shinymud.data.config import FLOOD_BURST, FLOOD_STRIKES, \
+             INPUT_QUEUE_MAX
+        from shinymud.lib.rate_limit import TokenBucket
+        bob = self.make_player('bob')
+        bob.queue_input(['look'] * 5)
+        self.assertEqual(len(bob.inq), 5)
+        self.assertEqual(bob.outq, [])
+        # A queue that's already full doesn't take any more
+        bob.inq = ['look'] * INPUT_QUEUE_MAX
+        bob.queue_input(['look'])
+        self.assertEqual(len(bob.inq), INPUT_QUEUE_MAX)
+        self.assertTrue('too fast' in bob.outq[-1])
+        
+        # Keep flooding, and you get disconnected
+        bob.inq = []
+        bob.input_bucket = TokenBucket(0, FLOOD_BURST)
+        for i in range(FLOOD_STRIKES):
+            bob.queue_input(['look'] * (FLOOD_BURST + 1))
+            self.assertFalse(bob.quit_flag)
+        self.assertEqual(len(bob.inq), FLOOD_BURST)
+        bob.queue_input(['look'])
+        self.assertTrue(bob.quit_flag)
+        self.assertTrue('disconnected' in bob.outq[-1])
+        
+        # Pasting a long description into the text editor is fine, though
+        from shinymud.data.config import EDITOR_QUEUE_MAX
+        from shinymud.modes.text_edit_mode import TextEditMode
+        sue = self.make_player('sue')
+        sue.mode = TextEditMode(sue, self.area, 'description', '')
+        sue.run_mode()
+        sue.input_bucket = TokenBucket(0, 2)
+        sue.queue_input(['Some text.'] * INPUT_QUEUE_MAX * 2 + ['@done'] +
+                        ['look'] * 10)
+        self.assertEqual(len(sue.inq), INPUT_QUEUE_MAX * 2 + 11)
+        self.assertFalse(sue.quit_flag)
+        # The whole paste is taken in one go; the lines after @done are
+        # commands, and are limited like any others
+        sue.run_mode()
+        self.assertEqual(sue.mode, None)
+        self.assertEqual(sue.inq, ['look'] * 2)
+        self.assertTrue('too fast' in sue.outq[-1])
+        # And even the editor only holds so much
+        sue.mode = TextEditMode(sue, self.area, 'description', '')
+        sue.inq = []
+        sue.queue_input(['Some text.'] * (EDITOR_QUEUE_MAX + 1))
+        self.assertEqual(len(sue.inq), EDITOR_QUEUE_MAX)
+    
+    
+    def test_prompt(self):
+        from shinymud.modes.build_mode import BuildMode
+        bob = self.make_player('bob')
+        self.assertEqual(bob.get_prompt(), '<HP:20/20 MP:5/5> ')
+        prompt = bob.get_prompt()
+        # Nothing has changed, so the prompt doesn't get rebuilt...
+        self.assertTrue(bob.get_prompt() is prompt)
+        # ...until something it shows does
+        bob.hp = 12
+        self.assertEqual(bob.get_prompt(), '<HP:12/20 MP:5/5> ')
+        bob.mode = BuildMode(bob)
+        self.assertEqual(bob.get_prompt(), '<Build> ')
+        bob.mode.edit_area = self.area
+        self.assertEqual(bob.get_prompt(), '<Build boo> ')
+        room = self.area.new_room()
+        bob.mode.edit_object = room
+        self.assertEqual(bob.get_prompt(), '<Build boo Room %s> ' % room.id)
+        bob.mode = None
+        bob.enqueue_prompt()
+        self.assertEqual(bob.outq, ['<HP:12/20 MP:5/5> '])
+    
+    def test_send_status(self):
+        class FakeConn(object):
+            gmcp = True
+            def __init__(self):
+                self.status = []
+            def send_status(self, package, data):
+                self.status.append((package, data))
+        bob = self.make_player('bob')
+        bob.conn = FakeConn()
+        bob.send_status()
+        self.assertEqual(bob.conn.status, [('Char.Vitals', {'hp': 20, 'maxhp': 20,
+                                                            'mp': 5, 'maxmp': 5})])
+        # Vitals only get sent again once they've changed
+        bob.send_status()
+        self.assertEqual(len(bob.conn.status), 1)
+        bob.mp = 2
+        bob.send_status()
+        self.assertEqual(bob.conn.status[-1][1]['mp'], 2)
+        bob.conn.gmcp = False
+        bob.hp = 1
+        bob.send_status()
+        self.assertEqual(len(bob.conn.status), 2)